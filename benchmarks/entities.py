@@ -0,0 +1,129 @@
+"""
+Compares the entity helpers in `taipo.common` against their original
+implementations on a corpus built from `data/nlu-entities.yml`.
+
+Usage:
+
+```
+python benchmarks/entities.py --n-examples 100000
+```
+"""
+import time
+import random
+
+import typer
+import pandas as pd
+from parse import compile as parse_compile
+
+from taipo.common import (
+    nlu_path_to_dataframe,
+    entity_names,
+    curly_entity_items,
+    replace_ent_assignment,
+)
+
+
+def legacy_entity_names(rasa_strings):
+    r = parse_compile("({entity})")
+    results = [list(r.findall(s)) for s in rasa_strings]
+    flat_results = [item for sublist in results for item in sublist]
+    if len(flat_results) == 0:
+        return []
+    uniq = pd.DataFrame([_.named for _ in flat_results])["entity"].unique()
+    return list(uniq)
+
+
+def legacy_gen_curly_ents(text):
+    while text.find("[") != -1:
+        sq1 = text.find("[")
+        sq2 = text[sq1:].find("]")
+        br1 = text[sq1 + sq2 :].find("{")
+        br2 = text[sq1 + sq2 + br1 :].find("}")
+        ent = text[sq1 : sq1 + sq2 + 1]
+        curly_bit = text[sq1 + sq2 + br1 : sq1 + sq2 + br1 + br2 + 1]
+        yield ent, curly_bit
+        if curly_bit != "":
+            text = text[sq1 + sq2 + br1 + br2 :]
+        else:
+            text = text[sq1 + sq2 :]
+
+
+def legacy_curly_entity_items(texts):
+    results = []
+    for text in texts:
+        for ent, curly in legacy_gen_curly_ents(text):
+            cleaned = (
+                curly.replace(":", " ")
+                .replace("{", "")
+                .replace("}", "")
+                .replace(",", " ")
+                .split(" ")
+            )
+            for item in cleaned:
+                if item != "":
+                    results.append(item)
+    return list(set(results))
+
+
+def legacy_replace_ent_assignment(texts):
+    parser = parse_compile("[{entity}]({ent_name})")
+    results = []
+    for t in texts:
+        for found in [_.named for _ in parser.findall(t)]:
+            t = t.replace(f"[{found['entity']}]", found["entity"])
+            t = t.replace(f"({found['ent_name']})", "")
+        results.append(t)
+    return results
+
+
+def make_corpus(path, n_examples, seed):
+    """
+    Samples texts from an nlu file and rewrites a third of the `(entity)`
+    annotations into the `{...}` form so both kinds of markup are present.
+    """
+    rng = random.Random(seed)
+    texts = list(nlu_path_to_dataframe(path)["text"])
+    corpus = []
+    for _ in range(n_examples):
+        text = rng.choice(texts)
+        if rng.random() < 0.33:
+            text = text.replace("](proglang)", "]{entity:proglang, role:lang}")
+        corpus.append(text)
+    return corpus
+
+
+def best_of(func, texts, repeat):
+    timings = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func(texts)
+        timings.append(time.perf_counter() - tic)
+    return min(timings)
+
+
+def main(
+    path: str = typer.Option("data/nlu-entities.yml", help="File to sample from."),
+    n_examples: int = typer.Option(100_000, help="Number of texts in the corpus."),
+    repeat: int = typer.Option(3, help="Number of timings to take the best of."),
+    seed: int = typer.Option(42, help="Seed for sampling the corpus."),
+):
+    """Times every entity helper against its original implementation."""
+    texts = make_corpus(path, n_examples, seed)
+    pairs = [
+        ("entity_names", legacy_entity_names, entity_names),
+        ("curly_entity_items", legacy_curly_entity_items, curly_entity_items),
+        (
+            "replace_ent_assignment",
+            legacy_replace_ent_assignment,
+            replace_ent_assignment,
+        ),
+    ]
+    typer.echo(f"{'helper':<24}{'legacy':>10}{'scanner':>10}{'speedup':>10}")
+    for name, legacy, current in pairs:
+        old = best_of(legacy, texts, repeat)
+        new = best_of(current, texts, repeat)
+        typer.echo(f"{name:<24}{old:>9.3f}s{new:>9.3f}s{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    typer.run(main)
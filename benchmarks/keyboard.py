@@ -0,0 +1,42 @@
+"""
+Compares the native typo engine against nlpaug's `KeyboardAug` as used by
+`taipo keyboard augment`.
+
+Usage:
+
+```
+python benchmarks/keyboard.py --n-examples 100000
+```
+"""
+import time
+import random
+
+import typer
+
+from taipo.common import nlu_path_to_dataframe
+from taipo.cli.keyboard import add_spelling_errors, make_augmenter
+
+
+def main(
+    path: str = typer.Option("data/nlu-orig.yml", help="File to sample from."),
+    n_examples: int = typer.Option(100_000, help="Number of examples to augment."),
+    lang: str = typer.Option("en", help="Language for keyboard layout."),
+    seed: int = typer.Option(42, help="Seed for sampling and augmenting."),
+):
+    """Times both engines on the same sample of examples."""
+    dataf = nlu_path_to_dataframe(path)
+    rows = random.Random(seed).choices(range(len(dataf)), k=n_examples)
+    dataf = dataf.iloc[rows].reset_index(drop=True)
+
+    timings = {}
+    for engine in ["nlpaug", "native"]:
+        aug = make_augmenter(engine=engine, char_max=3, word_max=3, lang=lang)
+        tic = time.perf_counter()
+        add_spelling_errors(dataf, aug=aug, seed=seed)
+        timings[engine] = time.perf_counter() - tic
+        typer.echo(f"{engine:<8}{timings[engine]:>9.2f}s")
+    typer.echo(f"speedup {timings['nlpaug'] / timings['native']:>9.1f}x")
+
+
+if __name__ == "__main__":
+    typer.run(main)
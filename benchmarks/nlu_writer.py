@@ -0,0 +1,82 @@
+"""
+Compares `dataframe_to_nlu_file` against the original single `yaml.dump` writer.
+
+Usage:
+
+```
+python benchmarks/nlu_writer.py --n-examples 1000000
+```
+"""
+import time
+import random
+import pathlib
+import tempfile
+
+import typer
+import yaml
+import pandas as pd
+
+from taipo.common import dataframe_to_nlu_file
+
+
+def legacy_dataframe_to_nlu_file(
+    dataf, write_path, text_col="text", label_col="intent"
+):
+    """The writer as it was before it started streaming, kept as a reference."""
+    result = {"version": str(2.0), "nlu": []}
+    for idx, group in dataf.groupby(label_col):
+        intent = group[label_col].iloc[0]
+        result["nlu"].append(
+            {
+                "intent": intent,
+                "examples": [t for t in group[text_col]],
+            }
+        )
+    dump = (
+        yaml.dump(result, sort_keys=False, width=1000, allow_unicode=True)
+        .replace("examples:", "examples: |")
+        .replace("  -", "   -")
+    )
+    return pathlib.Path(write_path).write_text(dump)
+
+
+def make_dataframe(n_examples, n_intents, seed):
+    """Generates a reproducible dataframe with mostly plain but some quoted texts."""
+    rng = random.Random(seed)
+    words = ["book", "a", "flight", "to", "[berlin](city)", "please", "what's", "my"]
+    words += ["balance", "how", "do", "i", "reset", "pin?", "yes", "2021", "#1"]
+    texts = [
+        " ".join(rng.choice(words) for _ in range(rng.randint(1, 12)))
+        for _ in range(n_examples)
+    ]
+    intents = [f"intent_{rng.randrange(n_intents)}" for _ in range(n_examples)]
+    return pd.DataFrame({"text": texts, "intent": intents})
+
+
+def main(
+    n_examples: int = typer.Option(1_000_000, help="Number of examples to write."),
+    n_intents: int = typer.Option(150, help="Number of distinct intents."),
+    seed: int = typer.Option(42, help="Seed for the generated examples."),
+    skip_legacy: bool = typer.Option(False, help="Only time the streaming writer."),
+):
+    """Times both writers on the same dataframe and checks the outputs match."""
+    dataf = make_dataframe(n_examples, n_intents, seed)
+    with tempfile.TemporaryDirectory() as folder:
+        new_path = pathlib.Path(folder) / "streaming.yml"
+        tic = time.perf_counter()
+        dataframe_to_nlu_file(dataf, write_path=new_path)
+        typer.echo(f"streaming writer: {time.perf_counter() - tic:.2f}s")
+        if skip_legacy:
+            return
+        old_path = pathlib.Path(folder) / "legacy.yml"
+        tic = time.perf_counter()
+        legacy_dataframe_to_nlu_file(dataf, write_path=old_path)
+        typer.echo(f"legacy writer:    {time.perf_counter() - tic:.2f}s")
+        identical = new_path.read_bytes() == old_path.read_bytes()
+        typer.echo(f"identical output: {identical}")
+        if not identical:
+            raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
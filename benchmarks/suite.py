@@ -0,0 +1,322 @@
+"""
+Times the hot paths of taipo on synthetic corpora and compares the timings against
+a stored baseline, so that a change that makes one of them slower is caught.
+
+The corpora are generated from a seed, so every run times the same examples and
+no data has to be downloaded. Every benchmark runs at the sizes of `--sizes` up to
+its own maximum, the slow end-to-end commands stop before the larger sizes.
+
+Usage:
+
+```
+python benchmarks/suite.py run --output results.json
+python benchmarks/suite.py run --sizes 1000 --sizes 10000 --bench entity_names
+python benchmarks/suite.py compare benchmarks/baseline.json results.json
+```
+
+`make benchmark` runs all of them and compares against `benchmarks/baseline.json`.
+That baseline is timed on Python 3.8, the version that CI tests with. Timings are
+only compared when they were made with the same version of Python as the baseline,
+run `python benchmarks/suite.py run --output benchmarks/baseline.json` to record a
+new baseline for another version.
+"""
+import re
+import json
+import time
+import random
+import pathlib
+import platform
+import statistics
+import tempfile
+from typing import List
+
+import typer
+import pandas as pd
+
+from taipo.common import (
+    nlu_path_to_dataframe,
+    dataframe_to_nlu_file,
+    entity_names,
+    curly_entity_items,
+    replace_ent_assignment,
+)
+
+
+app = typer.Typer(
+    name="suite",
+    add_completion=False,
+    help="Benchmarks the hot paths of taipo.",
+)
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+ENTITIES = ["city", "proglang", "product", "person", "date"]
+
+CYRILLIC = "абвгдежзийклмнопрстуфхцчшщыэюя"
+
+
+def make_words(n_words, rng, alphabet="abcdefghijklmnopqrstuvwxyz"):
+    """A vocabulary of made up words with the length distribution of English."""
+    return [
+        "".join(rng.choices(alphabet, k=rng.choice([2, 3, 4, 4, 5, 5, 6, 7, 8, 10])))
+        for _ in range(n_words)
+    ]
+
+
+def make_corpus(n_examples, seed=42, n_intents=50, alphabet=None):
+    """
+    A dataframe with `n_examples` nlu examples spread over `n_intents` intents.
+    About a third of the examples has an entity annotation, a quarter of those is
+    written in the `{"entity": ...}` form with a role.
+    """
+    rng = random.Random(seed)
+    words = make_words(5_000, rng, **({"alphabet": alphabet} if alphabet else {}))
+    intents = [f"intent_{i}" for i in range(n_intents)]
+    texts = []
+    for _ in range(n_examples):
+        tokens = rng.choices(words, k=rng.randint(3, 14))
+        if rng.random() < 0.33:
+            i, entity = rng.randrange(len(tokens)), rng.choice(ENTITIES)
+            if rng.random() < 0.25:
+                markup = f'{{"entity": "{entity}", "role": "from"}}'
+            else:
+                markup = f"({entity})"
+            tokens[i] = f"[{tokens[i]}]{markup}"
+        if rng.random() < 0.2:
+            tokens[-1] += rng.choice("?!.")
+        texts.append(" ".join(tokens))
+    return pd.DataFrame({"intent": rng.choices(intents, k=n_examples), "text": texts})
+
+
+def write_corpus(folder, n_examples, seed):
+    path = pathlib.Path(folder) / f"nlu-{n_examples}.yml"
+    if not path.exists():
+        dataframe_to_nlu_file(make_corpus(n_examples, seed), write_path=path)
+    return path
+
+
+def invoke(*args):
+    """Runs a taipo command in this process and fails when it fails."""
+    from typer.testing import CliRunner
+    from taipo.__main__ import app as taipo_app
+
+    result = CliRunner().invoke(taipo_app, [str(a) for a in args])
+    if result.exit_code != 0:
+        raise RuntimeError(f"taipo {' '.join(map(str, args))} failed:\n{result.output}")
+
+
+# Every benchmark gets the number of examples, the seed and a scratch folder. It
+# returns a function without arguments that runs the part that is timed.
+
+
+def bench_nlu_path_to_dataframe(n_examples, seed, folder):
+    path = write_corpus(folder, n_examples, seed)
+    return lambda: nlu_path_to_dataframe(path)
+
+
+def bench_dataframe_to_nlu_file(n_examples, seed, folder):
+    dataf = make_corpus(n_examples, seed)
+    path = pathlib.Path(folder) / "written.yml"
+    return lambda: dataframe_to_nlu_file(dataf, write_path=path)
+
+
+def bench_entity_names(n_examples, seed, folder):
+    texts = list(make_corpus(n_examples, seed)["text"])
+    return lambda: entity_names(texts)
+
+
+def bench_curly_entity_items(n_examples, seed, folder):
+    texts = list(make_corpus(n_examples, seed)["text"])
+    return lambda: curly_entity_items(texts)
+
+
+def bench_replace_ent_assignment(n_examples, seed, folder):
+    texts = list(make_corpus(n_examples, seed)["text"])
+    return lambda: replace_ent_assignment(texts)
+
+
+def bench_translitor_translit(n_examples, seed, folder):
+    from taipo.cli.translit import Translitor
+
+    texts = list(make_corpus(n_examples, seed, alphabet=CYRILLIC)["text"])
+    tl = Translitor(lang="ru", reversed=True, ents=ENTITIES)
+    return lambda: [tl.translit(t) for t in texts]
+
+
+def bench_custom_reverse_tokenizer(n_examples, seed, folder):
+    from taipo.cli.keyboard import custom_reverse_tokenizer
+
+    texts = replace_ent_assignment(list(make_corpus(n_examples, seed)["text"]))
+    token_lists = [re.findall(r"\w+|[^\w\s]", t) for t in texts]
+    return lambda: [custom_reverse_tokenizer(tokens) for tokens in token_lists]
+
+
+def bench_keyboard_augment(n_examples, seed, folder):
+    path = write_corpus(folder, n_examples, seed)
+    out = pathlib.Path(folder) / "typos.yml"
+    return lambda: invoke("keyboard", "augment", path, out, "--seed-aug", seed)
+
+
+def bench_confirm_logistic(n_examples, seed, folder):
+    path = write_corpus(folder, n_examples, seed)
+    out = pathlib.Path(folder) / "checkthese.csv"
+    return lambda: invoke("confirm", "logistic", path, out)
+
+
+# The name of every benchmark, with its function and the largest size it runs at.
+BENCHMARKS = {
+    "nlu_path_to_dataframe": (bench_nlu_path_to_dataframe, 1_000_000),
+    "dataframe_to_nlu_file": (bench_dataframe_to_nlu_file, 1_000_000),
+    "entity_names": (bench_entity_names, 1_000_000),
+    "curly_entity_items": (bench_curly_entity_items, 1_000_000),
+    "replace_ent_assignment": (bench_replace_ent_assignment, 1_000_000),
+    "translitor_translit": (bench_translitor_translit, 100_000),
+    "custom_reverse_tokenizer": (bench_custom_reverse_tokenizer, 1_000_000),
+    "keyboard_augment": (bench_keyboard_augment, 100_000),
+    "confirm_logistic": (bench_confirm_logistic, 100_000),
+}
+
+
+def time_benchmark(name, n_examples, seed, repeat, folder):
+    """
+    Runs a benchmark `repeat` times and returns the timings in seconds. One run
+    before them isn't timed, so imports and caches that fill on the first call
+    don't show up as a slowdown.
+    """
+    func = BENCHMARKS[name][0](n_examples, seed, folder)
+    func()
+    timings = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - tic)
+    return timings
+
+
+@app.command()
+def run(
+    output: pathlib.Path = typer.Option(
+        "benchmark-results.json", help="File to write the timings to."
+    ),
+    sizes: List[int] = typer.Option(SIZES, help="Number of examples to time with."),
+    bench: List[str] = typer.Option(None, help="Only run these benchmarks."),
+    repeat: int = typer.Option(3, help="Number of times to run every benchmark."),
+    seed: int = typer.Option(42, help="Seed for the synthetic corpora."),
+    baseline: pathlib.Path = typer.Option(
+        None, help="Baseline file to compare the timings with."
+    ),
+    threshold: float = typer.Option(
+        1.25, help="Slowdown compared to the baseline that counts as a regression."
+    ),
+):
+    """Times the benchmarks and writes the timings to a json file."""
+    unknown = set(bench or []) - set(BENCHMARKS)
+    if unknown:
+        typer.echo(f"Error! Unknown benchmarks {sorted(unknown)}.")
+        raise typer.Exit(1)
+    # A baseline of another Python can't be compared, so fail before timing anything.
+    if baseline is not None:
+        version = ".".join(platform.python_version_tuple()[:2])
+        check_python_version(json.loads(baseline.read_text()), version)
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for name, (_, max_size) in BENCHMARKS.items():
+            if bench and name not in bench:
+                continue
+            for n_examples in sorted(s for s in sizes if s <= max_size):
+                # The biggest corpora are only timed once, they take long enough.
+                times = repeat if n_examples < 1_000_000 else 1
+                timings = time_benchmark(name, n_examples, seed, times, folder)
+                key = f"{name}[{n_examples}]"
+                results[key] = {
+                    "min": min(timings),
+                    "median": statistics.median(timings),
+                    "repeat": times,
+                }
+                typer.echo(f"{key:<40}{min(timings):>10.3f}s")
+    report = {
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "seed": seed,
+        "results": results,
+    }
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    typer.echo(f"Wrote {len(results)} timings to {output}.")
+    if baseline is not None:
+        compare(baseline, output, threshold, min_delta=0.005)
+
+
+def python_version(report):
+    """The major and minor version of Python that the timings were made with."""
+    return ".".join(report["machine"]["python"].split(".")[:2])
+
+
+def check_python_version(baseline, version):
+    """
+    Exits with an error when the `baseline` was timed on another major and minor
+    version of Python than `version`, which runs the same code at another speed.
+    """
+    if python_version(baseline) != version:
+        typer.echo(
+            f"Error! The baseline was timed on Python {python_version(baseline)} "
+            f"and the new timings on Python {version}, record a baseline with the "
+            "same version to compare them."
+        )
+        raise typer.Exit(1)
+
+
+def compare_results(baseline, results, threshold, min_delta=0.005):
+    """
+    The rows of a comparison between two result files and the names of the
+    benchmarks that got slower than `threshold` times their baseline. Only the
+    benchmarks that are in both files are compared, and a benchmark that is less
+    than `min_delta` seconds slower never counts, to ignore timer noise.
+    """
+    rows, regressions = [], []
+    for key, timing in results["results"].items():
+        if key not in baseline["results"]:
+            rows.append((key, None, timing["min"], None))
+            continue
+        before = baseline["results"][key]["min"]
+        ratio = timing["min"] / before if before else float("inf")
+        rows.append((key, before, timing["min"], ratio))
+        if ratio > threshold and timing["min"] - before > min_delta:
+            regressions.append(key)
+    return rows, regressions
+
+
+@app.command()
+def compare(
+    baseline: pathlib.Path = typer.Argument(..., help="The stored baseline timings."),
+    results: pathlib.Path = typer.Argument(..., help="The new timings."),
+    threshold: float = typer.Option(
+        1.25, help="Slowdown compared to the baseline that counts as a regression."
+    ),
+    min_delta: float = typer.Option(
+        0.005, help="Seconds a benchmark has to be slower to count as a regression."
+    ),
+):
+    """Compares timings against a baseline, exits with 1 when one got slower."""
+    baseline, results = json.loads(baseline.read_text()), json.loads(
+        results.read_text()
+    )
+    check_python_version(baseline, python_version(results))
+    rows, regressions = compare_results(baseline, results, threshold, min_delta)
+    typer.echo(f"{'benchmark':<40}{'baseline':>10}{'new':>10}{'ratio':>8}")
+    for key, before, after, ratio in rows:
+        if ratio is None:
+            typer.echo(f"{key:<40}{'-':>10}{after:>9.3f}s{'new':>8}")
+            continue
+        flag = "  slower" if key in regressions else ""
+        typer.echo(f"{key:<40}{before:>9.3f}s{after:>9.3f}s{ratio:>7.2f}x{flag}")
+    if regressions:
+        typer.echo(f"{len(regressions)} benchmarks got more than {threshold}x slower.")
+        raise typer.Exit(1)
+    typer.echo("No regressions.")
+
+
+if __name__ == "__main__":
+    app()
@@ -8,12 +8,13 @@ base_packages = [
     "numpy>=1.18.5",
     "typer==0.3.2",
     "nlpaug>=1.1.4",
-    "parse>=1.19.0",
     "clumper>=0.2.15",
     "transliterate>=1.10.2",
     "rich>=10.4.0",
 ]
 
+arrow_packages = ["pyarrow>=4.0.0"]
+
 dev_packages = [
     "flake8>=3.6.0",
     "black>=19.10b0",
@@ -21,6 +22,9 @@ dev_packages = [
     "pytype>=2020.0.0",
     "pytest>=4.0.2",
     "pytest-xdist==1.32.0",
+    "parse>=1.19.0",
+    "hypothesis>=6.0.0",
+    "pyarrow>=4.0.0",
     "mkdocs==1.1",
     "mkdocs-material==5.4.0",
     "mkdocstrings==0.8.0",
@@ -32,8 +36,10 @@ setup(
     name="taipo",
     version="0.0.6",
     packages=find_packages(exclude=["notebooks", "data"]),
+    package_data={"taipo": ["res/keyboard/*.json"]},
     install_requires=base_packages,
     extras_require={
+        "arrow": arrow_packages,
         "dev": dev_packages,
     },
 )
@@ -1,15 +1,45 @@
 import pathlib
+import importlib
 
+import click
 import typer
 
-from taipo.cli.keyboard import app as keyboard_app
-from taipo.cli.translit import app as translit_app
-from taipo.cli.util import app as util_app
-from taipo.cli.confirm import app as confirm_app
+
+class LazyGroup(click.Group):
+    """
+    Click group that only imports the module behind a subcommand once that
+    subcommand is used, so `taipo util ...` never pays for Rasa or TensorFlow.
+    """
+
+    subcommands = {
+        "keyboard": ("taipo.cli.keyboard", "Commands to simulate keyboard typos."),
+        "translit": ("taipo.cli.translit", "Commands to generate transliterations."),
+        "confirm": ("taipo.cli.confirm", "Confirm labels inside of nlu.yml files."),
+        "pipeline": (
+            "taipo.cli.pipeline",
+            "Generate train/validation data for many augmenters at once.",
+        ),
+        "util": ("taipo.cli.util", "Some utility commands."),
+    }
+
+    def list_commands(self, ctx):
+        return sorted(self.subcommands)
+
+    def get_command(self, ctx, name):
+        if name not in self.subcommands:
+            return None
+        module = importlib.import_module(self.subcommands[name][0])
+        return typer.main.get_command(module.app)
+
+    def format_commands(self, ctx, formatter):
+        rows = [(name, self.subcommands[name][1]) for name in self.list_commands(ctx)]
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
 
 
 app = typer.Typer(
     name="taipo",
+    cls=LazyGroup,
     add_completion=False,
     help="""
     This app contains tools for data quality in Rasa. It can generate
@@ -18,10 +48,24 @@ app = typer.Typer(
     """,
 )
 
-app.add_typer(keyboard_app, name="keyboard")
-app.add_typer(translit_app, name="translit")
-app.add_typer(confirm_app, name="confirm")
-app.add_typer(util_app, name="util")
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    profile: bool = typer.Option(
+        False, help="Print the time and memory that every stage of a command takes"
+    ),
+    profile_json: pathlib.Path = typer.Option(
+        None, help="Also write the profile of the stages to this json file"
+    ),
+    profile_stats: pathlib.Path = typer.Option(
+        None, help="Also write a cProfile stats file for use with pstats"
+    ),
+):
+    if profile or profile_json or profile_stats:
+        from taipo.profiling import start_profiling
+
+        ctx.call_on_close(start_profiling(profile_json, profile_stats))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+"""
+A content addressed cache for augmented examples, stored in a single sqlite file.
+"""
+import json
+import sqlite3
+import hashlib
+import pathlib
+import contextlib
+
+import typer
+
+
+# Number of keys to look up per query, sqlite limits the number of parameters.
+_CHUNK_SIZE = 500
+
+
+class AugmentationCache:
+    """
+    Remembers augmented examples on disk. Every example is stored under a hash of
+    its text, intent, the augmenter config, the seed and which variant it is, so
+    only examples that are new or edited need to be augmented again.
+
+    When the cache holds more than `max_entries` examples or `max_mb` megabytes of
+    text, the least recently used examples are evicted on `close`.
+
+    Usage:
+
+    ```python
+    from taipo.cache import AugmentationCache
+
+    with AugmentationCache("taipo-cache.db") as cache:
+        key = cache.key("hello there", "greet", config={"lang": "en"}, seed=42)
+        cache.put_many({key: "hwllo there"})
+        cache.get_many([key])
+    ```
+    """
+
+    def __init__(self, path, max_entries=1_000_000, max_mb=512):
+        self.path = pathlib.Path(path)
+        self.max_entries = max_entries
+        self.max_mb = max_mb
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS examples ("
+            "key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used INTEGER)"
+        )
+        # Everything used during this session shares one tick, older ticks go first.
+        (last,) = self.conn.execute("SELECT MAX(last_used) FROM examples").fetchone()
+        self.tick = (last or 0) + 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def key(text, intent, config, seed, variant=0):
+        """Hashes everything that determines the augmented version of an example."""
+        blob = json.dumps([text, intent, config, seed, variant], sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """Returns a dictionary with the cached values of the `keys` that are known."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for i in range(0, len(keys), _CHUNK_SIZE):
+            chunk = keys[i : i + _CHUNK_SIZE]
+            marks = ",".join("?" * len(chunk))
+            found.update(
+                self.conn.execute(
+                    f"SELECT key, value FROM examples WHERE key IN ({marks})", chunk
+                )
+            )
+            self.conn.execute(
+                f"UPDATE examples SET last_used = ? WHERE key IN ({marks})",
+                [self.tick, *chunk],
+            )
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Stores a dictionary of keys and augmented values."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO examples VALUES (?, ?, ?, ?)",
+            [(k, v, len(v.encode("utf-8")), self.tick) for k, v in items.items()],
+        )
+
+    def evict(self):
+        """Drops the least recently used examples until the cache fits its limits."""
+        cursor = self.conn.execute(
+            "DELETE FROM examples WHERE key IN ("
+            " SELECT key FROM ("
+            "  SELECT key,"
+            "   ROW_NUMBER() OVER (ORDER BY last_used DESC, rowid DESC) AS n,"
+            "   SUM(size) OVER (ORDER BY last_used DESC, rowid DESC) AS total"
+            "  FROM examples"
+            " ) WHERE n > ? OR total > ?"
+            ")",
+            (self.max_entries, int(self.max_mb * 1024 * 1024)),
+        )
+        self.evicted += cursor.rowcount
+
+    def close(self):
+        self.evict()
+        self.conn.commit()
+        self.conn.close()
+
+    def summary(self):
+        """A single line with the hit and miss statistics."""
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (
+            f"Cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), "
+            f"{self.evicted} evicted."
+        )
+
+
+def cached_augment(
+    dataf,
+    augment,
+    cache,
+    config,
+    seed,
+    n_variants=1,
+    text_col="text",
+    label_col="intent",
+    deterministic=False,
+):
+    """
+    Augments a dataframe `n_variants` times, but only the rows that are not in
+    `cache` yet. The `augment` function receives a dataframe with the rows that are
+    missing and needs to return `n_variants` augmented copies of it. Returns the
+    list of augmented copies of all of `dataf`.
+
+    Without a `seed` every run gives other examples, so the cache is skipped unless
+    the augmenter is `deterministic` and always gives the same examples.
+    """
+    if seed is None and not deterministic:
+        return list(augment(dataf))
+    texts, intents = dataf[text_col].tolist(), dataf[label_col].tolist()
+    # The config can be large, it is hashed once instead of once per example.
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+    keys = [
+        [cache.key(t, i, digest, seed, variant) for t, i in zip(texts, intents)]
+        for variant in range(n_variants)
+    ]
+    found = cache.get_many(k for variant_keys in keys for k in variant_keys)
+    missing = [
+        any(variant_keys[idx] not in found for variant_keys in keys)
+        for idx in range(len(texts))
+    ]
+    if any(missing):
+        fresh = augment(dataf[missing])
+        for variant_keys, variant in zip(keys, fresh):
+            new = dict(
+                zip(
+                    (k for k, m in zip(variant_keys, missing) if m),
+                    variant[text_col].tolist(),
+                )
+            )
+            cache.put_many(new)
+            found.update(new)
+    return [
+        dataf.assign(**{text_col: [found[k] for k in variant_keys]})
+        for variant_keys in keys
+    ]
+
+
+@contextlib.contextmanager
+def open_cache(path, max_entries, max_mb):
+    """
+    Opens the cache at `path` for a command and prints the statistics once it is
+    closed. Without a `path` there is no cache and `None` is given back.
+    """
+    if path is None:
+        yield None
+        return
+    with AugmentationCache(path, max_entries=max_entries, max_mb=max_mb) as cache:
+        yield cache
+    typer.echo(cache.summary())
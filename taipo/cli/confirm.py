@@ -1,5 +1,10 @@
 import os
+import time
 import warnings
+import functools
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 
 # Turn off annoying Tensorflow logs
@@ -8,18 +13,15 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 import typer
 import pathlib
 import numpy as np
-import pandas as pd
-import tensorflow as tf  # noqa
-from rich.progress import Progress
 from rich import print
-from sklearn.pipeline import make_pipeline
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.linear_model import LogisticRegression
-from rasa.cli.utils import get_validated_path
-from rasa.core.interpreter import RasaNLUInterpreter
-from rasa.model import get_model, get_model_subdirectories
 
 from taipo.common import nlu_path_to_dataframe, replace_ent_assignment
+from taipo.suggestions import (
+    SuggestionWriter,
+    suggestion_fields,
+    suggestion_rows,
+    data_fingerprint,
+)
 
 
 app = typer.Typer(
@@ -31,6 +33,11 @@ app = typer.Typer(
 
 def load_interpreter(model_path):
     """Loads a Rasa interpreter."""
+    import tensorflow as tf  # noqa
+    from rasa.cli.utils import get_validated_path
+    from rasa.core.interpreter import RasaNLUInterpreter
+    from rasa.model import get_model, get_model_subdirectories
+
     path_str = str(model_path)
     model = get_validated_path(path_str, "model")
     model_path = get_model(model)
@@ -38,77 +45,244 @@ def load_interpreter(model_path):
     return RasaNLUInterpreter(nlu_model)
 
 
+def model_fingerprint(model_path):
+    """
+    The path, modification time and size of the model file that `model_path` points
+    to. A folder points to its newest `.tar.gz` file, the way Rasa picks a model.
+    """
+    path = pathlib.Path(model_path)
+    if path.is_dir():
+        models = list(path.glob("*.tar.gz"))
+        if models:
+            path = max(models, key=lambda p: p.stat().st_ctime)
+    path = path.resolve()
+    if not path.exists():
+        return {"path": str(path), "mtime": None, "size": None}
+    stat = path.stat()
+    return {"path": str(path), "mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def parse_batch(nlu_interpreter, texts):
+    """
+    Parses a batch of texts with a Rasa NLU `Interpreter`. Each component in the
+    pipeline processes the whole batch before the next one runs, which gives the
+    same output as calling `nlu_interpreter.parse` on every text.
+    """
+    from rasa.shared.nlu.training_data.message import Message
+
+    results = [None] * len(texts)
+    messages = []
+    for idx, text in enumerate(texts):
+        if not text:
+            # Not every component can handle empty strings, `parse` skips them too.
+            results[idx] = {**nlu_interpreter.default_output_attributes(), "text": ""}
+            continue
+        data = nlu_interpreter.default_output_attributes()
+        data["text"] = text
+        messages.append((idx, Message(data=data)))
+
+    for component in nlu_interpreter.pipeline:
+        for _, message in messages:
+            component.process(message, **nlu_interpreter.context)
+
+    for idx, message in messages:
+        output = nlu_interpreter.default_output_attributes()
+        output.update(message.as_dict(only_output_properties=True))
+        results[idx] = output
+    return results
+
+
+# Every process that makes predictions holds on to its own interpreter.
+_interpreter = None
+
+
+def _load_process_interpreter(model_path, loader=load_interpreter):
+    global _interpreter
+    warnings.filterwarnings("ignore")
+    _interpreter = loader(model_path)
+
+
+def _parse_predictions(texts, top_k=1):
+    """The predicted intent of every text, with the best `top_k` of its ranking."""
+    return [
+        {
+            "name": p["intent"]["name"],
+            "confidence": p["intent"]["confidence"],
+            "ranking": [
+                (r["name"], r["confidence"]) for r in p.get("intent_ranking", [])
+            ][:top_k],
+        }
+        for p in parse_batch(_interpreter.interpreter, texts)
+    ]
+
+
+@contextlib.contextmanager
+def predict_batches(model_path, batches, workers=1, top_k=1, loader=load_interpreter):
+    """
+    Gives an iterator with the predictions of every batch, in the order of the
+    batches. With `workers` larger than one the batches are spread over processes
+    that each load their own interpreter with `loader`.
+    """
+    parse = functools.partial(_parse_predictions, top_k=top_k)
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_load_process_interpreter,
+            initargs=(model_path, loader),
+        ) as pool:
+            yield pool.map(parse, batches)
+    else:
+        _load_process_interpreter(model_path, loader)
+        yield map(parse, batches)
+
+
 @app.command()
 def rasa_model(
     model_path: pathlib.Path = typer.Argument(..., help="Location of Rasa model."),
-    nlu_path: pathlib.Path = typer.Argument(..., help="The original nlu.yml file"),
+    nlu_path: pathlib.Path = typer.Argument(
+        ..., help="The original nlu.yml file, a folder or a glob"
+    ),
     out_path: pathlib.Path = typer.Argument(
         "checkthese.csv", help="Path to write examples file to"
     ),
+    batch_size: int = typer.Option(64, help="Number of examples to parse at once"),
+    workers: int = typer.Option(
+        1, help="Number of processes that read files and make predictions"
+    ),
+    top_k: int = typer.Option(
+        1, help="Number of intents of the ranking to write for every suggestion"
+    ),
+    chunk_size: int = typer.Option(
+        10_000, help="Number of examples to predict between two checkpoints"
+    ),
 ):
     """Confirm via trained Rasa pipeline."""
+    from rich.progress import Progress
+
     warnings.filterwarnings("ignore")
 
-    # Load required components.
-    print("[green]Loading Interpreter.")
-    interpreter = load_interpreter(model_path)
     print("[green]Loading NLU file.")
-    df = nlu_path_to_dataframe(nlu_path).assign(
+    df = nlu_path_to_dataframe(nlu_path, workers=workers).assign(
         clean_text=lambda d: replace_ent_assignment(d["text"])
     )
+    texts = list(df["clean_text"])
+    columns = {c: df[c].tolist() for c in ["text", "intent", "source_file"] if c in df}
+    # A checkpoint is only continued for the same model file and the same examples.
+    config = dict(
+        model=model_fingerprint(model_path),
+        nlu_path=str(nlu_path),
+        n_examples=len(texts),
+        data=data_fingerprint(columns["text"], columns["intent"]),
+        top_k=top_k,
+    )
+    fields = suggestion_fields(top_k, source_file="source_file" in columns)
 
-    # Make predictions.
-    parsed_examples = []
-    with Progress() as progress:
-        task = progress.add_task("[green]Making predictions...", total=df.shape[0])
-        for text in df["clean_text"]:
-            parsed_examples.append(interpreter.interpreter.parse(text)["intent"])
-            progress.update(task, advance=1)
-    pred_df = pd.DataFrame(parsed_examples)
-
-    # Save the suggestions
-    (
-        df.assign(pred_intent=pred_df["name"], confidence=pred_df["confidence"])
-        .loc[lambda d: d["intent"] != d["pred_intent"]]
-        .sort_values("confidence", ascending=False)[
-            ["text", "intent", "pred_intent", "confidence"]
+    # Suggestions are written in sorted runs, a run that stopped early continues
+    # after the last checkpoint and the runs are merged once all examples are done.
+    with SuggestionWriter(out_path, fields, config, chunk_size) as writer:
+        start = writer.done
+        if start:
+            print(f"[green]Resuming after {start} examples.")
+        batches = [
+            texts[i : i + batch_size] for i in range(start, len(texts), batch_size)
         ]
-        .to_csv(out_path, index=False)
-    )
+        # Load required components.
+        if workers > 1:
+            print(f"[green]Loading Interpreter in {workers} processes.")
+        else:
+            print("[green]Loading Interpreter.")
+        with predict_batches(model_path, batches, workers, top_k) as parsed_batches:
+            # Make predictions, the batches come back in their original order.
+            offset = start
+            tic = time.perf_counter()
+            with Progress() as progress:
+                task = progress.add_task(
+                    "[green]Making predictions...", total=len(texts), completed=start
+                )
+                for predictions in parsed_batches:
+                    rows = suggestion_rows(columns, offset, predictions, top_k=top_k)
+                    writer.add(rows, len(predictions))
+                    offset += len(predictions)
+                    progress.update(task, advance=len(predictions))
+            elapsed = time.perf_counter() - tic
+        rate = (len(texts) - start) / max(elapsed, 1e-9)
+        print(f"[green]Parsed {rate:.1f} examples per second.")
     print("[green]Done.")
 
 
+def suggestion_columns(dataf):
+    """The columns of the suggestions, with the file of every example if it is known."""
+    columns = ["text", "intent", "pred_intent", "confidence", "source_file"]
+    return dataf[[c for c in columns if c in dataf.columns]]
+
+
+def _fit_predict_fold(X, y, train_idx, test_idx):
+    """Fits a logistic regression on one fold and predicts the held out rows."""
+    from sklearn.linear_model import LogisticRegression
+
+    mod = LogisticRegression(solver="liblinear", class_weight="balanced")
+    mod.fit(X[train_idx], y[train_idx])
+    return test_idx, mod.classes_, mod.predict_proba(X[test_idx])
+
+
 @app.command()
 def logistic(
-    nlu_path: pathlib.Path = typer.Argument(..., help="The original nlu.yml file"),
+    nlu_path: pathlib.Path = typer.Argument(
+        ..., help="The original nlu.yml file, a folder or a glob"
+    ),
     out_path: pathlib.Path = typer.Argument(
         "checkthese.csv", help="Path to write examples file to"
     ),
+    folds: int = typer.Option(
+        1, help="Predict out-of-fold with this many folds, 1 predicts on train data"
+    ),
+    seed: int = typer.Option(42, help="The seed value to assign the folds"),
+    workers: int = typer.Option(
+        1, help="Number of files to read and folds to fit in parallel"
+    ),
 ):
     """Confirm via basic sklearn pipeline."""
-    df = nlu_path_to_dataframe(nlu_path).assign(
+    from joblib import Parallel, delayed
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.model_selection import StratifiedKFold
+
+    df = nlu_path_to_dataframe(nlu_path, workers=workers).assign(
         clean_text=lambda d: replace_ent_assignment(d["text"])
     )
 
-    print("[green]Training basic pipeline.")
-    mod = make_pipeline(
-        CountVectorizer(),
-        LogisticRegression(solver="liblinear", class_weight="balanced"),
-    )
+    # The texts are only tokenized once, every fold slices the same sparse matrix.
+    X = CountVectorizer().fit_transform(df["clean_text"])
+    y = df["intent"].to_numpy()
+    classes = np.unique(y)
+    if folds > 1:
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+        splits = list(splitter.split(X, y))
+    else:
+        splits = [(np.arange(len(y)), np.arange(len(y)))]
 
-    mod.fit(df["clean_text"], df["intent"])
+    print(f"[green]Training basic pipeline on {len(splits)} fold(s).")
+    fold_results = Parallel(n_jobs=workers)(
+        delayed(_fit_predict_fold)(X, y, train_idx, test_idx)
+        for train_idx, test_idx in splits
+    )
 
     print("[green]Checking labels.")
+    # Classes missing from a training fold keep a probability of zero.
+    proba = np.zeros((len(y), len(classes)))
+    for test_idx, fold_classes, fold_proba in fold_results:
+        cols = np.searchsorted(classes, fold_classes)
+        proba[np.ix_(test_idx, cols)] = fold_proba
+
     # Save the suggestions
     (
         df.assign(
-            pred_intent=mod.predict(df["clean_text"]),
-            confidence=np.max(mod.predict_proba(df["clean_text"]), axis=1),
+            pred_intent=classes[np.argmax(proba, axis=1)],
+            confidence=np.max(proba, axis=1),
         )
         .loc[lambda d: d["intent"] != d["pred_intent"]]
-        .sort_values("confidence", ascending=False)[
-            ["text", "intent", "pred_intent", "confidence"]
-        ]
+        .sort_values("confidence", ascending=False)
+        .pipe(suggestion_columns)
         .to_csv(out_path, index=False)
     )
     print("[green]Done.")
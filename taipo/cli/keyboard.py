@@ -1,18 +1,27 @@
+import re
 import random
 import pathlib
-import re
+import functools
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import typer
+import numpy as np
 import pandas as pd
-import nlpaug.augmenter.char as nac
-from sklearn.model_selection import train_test_split
 
 from taipo.common import (
     nlu_path_to_dataframe,
     dataframe_to_nlu_file,
+    dataframe_to_nlu_files,
+    is_nlu_folder,
     entity_names,
     curly_entity_items,
+    train_valid_split,
+    BackgroundWriter,
 )
+from taipo.cache import open_cache, cached_augment
+from taipo.profiling import profile_stage
 
 
 # NOTE: the following custom implementation of a reverse tokenizer is necessary, since otherwise
@@ -29,13 +38,108 @@ CUSTOM_DETOKENIZER_REGEXS = [
 ]
 
 
-def custom_reverse_tokenizer(tokens):
+def chained_reverse_tokenizer(tokens):
+    """Applies the `CUSTOM_DETOKENIZER_REGEXS` one after another."""
     text = " ".join(tokens)
     for regex, sub in CUSTOM_DETOKENIZER_REGEXS:
         text = regex.sub(sub, text)
     return text.strip()
 
 
+# The regexes above can only remove the space between two tokens, and only next to a
+# token that holds a bracket or starts with punctuation. A single scan finds the runs
+# of such tokens and `_detokenize_run` replays the seven passes on just that run.
+_OPEN, _CLOSE = set("[({<"), set("])}>")
+_PUNCT, _QUOTES = set(".,:;?!%"), set("'\"`")
+_SPECIAL_TOKEN = r"(?:[.,:;?!%(]\S*|\S*\]|[\[{<)}>])(?!\S)"
+DETOKENIZER_REGEX = re.compile(
+    rf"(?:^| ){_SPECIAL_TOKEN}(?: {_SPECIAL_TOKEN})*(?: |$)", re.MULTILINE
+)
+_WHITESPACE = re.compile(r"\s")
+
+
+def _punct_prefix(token):
+    """Length of the run of `[.,:;?!%]` that starts the token."""
+    for idx, char in enumerate(token):
+        if char not in _PUNCT:
+            return idx
+    return len(token)
+
+
+@functools.lru_cache(maxsize=4096)
+def _detokenize_run(run):
+    # gaps[j] is the space in front of toks[j], gaps[-1] the one after the run.
+    toks = run.strip(" ").split(" ")
+    n = len(toks)
+    gaps = [run[0] == " "] + [True] * (n - 1) + [run[-1] == " "]
+    at_start, at_end = not gaps[0], not gaps[-1]
+
+    # Left bracket, a match hides the space it removed from the next token.
+    for j, tok in enumerate(toks):
+        if tok in _OPEN and gaps[j] and gaps[j + 1]:
+            gaps[j + 1] = False
+    # Right bracket, a match uses up the space after it.
+    after_match = False
+    for j, tok in enumerate(toks):
+        after_match = tok in _CLOSE and gaps[j] and gaps[j + 1] and not after_match
+        if after_match:
+            gaps[j] = False
+    # Left square bracket at the start and right round bracket at the end.
+    if at_start and toks[0] == "[":
+        gaps[1] = False
+    if at_end and toks[-1] == ")":
+        gaps[-2] = False
+    # Entity annotation of the form "](".
+    for j in range(1, n):
+        if toks[j - 1][-1] == "]" and toks[j][0] == "(":
+            gaps[j] = False
+    # Punctuation followed by a quote or a space, the latter uses up that space.
+    after_match = False
+    for j, tok in enumerate(toks):
+        k = _punct_prefix(tok)
+        matched = gaps[j] and not after_match and k > 0
+        if matched and k < len(tok):
+            matched, after_match = tok[k] in _QUOTES, False
+        elif matched:
+            matched = after_match = gaps[j + 1]
+        else:
+            after_match = False
+        if matched:
+            gaps[j] = False
+    # Punctuation at the end.
+    if at_end and _punct_prefix(toks[-1]) == len(toks[-1]):
+        gaps[-2] = False
+
+    return "".join((" " if gap else "") + tok for gap, tok in zip(gaps, toks)) + (
+        " " if gaps[-1] else ""
+    )
+
+
+def _detokenize_match(match):
+    return _detokenize_run(match[0])
+
+
+def custom_reverse_tokenizer(tokens):
+    """
+    Joins tokens like `chained_reverse_tokenizer` but in a single scan of the text.
+    Tokens that are empty or hold whitespace fall back to the chain of regexes.
+    """
+    if not all(tokens) or _WHITESPACE.search("".join(tokens)):
+        return chained_reverse_tokenizer(tokens)
+    return DETOKENIZER_REGEX.sub(_detokenize_match, " ".join(tokens))
+
+
+def custom_reverse_tokenizer_batch(token_lists):
+    """Applies `custom_reverse_tokenizer` to a list of token lists in a single scan."""
+    flat = [tok for tokens in token_lists for tok in tokens]
+    if len(token_lists) == 0:
+        return []
+    if not all(flat) or _WHITESPACE.search("".join(flat)):
+        return [custom_reverse_tokenizer(tokens) for tokens in token_lists]
+    text = "\n".join(" ".join(tokens) for tokens in token_lists)
+    return DETOKENIZER_REGEX.sub(_detokenize_match, text).split("\n")
+
+
 app = typer.Typer(
     name="augment",
     add_completion=False,
@@ -43,29 +147,221 @@ app = typer.Typer(
 )
 
 
-def add_spelling_errors(dataf, aug, text_col="text"):
-    """Applies the keyboard typos to a column in the dataframe."""
-    texts = list(dataf["text"])
-    names = entity_names(texts) + curly_entity_items(texts)
-    aug.stopwords = names
-    return dataf.assign(**{text_col: lambda d: aug.augment(list(d[text_col]), n=1)})
+# Texts are augmented in shards of this size, each with its own seed, so the output
+# only depends on the seed and never on the number of workers.
+SHARD_SIZE = 500
 
+# Every process that adds typos holds on to its own augmenter.
+_augmenter = None
 
-@app.command()
-def augment(
-    file: pathlib.Path = typer.Argument(..., help="The original nlu.yml file"),
-    out: pathlib.Path = typer.Argument(..., help="Path to write misspelled file to"),
-    char_max: int = typer.Option(3, help="Max number of chars to change per line"),
-    word_max: int = typer.Option(3, help="Max number of words to change per line"),
-    lang: str = typer.Option("en", help="Language for keyboard layout"),
-    seed_aug: int = typer.Option(None, help="The seed value to augment the data"),
+
+def _set_process_augmenter(aug):
+    global _augmenter
+    _augmenter = aug
+
+
+def _augment_shard(texts, seed):
+    # nlpaug draws from both random number generators.
+    random.seed(seed)
+    np.random.seed(seed)
+    return _augmenter.augment(texts, n=1)
+
+
+def entity_stopwords(texts):
+    """The entity names and curly entity items, these should never get typos."""
+    return entity_names(texts) + curly_entity_items(texts)
+
+
+def spelling_error_variants(
+    dataf,
+    aug,
+    n_variants,
+    text_col="text",
+    workers=1,
+    seed=None,
+    shard_size=SHARD_SIZE,
+    stopwords=None,
 ):
     """
-    Applies typos to an NLU file and saves it to disk.
+    Yields `n_variants` copies of the dataframe, each with its own keyboard typos.
+
+    The entity stopwords are only computed once and every shard of every variant is
+    augmented in the same pass, so with `workers` larger than one the processes are
+    started once for all variants. The shards get seeds derived from `seed`, the first
+    variant is the same as the output of `add_spelling_errors`. The `stopwords` are
+    the entity names in `dataf` unless they are given.
     """
-    random.seed(seed_aug)
+    texts = dataf[text_col].tolist()
+    if stopwords is None:
+        stopwords = entity_stopwords(texts)
+    aug.stopwords = stopwords
+
+    shards = [texts[i : i + shard_size] for i in range(0, len(texts), shard_size)]
+    # Every call to `spawn` continues where the previous one stopped.
+    root = np.random.SeedSequence(seed)
+    seeds = [
+        int(s.generate_state(1)[0])
+        for _ in range(n_variants)
+        for s in root.spawn(len(shards))
+    ]
+    with contextlib.ExitStack() as stack:
+        if workers > 1:
+            # The background writers may hold a lock while a forked process copies
+            # it, spawned processes start without any of the threads.
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_set_process_augmenter,
+                initargs=(aug,),
+            )
+            stack.enter_context(pool)
+            augmented = pool.map(_augment_shard, shards * n_variants, seeds)
+        else:
+            _set_process_augmenter(aug)
+            augmented = map(_augment_shard, shards * n_variants, seeds)
+
+        for _ in range(n_variants):
+            with profile_stage("augment", rows=len(texts)):
+                variant = [t for _, shard in zip(shards, augmented) for t in shard]
+            yield dataf.assign(**{text_col: variant})
+
+
+def add_spelling_errors(
+    dataf, aug, text_col="text", workers=1, seed=None, shard_size=SHARD_SIZE
+):
+    """
+    Applies the keyboard typos to a column in the dataframe.
+
+    The texts are split into shards that each get a seed derived from `seed`. With
+    `workers` larger than one, the shards are spread over that many processes that
+    each hold a copy of `aug`.
+    """
+    [variant] = spelling_error_variants(
+        dataf,
+        aug=aug,
+        n_variants=1,
+        text_col=text_col,
+        workers=workers,
+        seed=seed,
+        shard_size=shard_size,
+    )
+    return variant
+
+
+def cached_spelling_error_variants(
+    dataf, aug, n_variants, cache, config, workers=1, seed=None
+):
+    """
+    Like `spelling_error_variants`, but only the examples that aren't in the cache
+    yet get new typos. The entity stopwords come from all of `dataf` and are part of
+    the `config` that the cached examples are stored under.
+    """
+    kwargs = dict(aug=aug, n_variants=n_variants, workers=workers, seed=seed)
+    if cache is None:
+        return spelling_error_variants(dataf, **kwargs)
+    stopwords = entity_stopwords(dataf["text"].tolist())
+    return cached_augment(
+        dataf,
+        augment=lambda d: spelling_error_variants(d, stopwords=stopwords, **kwargs),
+        cache=cache,
+        config={**config, "stopwords": sorted(set(stopwords))},
+        seed=seed,
+        n_variants=n_variants,
+    )
+
+
+def check_n_variants(n_variants):
+    if n_variants < 1:
+        typer.echo(f"Error! The --n-variants must be at least 1, got {n_variants}.")
+        raise typer.Exit(1)
+
+
+def check_cache_seed(cache, seed):
+    if cache is not None and seed is None:
+        typer.echo("Error! The --cache needs a --seed-aug, otherwise typos are random.")
+        raise typer.Exit(1)
+
+
+def variant_paths(path, n_variants):
+    """Numbers the file name at `path` for every variant, `nlu.yml` becomes `nlu-1.yml`."""
+    path = pathlib.Path(path)
+    if n_variants == 1:
+        return [path]
+    return [
+        path.with_name(f"{path.stem}-{i}{path.suffix}")
+        for i in range(1, n_variants + 1)
+    ]
+
+
+def write_variants(
+    variants,
+    write_path,
+    n_variants,
+    split_variants,
+    writer=None,
+    mirror=False,
+    workers=1,
+    sections_from=None,
+):
+    """
+    Writes the variants one by one to their own numbered file when `split_variants`
+    is set. Otherwise all variants end up in the single file at `write_path`. The
+    files are written by the `writer` when it is given. With `mirror` the variants
+    are written by `workers` processes as folders with one file per `source_file`.
+    Every file gets the lookup tables, synonyms and regexes of `sections_from`.
+    """
+    write_nlu = writer.write if writer else dataframe_to_nlu_file
+    if mirror:
+        write_nlu = functools.partial(dataframe_to_nlu_files, workers=workers)
+    if split_variants:
+        for variant, path in zip(variants, variant_paths(write_path, n_variants)):
+            write_nlu(
+                variant,
+                write_path=path,
+                label_col="intent",
+                sections_from=sections_from,
+            )
+    else:
+        write_nlu(
+            pd.concat(variants, ignore_index=True),
+            write_path=write_path,
+            label_col="intent",
+            sections_from=sections_from,
+        )
 
-    aug = nac.KeyboardAug(
+
+ENGINES = ["nlpaug", "native"]
+
+
+def check_engine(engine):
+    if engine not in ENGINES:
+        typer.echo(f"Error! The --engine must be one of {ENGINES}, got {engine}.")
+        raise typer.Exit(1)
+
+
+def make_augmenter(engine, char_max, word_max, lang, reverse_tokenizer=None):
+    """
+    Creates the augmenter that adds the keyboard typos. The `nlpaug` engine uses
+    `KeyboardAug`, the `native` engine uses `taipo.typos.KeyboardTypos` which edits
+    characters in place and ignores `reverse_tokenizer`.
+    """
+    check_engine(engine)
+    if engine == "native":
+        from taipo.typos import KeyboardTypos
+
+        return KeyboardTypos(
+            aug_char_min=1,
+            aug_char_max=char_max,
+            aug_char_p=0.3,
+            aug_word_p=0.3,
+            aug_word_min=1,
+            aug_word_max=word_max,
+            lang=lang,
+        )
+
+    import nlpaug.augmenter.char as nac
+
+    return nac.KeyboardAug(
         aug_char_min=1,
         aug_char_max=char_max,
         aug_char_p=0.3,
@@ -76,19 +372,139 @@ def augment(
         include_numeric=False,
         include_upper_case=False,
         lang=lang,
+        reverse_tokenizer=reverse_tokenizer,
+    )
+
+
+def write_typo_files(
+    df_train,
+    df_valid,
+    prefix="misspelled",
+    seed_aug=None,
+    char_max=3,
+    word_max=3,
+    lang="en",
+    workers=1,
+    engine="nlpaug",
+    n_variants=1,
+    split_variants=False,
+    cache=None,
+    cache_max_entries=1_000_000,
+    cache_max_mb=512,
+):
+    """
+    Writes the misspelled copies of a train/validation split to
+    `data/{prefix}-nlu-train.yml` and `test/{prefix}-nlu-valid.yml`, like the
+    `generate` command does. The training files are written in the background while
+    the validation split gets its typos.
+    """
+    aug = make_augmenter(engine=engine, char_max=char_max, word_max=word_max, lang=lang)
+    config = dict(
+        command="generate",
+        engine=engine,
+        char_max=char_max,
+        word_max=word_max,
+        lang=lang,
+    )
+    with BackgroundWriter() as writer, open_cache(
+        cache, cache_max_entries, cache_max_mb
+    ) as store:
+        for dataf, path in [
+            (df_train, f"data/{prefix}-nlu-train.yml"),
+            (df_valid, f"test/{prefix}-nlu-valid.yml"),
+        ]:
+            variants = cached_spelling_error_variants(
+                dataf,
+                aug=aug,
+                n_variants=n_variants,
+                cache=store,
+                config=config,
+                workers=workers,
+                seed=seed_aug,
+            )
+            write_variants(variants, path, n_variants, split_variants, writer=writer)
+
+
+@app.command()
+def augment(
+    file: pathlib.Path = typer.Argument(
+        ..., help="The original nlu.yml file, a folder or a glob"
+    ),
+    out: pathlib.Path = typer.Argument(..., help="Path to write misspelled file to"),
+    char_max: int = typer.Option(3, help="Max number of chars to change per line"),
+    word_max: int = typer.Option(3, help="Max number of words to change per line"),
+    lang: str = typer.Option("en", help="Language for keyboard layout"),
+    seed_aug: int = typer.Option(None, help="The seed value to augment the data"),
+    workers: int = typer.Option(
+        1, help="Number of processes that read files and add typos"
+    ),
+    engine: str = typer.Option("nlpaug", help="Typo engine, either nlpaug or native"),
+    n_variants: int = typer.Option(1, help="Number of misspelled copies to make"),
+    split_variants: bool = typer.Option(
+        False, help="Write every copy to its own numbered file"
+    ),
+    mirror: bool = typer.Option(
+        False, help="Write a folder with the same files as the input folder"
+    ),
+    cache: pathlib.Path = typer.Option(
+        None, help="Cache file that remembers misspelled examples"
+    ),
+    cache_max_entries: int = typer.Option(
+        1_000_000, help="Max number of examples to keep in the cache"
+    ),
+    cache_max_mb: float = typer.Option(
+        512, help="Max megabytes of examples to keep in the cache"
+    ),
+):
+    """
+    Applies typos to an NLU file and saves it to disk.
+    """
+    check_n_variants(n_variants)
+    check_cache_seed(cache, seed_aug)
+    if mirror and not is_nlu_folder(file):
+        typer.echo("Error! --mirror needs a folder or a glob of nlu files.")
+        raise typer.Exit(1)
+    aug = make_augmenter(
+        engine=engine,
+        char_max=char_max,
+        word_max=word_max,
+        lang=lang,
         reverse_tokenizer=custom_reverse_tokenizer,
     )
-    dataf = nlu_path_to_dataframe(file)
-    (
-        dataf.pipe(add_spelling_errors, aug=aug).pipe(
-            dataframe_to_nlu_file, write_path=out, label_col="intent"
-        )
+    config = dict(
+        command="augment",
+        engine=engine,
+        char_max=char_max,
+        word_max=word_max,
+        lang=lang,
     )
+    dataf = nlu_path_to_dataframe(file, workers=workers)
+    with open_cache(cache, cache_max_entries, cache_max_mb) as store:
+        variants = cached_spelling_error_variants(
+            dataf,
+            aug=aug,
+            n_variants=n_variants,
+            cache=store,
+            config=config,
+            workers=workers,
+            seed=seed_aug,
+        )
+        write_variants(
+            variants,
+            out,
+            n_variants,
+            split_variants,
+            mirror=mirror,
+            workers=workers,
+            sections_from=file,
+        )
 
 
 @app.command()
 def generate(
-    file: pathlib.Path = typer.Argument(..., help="The original nlu.yml file"),
+    file: pathlib.Path = typer.Argument(
+        ..., help="The original nlu.yml file, a folder or a glob"
+    ),
     seed_split: int = typer.Option(42, help="The seed value to split the data"),
     seed_aug: int = typer.Option(None, help="The seed value to augment the data"),
     test_size: int = typer.Option(33, help="Percentage of data to keep as test data"),
@@ -96,64 +512,50 @@ def generate(
     char_max: int = typer.Option(3, help="Max number of chars to change per line"),
     word_max: int = typer.Option(3, help="Max number of words to change per line"),
     lang: str = typer.Option("en", help="Language for keyboard layout"),
+    workers: int = typer.Option(
+        1, help="Number of processes that read files and add typos"
+    ),
+    engine: str = typer.Option("nlpaug", help="Typo engine, either nlpaug or native"),
+    n_variants: int = typer.Option(1, help="Number of misspelled copies to make"),
+    split_variants: bool = typer.Option(
+        False, help="Write every copy to its own numbered file"
+    ),
+    cache: pathlib.Path = typer.Option(
+        None, help="Cache file that remembers misspelled examples"
+    ),
+    cache_max_entries: int = typer.Option(
+        1_000_000, help="Max number of examples to keep in the cache"
+    ),
+    cache_max_mb: float = typer.Option(
+        512, help="Max megabytes of examples to keep in the cache"
+    ),
 ):
     """
     Generate train/validation data with/without misspelling.
 
     Will also generate files for the `/test` directory.
     """
-    random.seed(seed_aug)
-
-    aug = nac.KeyboardAug(
-        aug_char_min=1,
-        aug_char_max=char_max,
-        aug_char_p=0.3,
-        aug_word_p=0.3,
-        aug_word_min=1,
-        aug_word_max=word_max,
-        include_special_char=False,
-        include_numeric=False,
-        include_upper_case=False,
-        lang=lang,
-    )
-    dataf = nlu_path_to_dataframe(file)
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        dataf["text"],
-        dataf["intent"],
-        test_size=test_size / 100,
-        random_state=seed_split,
-    )
-
-    df_valid = pd.DataFrame({"text": X_test, "intent": y_test}).sort_values(["intent"])
-    df_train = pd.DataFrame({"text": X_train, "intent": y_train}).sort_values(
-        ["intent"]
-    )
-
-    (
-        df_train.pipe(
-            dataframe_to_nlu_file, write_path="data/nlu-train.yml", label_col="intent"
-        )
-    )
-
-    (
-        df_valid.pipe(
-            dataframe_to_nlu_file, write_path="test/nlu-valid.yml", label_col="intent"
+    check_n_variants(n_variants)
+    check_cache_seed(cache, seed_aug)
+    check_engine(engine)
+    dataf = nlu_path_to_dataframe(file, workers=workers)
+    with BackgroundWriter() as writer:
+        df_train, df_valid = train_valid_split(
+            dataf, test_size=test_size, seed=seed_split, writer=writer
         )
-    )
-
-    (
-        df_train.pipe(add_spelling_errors, aug=aug).pipe(
-            dataframe_to_nlu_file,
-            write_path=f"data/{prefix}-nlu-train.yml",
-            label_col="intent",
-        )
-    )
-
-    (
-        df_valid.pipe(add_spelling_errors, aug=aug).pipe(
-            dataframe_to_nlu_file,
-            write_path=f"test/{prefix}-nlu-valid.yml",
-            label_col="intent",
+        write_typo_files(
+            df_train,
+            df_valid,
+            prefix=prefix,
+            seed_aug=seed_aug,
+            char_max=char_max,
+            word_max=word_max,
+            lang=lang,
+            workers=workers,
+            engine=engine,
+            n_variants=n_variants,
+            split_variants=split_variants,
+            cache=cache,
+            cache_max_entries=cache_max_entries,
+            cache_max_mb=cache_max_mb,
         )
-    )
@@ -0,0 +1,142 @@
+import os
+import pathlib
+import inspect
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+import typer
+import yaml
+
+from taipo.common import nlu_path_to_dataframe, train_valid_split, BackgroundWriter
+from taipo.cli import keyboard, translit
+
+
+app = typer.Typer(
+    name="pipeline",
+    add_completion=False,
+    help="""Generate train/validation data for many augmenters at once.""",
+)
+
+
+# The function that writes the files of every type of augmenter.
+AUGMENTERS = {
+    "keyboard": keyboard.write_typo_files,
+    "translit": translit.write_translit_files,
+}
+
+
+def read_config(path):
+    """
+    Reads a pipeline config and exits with an error when one of the augmenters
+    cannot run, so that nothing is written for a config with a typo in it. Every
+    augmenter in the config that is returned has all of its settings.
+    """
+    config = yaml.safe_load(pathlib.Path(path).read_text()) or {}
+    unknown = set(config) - {"file", "seed_split", "test_size", "augmenters"}
+    if unknown:
+        typer.echo(f"Error! Unknown keys in the pipeline config: {sorted(unknown)}.")
+        raise typer.Exit(1)
+    if "file" not in config or not config.get("augmenters"):
+        typer.echo("Error! The pipeline config needs a `file` and `augmenters`.")
+        raise typer.Exit(1)
+
+    steps, prefixes = [], set()
+    for step in config["augmenters"]:
+        step = dict(step)
+        kind = step.pop("type", None)
+        if kind not in AUGMENTERS:
+            typer.echo(
+                f"Error! The type of an augmenter must be one of {list(AUGMENTERS)}, "
+                f"got {kind}."
+            )
+            raise typer.Exit(1)
+        params = inspect.signature(AUGMENTERS[kind]).parameters
+        settings = {
+            name: p.default
+            for name, p in params.items()
+            if name not in ["df_train", "df_valid"]
+        }
+        unknown = set(step) - set(settings)
+        if unknown:
+            typer.echo(f"Error! Unknown settings for {kind}: {sorted(unknown)}.")
+            raise typer.Exit(1)
+        settings.update(step)
+
+        if kind == "keyboard":
+            keyboard.check_n_variants(settings["n_variants"])
+            keyboard.check_engine(settings["engine"])
+        else:
+            translit.translit_direction(settings["source"], settings["target"])
+            translit.check_engine(settings["engine"])
+        if settings["prefix"] in prefixes:
+            typer.echo(f"Error! Two augmenters use the prefix {settings['prefix']}.")
+            raise typer.Exit(1)
+        prefixes.add(settings["prefix"])
+        steps.append({"type": kind, **settings})
+    return {**config, "augmenters": steps}
+
+
+def group_by_cache(steps):
+    """
+    Puts augmenters that share a cache file in the same group, the groups run
+    concurrently but only one augmenter at a time writes to a cache.
+    """
+    groups = {}
+    for i, step in enumerate(steps):
+        cache = step.get("cache")
+        key = ("cache", str(pathlib.Path(cache).resolve())) if cache else ("step", i)
+        groups.setdefault(key, []).append(step)
+    return list(groups.values())
+
+
+def run_augmenters(steps, df_train, df_valid):
+    """Runs the augmenters of a group one after another on the shared split."""
+    for step in steps:
+        step = dict(step)
+        AUGMENTERS[step.pop("type")](df_train, df_valid, **step)
+    return [step["prefix"] for step in steps]
+
+
+@app.command()
+def pipeline(
+    config: pathlib.Path = typer.Argument(..., help="The pipeline config file"),
+    workers: int = typer.Option(
+        None, help="Number of augmenters to run at once, defaults to the CPU count"
+    ),
+):
+    """
+    Splits an NLU file once and runs all augmenters of a config file on it.
+
+    Will also generate files for the `/test` directory.
+    """
+    settings = read_config(config)
+    dataf = nlu_path_to_dataframe(settings["file"])
+    df_train, df_valid = train_valid_split(
+        dataf,
+        test_size=settings.get("test_size", 33),
+        seed=settings.get("seed_split", 42),
+        write=False,
+    )
+    groups = group_by_cache(settings["augmenters"])
+    workers = min(workers or os.cpu_count() or 1, len(groups))
+    with contextlib.ExitStack() as stack:
+        if workers > 1:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            # Submitting starts the processes, before the writer starts its thread.
+            jobs = [
+                pool.submit(run_augmenters, group, df_train, df_valid)
+                for group in groups
+            ]
+        # The split itself is written in the background while the augmenters run.
+        writer = stack.enter_context(BackgroundWriter())
+        writer.write(df_train, write_path="data/nlu-train.yml", label_col="intent")
+        writer.write(df_valid, write_path="test/nlu-valid.yml", label_col="intent")
+        if workers > 1:
+            done = [prefix for job in jobs for prefix in job.result()]
+        else:
+            done = [
+                prefix
+                for group in groups
+                for prefix in run_augmenters(group, df_train, df_valid)
+            ]
+    typer.echo(f"Ran {len(done)} augmenters: {', '.join(done)}.")
@@ -1,11 +1,22 @@
+import re
 import pathlib
+import itertools
+import collections
 
 import typer
-import pandas as pd
-from transliterate import get_translit_function
-from sklearn.model_selection import train_test_split
 
-from ..common import nlu_path_to_dataframe, dataframe_to_nlu_file, entity_names
+from ..common import (
+    nlu_path_to_dataframe,
+    dataframe_to_nlu_file,
+    entity_names,
+    trie_regex,
+    dataframe_to_nlu_files,
+    is_nlu_folder,
+    train_valid_split,
+    BackgroundWriter,
+)
+from ..cache import open_cache, cached_augment
+from ..profiling import profile_stage
 
 
 app = typer.Typer(
@@ -15,118 +26,404 @@ app = typer.Typer(
 )
 
 
+# Entities are hidden behind private use characters, which no language pack maps.
+PLACEHOLDER = "\ue000{}\ue001"
+PLACEHOLDER_REGEX = re.compile("\ue000([0-9]+)\ue001")
+
+# Number of distinct words that a `Translitor` remembers by default.
+MEMO_SIZE = 100_000
+
+# The `fast` engine runs the rules of the language pack from precompiled tables.
+ENGINES = ["transliterate", "fast"]
+
+
+# Rules of a language pack that could hold whitespace.
+PACK_RULES = [
+    "mapping",
+    "reversed_specific_mapping",
+    "pre_processor_mapping",
+    "reversed_specific_pre_processor_mapping",
+    "reversed_pre_processor_mapping",
+]
+
+
+def _rules_split_on_spaces(pack):
+    """
+    Transliterating the words of a text one by one only gives the same result as
+    transliterating the whole text when no rule of the language pack touches
+    whitespace.
+    """
+    strings = []
+    for name in PACK_RULES:
+        rules = getattr(pack, name, None) or ()
+        if isinstance(rules, dict):
+            rules = list(rules) + list(rules.values())
+        strings.extend(rules)
+    return not any(re.search(r"\s", s) for s in strings)
+
+
+def translit_direction(source, target):
+    """
+    The language pack and whether to map back to latin, for a `source` and `target`
+    alphabet of which one is latin.
+    """
+    if target == source:
+        typer.echo(
+            "Error! Either --target or --source needs to be set. Cannot be the same."
+        )
+        raise typer.Exit(1)
+    lang = target if target != "latin" else source
+    return lang, target == "latin"
+
+
+def check_engine(engine):
+    """Exits when `engine` isn't one of the `ENGINES`."""
+    if engine not in ENGINES:
+        typer.echo(f"Error! --engine must be one of {ENGINES}, got {engine}.")
+        raise typer.Exit(1)
+
+
 class Translitor:
-    def __init__(self, lang, reversed, ents):
+    def __init__(
+        self,
+        lang,
+        reversed,
+        ents,
+        memo_size=0,
+        chunk_size=10_000,
+        engine="transliterate",
+    ):
+        from transliterate import get_translit_function
+
         self.translitor = get_translit_function(lang)
+        self.pack = self.translitor.__self__
+        if engine == "fast":
+            from ..fast_translit import FastTranslit
+
+            self.translitor = FastTranslit.load(lang, reversed)
         self.mapper = {e: i for i, e in enumerate(ents)}
+        self.ents = list(self.mapper)
+        self.ent_regex = trie_regex(self.ents)
         self.reversed = reversed
+        # Distinct words that were transliterated before, in the order they were last
+        # used, so the least recently used words are dropped first.
+        self.memo = {}
+        self.memo_size = memo_size
+        self.chunk_size = chunk_size
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.by_word = (
+            memo_size > 0
+            and _rules_split_on_spaces(self.pack)
+            and not any(re.search(r"\s", e) for e in self.ents)
+        )
 
     def hide_ents(self, s):
-        for k, v in self.mapper.items():
-            s = s.replace(k, str(v))
-        return s
+        return self.ent_regex.sub(lambda m: PLACEHOLDER.format(self.mapper[m[0]]), s)
 
     def show_ents(self, s):
-        for k, v in self.mapper.items():
-            s = s.replace(str(v), k)
-        return s
+        return PLACEHOLDER_REGEX.sub(lambda m: self.ents[int(m[1])], s)
 
     def translit(self, s):
         return self.show_ents(
             self.translitor(self.hide_ents(s), reversed=self.reversed)
         )
 
+    def translit_many(self, texts):
+        """
+        Transliterates a list of texts. With a `memo_size`, every distinct word is
+        transliterated once and remembered, the texts are then put back together
+        from the words. This gives the same result as `translit` on every text.
+        """
+        if not self.by_word or any("\n" in t for t in texts):
+            return [self.translit(t) for t in texts]
+        results = []
+        for i in range(0, len(texts), self.chunk_size):
+            words = "\n".join(texts[i : i + self.chunk_size]).split(" ")
+            distinct = dict.fromkeys(words)
+            known = {w: self.memo[w] for w in distinct if w in self.memo}
+            new = [w for w in distinct if w not in known]
+            # All new words go through the language pack in a single call.
+            known.update(zip(new, self.translit(" ".join(new)).split(" ")))
+            results.extend(" ".join(map(known.__getitem__, words)).split("\n"))
+
+            self.memo_hits += len(words) - len(new)
+            self.memo_misses += len(new)
+            # Words that were used again move to the end, away from the eviction.
+            for word in known:
+                self.memo.pop(word, None)
+            self.memo.update(known)
+            excess = max(len(self.memo) - self.memo_size, 0)
+            for word in list(itertools.islice(self.memo, excess)):
+                del self.memo[word]
+        return results
+
+    def memo_summary(self):
+        """A single line with the hit rate of the memo."""
+        return memo_summary(
+            collections.Counter(memo_hits=self.memo_hits, memo_misses=self.memo_misses)
+        )
+
+
+def memo_summary(stats):
+    """A single line with the hit rate of the memo from the counts in `stats`."""
+    total = stats["memo_hits"] + stats["memo_misses"]
+    rate = stats["memo_hits"] / total if total else 0.0
+    return (
+        f"Transliterated {stats['memo_misses']} distinct words for {total} words "
+        f"({rate:.1%} memo hit rate)."
+    )
 
-def add_transliteration(dataf, lang, reversed, text_col="text"):
-    """Applies the translitertion to a column in the dataframe."""
+
+def add_transliteration(
+    dataf,
+    lang,
+    reversed,
+    text_col="text",
+    ents=None,
+    memo_size=MEMO_SIZE,
+    engine="transliterate",
+    stats=None,
+):
+    """
+    Applies the translitertion to a column in the dataframe. The `ents` are the
+    entity names in the column unless they are given. Up to `memo_size` distinct
+    words are remembered, zero transliterates every text as a whole. The hits and
+    misses of the memo are added to the `stats` counter when it is given.
+    """
+    if ents is None:
+        ents = entity_names(list(dataf["text"]))
+    tl = Translitor(
+        lang=lang, reversed=reversed, ents=ents, memo_size=memo_size, engine=engine
+    )
+    with profile_stage("augment", rows=len(dataf)):
+        result = dataf.assign(**{text_col: tl.translit_many(list(dataf[text_col]))})
+    if tl.by_word and stats is not None:
+        stats.update(memo_hits=tl.memo_hits, memo_misses=tl.memo_misses)
+    return result
+
+
+def cached_transliteration(
+    dataf,
+    lang,
+    reversed,
+    cache,
+    memo_size=MEMO_SIZE,
+    engine="transliterate",
+    stats=None,
+):
+    """
+    Like `add_transliteration`, but only the examples that aren't in the cache yet
+    are transliterated. The entity names come from all of `dataf` and are part of
+    the config that the cached examples are stored under.
+    """
+    if cache is None:
+        return add_transliteration(
+            dataf,
+            lang=lang,
+            reversed=reversed,
+            memo_size=memo_size,
+            engine=engine,
+            stats=stats,
+        )
     ents = entity_names(list(dataf["text"]))
-    tl = Translitor(lang=lang, reversed=reversed, ents=ents)
-    return dataf.assign(**{text_col: lambda d: [tl.translit(e) for e in d["text"]]})
+    [result] = cached_augment(
+        dataf,
+        augment=lambda d: [
+            add_transliteration(
+                d,
+                lang=lang,
+                reversed=reversed,
+                ents=ents,
+                memo_size=memo_size,
+                engine=engine,
+                stats=stats,
+            )
+        ],
+        cache=cache,
+        config=dict(command="translit", lang=lang, reversed=reversed, ents=ents),
+        seed=None,
+        deterministic=True,
+    )
+    return result
+
+
+def write_translit_files(
+    df_train,
+    df_valid,
+    prefix="translit",
+    target="latin",
+    source="latin",
+    memo_size=MEMO_SIZE,
+    engine="transliterate",
+    cache=None,
+    cache_max_entries=1_000_000,
+    cache_max_mb=512,
+):
+    """
+    Writes the transliterated train/validation split to `data/{prefix}-nlu-train.yml`
+    and `test/{prefix}-nlu-valid.yml`, like the `generate` command does. The training
+    file is written in the background while the validation split is transliterated.
+    Returns a counter with the hits and misses of the memo of both splits.
+    """
+    lang, reversed = translit_direction(source, target)
+    stats = collections.Counter()
+    with BackgroundWriter() as writer, open_cache(
+        cache, cache_max_entries, cache_max_mb
+    ) as store:
+        for dataf, path in [
+            (df_train, f"data/{prefix}-nlu-train.yml"),
+            (df_valid, f"test/{prefix}-nlu-valid.yml"),
+        ]:
+            (
+                dataf.pipe(
+                    cached_transliteration,
+                    lang=lang,
+                    reversed=reversed,
+                    cache=store,
+                    memo_size=memo_size,
+                    engine=engine,
+                    stats=stats,
+                ).pipe(writer.write, write_path=path, label_col="intent")
+            )
+    return stats
+
+
+def write_translit_output(
+    dataf, write_path, mirror=False, workers=1, sections_from=None
+):
+    """
+    Writes a single nlu file, or with `mirror` a folder with one file per
+    `source_file` that is written by `workers` processes. The lookup tables,
+    synonyms and regexes of `sections_from` are copied as they are.
+    """
+    if mirror:
+        return dataframe_to_nlu_files(
+            dataf,
+            write_path=write_path,
+            label_col="intent",
+            workers=workers,
+            sections_from=sections_from,
+        )
+    return dataframe_to_nlu_file(
+        dataf, write_path=write_path, label_col="intent", sections_from=sections_from
+    )
 
 
 @app.command()
 def augment(
-    file: pathlib.Path = typer.Argument(..., help="The original nlu.yml file"),
+    file: pathlib.Path = typer.Argument(
+        ..., help="The original nlu.yml file, a folder or a glob"
+    ),
     out: pathlib.Path = typer.Argument(..., help="Path to write misspelled file to"),
     target: str = typer.Option("latin", help="Alphabet to map to."),
     source: str = typer.Option("latin", help="Alphabet to map from."),
     lang: str = typer.Option("en", help="Language for keyboard layout"),
+    cache: pathlib.Path = typer.Option(
+        None, help="Cache file that remembers transliterated examples"
+    ),
+    cache_max_entries: int = typer.Option(
+        1_000_000, help="Max number of examples to keep in the cache"
+    ),
+    cache_max_mb: float = typer.Option(
+        512, help="Max megabytes of examples to keep in the cache"
+    ),
+    memo_size: int = typer.Option(
+        MEMO_SIZE, help="Max number of distinct words to remember, 0 turns it off"
+    ),
+    engine: str = typer.Option(
+        "transliterate", help="Engine to use, either transliterate or fast"
+    ),
+    workers: int = typer.Option(
+        1, help="Number of processes that read and write files"
+    ),
+    mirror: bool = typer.Option(
+        False, help="Write a folder with the same files as the input folder"
+    ),
 ):
     """
     Applies translitertion to an NLU file and saves it to disk.
     """
-    if target == source:
-        typer.echo(
-            "Error! Either --target or --source needs to be set. Cannot be the same."
-        )
+    lang, reversed = translit_direction(source, target)
+    check_engine(engine)
+    if mirror and not is_nlu_folder(file):
+        typer.echo("Error! --mirror needs a folder or a glob of nlu files.")
         raise typer.Exit(1)
-    lang = target if target != "latin" else source
-    reversed = target == "latin"
-    dataf = nlu_path_to_dataframe(file)
-    (
-        dataf.pipe(add_transliteration, lang=lang, reversed=reversed).pipe(
-            dataframe_to_nlu_file, write_path=out, label_col="intent"
+    dataf = nlu_path_to_dataframe(file, workers=workers)
+    stats = collections.Counter()
+    with open_cache(cache, cache_max_entries, cache_max_mb) as store:
+        (
+            dataf.pipe(
+                cached_transliteration,
+                lang=lang,
+                reversed=reversed,
+                cache=store,
+                memo_size=memo_size,
+                engine=engine,
+                stats=stats,
+            ).pipe(
+                write_translit_output,
+                write_path=out,
+                mirror=mirror,
+                workers=workers,
+                sections_from=file,
+            )
         )
-    )
+        if stats:
+            typer.echo(memo_summary(stats))
 
 
 @app.command()
 def generate(
-    file: pathlib.Path = typer.Argument(..., help="The original nlu.yml file"),
+    file: pathlib.Path = typer.Argument(
+        ..., help="The original nlu.yml file, a folder or a glob"
+    ),
     seed_aug: int = typer.Option(42, help="The seed value to split the data"),
     test_size: int = typer.Option(33, help="Percentage of data to keep as test data"),
     prefix: str = typer.Option("translit", help="Prefix to add to all the files"),
     target: str = typer.Option("latin", help="Alphabet to map to."),
     source: str = typer.Option("latin", help="Alphabet to map from."),
     lang: str = typer.Option("en", help="Language for keyboard layout"),
+    cache: pathlib.Path = typer.Option(
+        None, help="Cache file that remembers transliterated examples"
+    ),
+    cache_max_entries: int = typer.Option(
+        1_000_000, help="Max number of examples to keep in the cache"
+    ),
+    cache_max_mb: float = typer.Option(
+        512, help="Max megabytes of examples to keep in the cache"
+    ),
+    memo_size: int = typer.Option(
+        MEMO_SIZE, help="Max number of distinct words to remember, 0 turns it off"
+    ),
+    engine: str = typer.Option(
+        "transliterate", help="Engine to use, either transliterate or fast"
+    ),
+    workers: int = typer.Option(1, help="Number of processes that read files"),
 ):
     """
     Generate train/validation data with/without translitertion.
 
     Will also generate files for the `/test` directory.
     """
-    if target == source:
-        typer.echo(
-            "Error! Either --target or --source needs to be set. Cannot be the same."
+    translit_direction(source, target)
+    check_engine(engine)
+    dataf = nlu_path_to_dataframe(file, workers=workers)
+    with BackgroundWriter() as writer:
+        df_train, df_valid = train_valid_split(
+            dataf, test_size=test_size, seed=seed_aug, writer=writer
         )
-        raise typer.Exit(1)
-    lang = target if target != "latin" else source
-    reversed = target == "latin"
-    dataf = nlu_path_to_dataframe(file)
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        dataf["text"], dataf["intent"], test_size=test_size / 100, random_state=seed_aug
-    )
-
-    df_valid = pd.DataFrame({"text": X_test, "intent": y_test}).sort_values(["intent"])
-    df_train = pd.DataFrame({"text": X_train, "intent": y_train}).sort_values(
-        ["intent"]
-    )
-
-    (
-        df_train.pipe(
-            dataframe_to_nlu_file, write_path="data/nlu-train.yml", label_col="intent"
+        stats = write_translit_files(
+            df_train,
+            df_valid,
+            prefix=prefix,
+            target=target,
+            source=source,
+            memo_size=memo_size,
+            engine=engine,
+            cache=cache,
+            cache_max_entries=cache_max_entries,
+            cache_max_mb=cache_max_mb,
         )
-    )
-
-    (
-        df_valid.pipe(
-            dataframe_to_nlu_file, write_path="test/nlu-valid.yml", label_col="intent"
-        )
-    )
-
-    (
-        df_train.pipe(add_transliteration, lang=lang, reversed=reversed).pipe(
-            dataframe_to_nlu_file,
-            write_path=f"data/{prefix}-nlu-train.yml",
-            label_col="intent",
-        )
-    )
-
-    (
-        df_valid.pipe(add_transliteration, lang=lang, reversed=reversed).pipe(
-            dataframe_to_nlu_file,
-            write_path=f"test/{prefix}-nlu-valid.yml",
-            label_col="intent",
-        )
-    )
+    if stats:
+        typer.echo(memo_summary(stats))
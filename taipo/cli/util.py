@@ -1,11 +1,7 @@
 import pathlib
-from rich import console
 
 import typer
 import pandas as pd
-from clumper import Clumper
-from rich.table import Table
-from rich.console import Console
 
 from taipo.common import nlu_path_to_dataframe, dataframe_to_nlu_file
 
@@ -50,6 +46,35 @@ def yml_to_csv(
     nlu_path_to_dataframe(file).to_csv(out, index=False)
 
 
+@app.command()
+def convert(
+    file: pathlib.Path = typer.Argument(
+        ..., help="The nlu file, folder or glob to convert"
+    ),
+    out: pathlib.Path = typer.Argument(..., help="The path of the output file."),
+    text_col: str = typer.Option("text", help="Name of the text column in a .csv."),
+    label_col: str = typer.Option("intent", help="Name of the label column in a .csv."),
+    workers: int = typer.Option(1, help="Number of processes that read files"),
+):
+    """
+    Converts between .yml, .csv, .parquet and .arrow files.
+    """
+    sections_from = None
+    if file.suffix == ".csv":
+        dataf = pd.read_csv(file).rename(
+            columns={text_col: "text", label_col: "intent"}
+        )
+    else:
+        dataf = nlu_path_to_dataframe(file, workers=workers)
+        sections_from = file
+    if out.suffix == ".csv":
+        dataf.to_csv(out, index=False)
+    else:
+        dataframe_to_nlu_file(
+            dataf, write_path=out, label_col="intent", sections_from=sections_from
+        )
+
+
 @app.command()
 def summary(
     folder: pathlib.Path = typer.Argument(
@@ -59,6 +84,10 @@ def summary(
     """
     Displays summary tables for gridsearch results.
     """
+    from clumper import Clumper
+    from rich.table import Table
+    from rich.console import Console
+
     stringify = lambda d: str(round(d, 5))
 
     data = (
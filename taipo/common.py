@@ -1,41 +1,396 @@
+import re
+import glob
+import json
 import pathlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import yaml
 import pandas as pd
-from clumper import Clumper
-from parse import compile as parse_compile
 
+from taipo.profiling import profile_stage
 
-def nlu_path_to_dataframe(path):
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader as YamlLoader
+
+
+def _iter_nlu_items(stream, marks=False):
+    """
+    Yields the items of the `nlu` section of a Rasa yaml stream one at a time.
+
+    The stream is consumed as parser events, so the full document never has to be
+    held in memory. Scalars are kept as strings and nested collections are skipped.
+    With `marks` every item comes with the `(line, column)` where it starts and ends.
+    """
+    # One entry per open collection: [is_mapping, pending mapping key].
+    stack = []
+    in_nlu = False
+    item = None
+    for event in yaml.parse(stream, Loader=YamlLoader):
+        if isinstance(event, (yaml.ScalarEvent, yaml.AliasEvent)):
+            if not stack or not stack[-1][0]:
+                continue
+            if stack[-1][1] is None:
+                stack[-1][1] = getattr(event, "value", None)
+                continue
+            if item is not None and len(stack) == 3:
+                item[stack[-1][1]] = getattr(event, "value", None)
+            stack[-1][1] = None
+        elif isinstance(event, yaml.CollectionStartEvent):
+            is_mapping = isinstance(event, yaml.MappingStartEvent)
+            if len(stack) == 1 and not is_mapping and stack[0][1] == "nlu":
+                in_nlu = True
+            elif len(stack) == 2 and in_nlu and is_mapping:
+                item = {}
+                start = (event.start_mark.line, event.start_mark.column)
+            stack.append([is_mapping, None])
+        elif isinstance(event, yaml.CollectionEndEvent):
+            stack.pop()
+            if len(stack) == 2 and item is not None:
+                if marks:
+                    yield item, start, (event.end_mark.line, event.end_mark.column)
+                else:
+                    yield item
+                item = None
+            elif stack and stack[-1][0]:
+                if len(stack) == 1:
+                    in_nlu = False
+                stack[-1][1] = None
+
+
+def iter_nlu_examples(path):
+    """
+    Lazily yields `(text, intent)` pairs from a single nlu file with intents.
+    Items in the file that are not intents are skipped.
+
+    Usage:
+
+    ```python
+    from taipo.common import iter_nlu_examples
+    for text, intent in iter_nlu_examples("path/to/nlu/nlu.yml"):
+        print(intent, text)
+    ```
+    """
+    with open(path, encoding="utf-8") as stream:
+        for item in _iter_nlu_items(stream):
+            if "intent" not in item:
+                continue
+            intent = item["intent"]
+            for line in (item.get("examples") or "").split("\n"):
+                text = line[2:]
+                if text != "":
+                    yield text, intent
+
+
+def _nlu_section_block(lines, column):
+    """
+    Turns the raw lines of an nlu item that started at `column` into an item of the
+    sequence that `dataframe_to_nlu_file` writes, which starts at the first column.
+    """
+    lines = "".join(lines).rstrip().split("\n")
+    indent = column - 2
+    rest = [line[indent:] if not line[:indent].strip() else line for line in lines[1:]]
+    return "\n".join([f"- {lines[0]}", *rest]) + "\n"
+
+
+def iter_nlu_sections(path):
+    """
+    Lazily yields the raw yaml of every item in the `nlu` section of a single file
+    that is not an intent, like lookup tables, synonyms and regexes. The blocks are
+    copied from the file as they are written, with comments and quoting intact, and
+    only re-indented to fit the files of `dataframe_to_nlu_file`.
+
+    Usage:
+
+    ```python
+    from taipo.common import iter_nlu_sections
+    for block in iter_nlu_sections("path/to/nlu/nlu.yml"):
+        print(block)
+    ```
+    """
+    with open(path, encoding="utf-8") as stream:
+        ranges = [
+            (*start, *end)
+            for item, start, end in _iter_nlu_items(stream, marks=True)
+            if "intent" not in item
+        ]
+    if not ranges:
+        return
+    ranges = iter(ranges)
+    current, lines = next(ranges), []
+    # The file is read a second time, now only keeping the lines of the sections.
+    with open(path, encoding="utf-8") as stream:
+        for number, line in enumerate(stream):
+            while current is not None and current[0] <= number:
+                first = current[1] if number == current[0] else 0
+                if number < current[2]:
+                    lines.append(line[first:])
+                    break
+                lines.append(line[first : current[3]])
+                yield _nlu_section_block(lines, current[1])
+                current, lines = next(ranges, None), []
+        if current is not None:
+            yield _nlu_section_block(lines, current[1])
+
+
+# Files with these suffixes are read when a folder is given.
+NLU_SUFFIXES = (".yml", ".yaml")
+
+# Columnar files that hold the same data as an nlu file, one example per row.
+TABLE_FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "Parquet and Arrow files need pyarrow, install it via `pip install taipo[arrow]`."
+        ) from e
+    return pyarrow
+
+
+def read_nlu_table(path):
     """
-    Converts a single nlu file with intents into a dataframe.
+    Reads a `.parquet` or `.arrow` file with an `intent` and a `text` column into a
+    dataframe. The file is memory mapped, so only the columns are copied.
+
+    Usage:
+
+    ```python
+    from taipo.common import read_nlu_table
+    df = read_nlu_table("path/to/nlu.parquet")
+    ```
+    """
+    pa = _import_pyarrow()
+    if TABLE_FORMATS[pathlib.Path(path).suffix] == "parquet":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, memory_map=True)
+    else:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    missing = {"intent", "text"} - set(table.column_names)
+    if missing:
+        raise ValueError(f"The file {path} has no {sorted(missing)} column.")
+    names = ["intent", "text"] + [n for n in table.column_names if n == "source_file"]
+    return table.select(names).to_pandas()
+
+
+def dataframe_to_nlu_table(dataf, write_path, text_col="text", label_col="intent"):
+    """
+    Writes a dataframe as a `.parquet` or `.arrow` file with an `intent` and a
+    `text` column, and the `source_file` column when there is one. Unlike the yaml
+    files, the examples keep their order and their text is stored as is.
+    """
+    pa = _import_pyarrow()
+    columns = {"intent": dataf[label_col], "text": dataf[text_col]}
+    if "source_file" in dataf.columns:
+        columns["source_file"] = dataf["source_file"]
+    table = pa.Table.from_pandas(pd.DataFrame(columns), preserve_index=False)
+    if TABLE_FORMATS[pathlib.Path(write_path).suffix] == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, str(write_path))
+    else:
+        # Without compression the file can be memory mapped without any copies.
+        with pa.ipc.new_file(str(write_path), table.schema) as writer:
+            writer.write_table(table)
+    return pathlib.Path(write_path).stat().st_size
+
+
+def is_nlu_folder(path):
+    """Whether `path` is a folder or a glob pattern instead of a single file."""
+    return glob.has_magic(str(path)) or pathlib.Path(path).is_dir()
+
+
+def nlu_sources(path):
+    """
+    Finds the nlu files at `path`, which is a single file, a folder that is searched
+    recursively or a glob pattern like `data/**/*.yml`. Returns the folder that the
+    files are relative to and the sorted list of files.
+    """
+    if not is_nlu_folder(path):
+        return pathlib.Path(path).parent, [pathlib.Path(path)]
+    path = str(path)
+    if glob.has_magic(path):
+        parts = pathlib.Path(path).parts
+        magic = next(i for i, part in enumerate(parts) if glob.has_magic(part))
+        root = pathlib.Path(*parts[:magic]) if magic else pathlib.Path(".")
+        files = [pathlib.Path(p) for p in glob.glob(path, recursive=True)]
+    else:
+        root = pathlib.Path(path)
+        files = [p for p in root.rglob("*") if p.suffix in NLU_SUFFIXES]
+    files = sorted(p for p in files if p.is_file())
+    if not files:
+        raise FileNotFoundError(f"No nlu files found at {path}.")
+    return root, files
+
+
+def nlu_sections(path):
+    """
+    Lazily yields the raw lookup, synonym and regex blocks of all nlu files at `path`,
+    which can be a single file, a folder or a glob like for `nlu_path_to_dataframe`.
+    Tables only hold examples, so they have no sections.
+    """
+    for file in nlu_sources(path)[1]:
+        if file.suffix not in TABLE_FORMATS:
+            yield from iter_nlu_sections(file)
+
+
+def _read_nlu_columns(path):
+    """The intents, texts and source files of a file, the latter only for tables."""
+    if pathlib.Path(path).suffix in TABLE_FORMATS:
+        dataf = read_nlu_table(path)
+        sources = dataf["source_file"].tolist() if "source_file" in dataf else None
+        return dataf["intent"].tolist(), dataf["text"].tolist(), sources
+    intents, texts = [], []
+    for text, intent in iter_nlu_examples(path):
+        intents.append(intent)
+        texts.append(text)
+    return intents, texts, None
+
+
+def nlu_path_to_dataframe(path, workers=1, entities=False):
+    """
+    Converts a single nlu file with intents into a dataframe. Files that end with
+    `.parquet`, `.arrow` or `.feather` are read with `read_nlu_table`.
+
+    The `path` can also be a folder or a glob pattern, all the nlu files it matches
+    are then read into one dataframe with a `source_file` column that holds the path
+    of every file relative to the folder, unless a table has that column already.
+    With `workers` larger than one the files are read by that many processes.
+
+    With `entities` the annotations are parsed once while loading. The dataframe then
+    gets a `clean_text` column without annotations and the table of entity spans from
+    `parse_entities` is returned as well.
+
     Usage:
     ```python
     from taipo.common import nlu_path_to_dataframe
     df = nlu_path_to_dataframe("path/to/nlu/nlu.yml")
+    df = nlu_path_to_dataframe("path/to/nlu", workers=4)
+    df, spans = nlu_path_to_dataframe("path/to/nlu/nlu.yml", entities=True)
     ```
     """
-    res = (
-        Clumper.read_yaml(path)
-        .explode("nlu")
-        .keep(lambda d: "intent" in d["nlu"].keys())
-        .mutate(
-            examples=lambda d: d["nlu"]["examples"].split("\n"),
-            intent=lambda d: d["nlu"]["intent"],
-        )
-        .drop("nlu", "version")
-        .explode(text="examples")
-        .mutate(text=lambda d: d["text"][2:])
-        .keep(lambda d: d["text"] != "")
-        .collect()
+    if entities:
+        dataf = nlu_path_to_dataframe(path, workers=workers)
+        clean, spans = parse_entities(dataf["text"])
+        return dataf.assign(clean_text=clean), spans
+    with profile_stage("load") as stage:
+        dataf = _read_nlu_path(path, workers=workers)
+        stage.rows = len(dataf)
+    return dataf
+
+
+def _read_nlu_path(path, workers=1):
+    if not is_nlu_folder(path):
+        if pathlib.Path(path).suffix in TABLE_FORMATS:
+            return read_nlu_table(path)
+        intents, texts, _ = _read_nlu_columns(path)
+        return pd.DataFrame({"intent": intents, "text": texts})
+
+    root, files = nlu_sources(path)
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+            columns = list(pool.map(_read_nlu_columns, files))
+    else:
+        columns = [_read_nlu_columns(f) for f in files]
+    # Tables that were read from a folder before still know the original files.
+    sources = [
+        found or [f.relative_to(root).as_posix()] * len(intents)
+        for f, (intents, _, found) in zip(files, columns)
+    ]
+    return pd.DataFrame(
+        {
+            "intent": [i for intents, _, _ in columns for i in intents],
+            "text": [t for _, texts, _ in columns for t in texts],
+            "source_file": [s for found in sources for s in found],
+        }
     )
-    return pd.DataFrame(res)
 
 
-def dataframe_to_nlu_file(dataf, write_path, text_col="text", label_col="intent"):
+# These mirror what `yaml.dump(..., width=1000, allow_unicode=True)` emits for a
+# list of intents, followed by the `examples: |` rewrite that turns the example
+# lists into block literals. Scalars that are not single-line printable text are
+# handed to PyYAML itself so the output stays byte-identical.
+_YAML_HEADER = "version: '2.0'\nnlu:"
+_YAML_RESOLVER = yaml.resolver.Resolver()
+_YAML_STR_TAG = "tag:yaml.org,2002:str"
+_YAML_MAX_SCALAR = 900
+_YAML_PRINTABLE = re.compile(
+    r"[\x20-\x7e\xa0-\u2027\u202a-\ud7ff\ue000-\ufefe\uff00-\ufffd\U00010000-\U0010fffe]+"
+)
+_YAML_INDICATORS = "#,[]{}&*!|>'\"%@`"
+
+
+def _yaml_scalar(value):
+    """
+    Returns `value` the way PyYAML writes it inside a block sequence, or `None` when
+    it is not a short single-line string that can be written without PyYAML.
+    """
+    if (
+        not isinstance(value, str)
+        or len(value) > _YAML_MAX_SCALAR
+        or _YAML_PRINTABLE.fullmatch(value) is None
+        or "  -" in value
+        or "examples:" in value
+    ):
+        return None
+    first = value[0]
+    plain = not (
+        first == " "
+        or value[-1] in " :"
+        or first in _YAML_INDICATORS
+        or (first in "?:-" and (len(value) == 1 or value[1] == " "))
+        or value.startswith(("---", "..."))
+        or ": " in value
+        or " #" in value
+        or _YAML_RESOLVER.resolve(yaml.ScalarNode, value, (True, False))
+        != _YAML_STR_TAG
+    )
+    if plain:
+        return value
+    quoted = "'" + value.replace("'", "''") + "'"
+    return quoted if len(quoted) <= _YAML_MAX_SCALAR else None
+
+
+def _yaml_fragment(obj, skip_lines=0):
+    dump = yaml.dump(obj, sort_keys=False, width=1000, allow_unicode=True)
+    dump = dump.split("\n", skip_lines)[-1]
+    return dump.replace("examples:", "examples: |").replace("  -", "   -")
+
+
+def _yaml_intent_line(intent):
+    scalar = _yaml_scalar(intent)
+    if scalar is None:
+        return _yaml_fragment([{"intent": intent}])
+    return f"- intent: {scalar}\n"
+
+
+def _yaml_example_line(text):
+    scalar = _yaml_scalar(text)
+    if scalar is None:
+        return _yaml_fragment([{"examples": [text]}], skip_lines=1)
+    return f"   - {scalar}\n"
+
+
+def dataframe_to_nlu_file(
+    dataf,
+    write_path,
+    text_col="text",
+    label_col="intent",
+    spans=None,
+    sections_from=None,
+):
     """
     Converts a single DataFrame file with intents into a intents file for Rasa.
-    Note that you cannot use this method to add entities.
+    Entities are only written when they are annotated in the texts or given as
+    `spans`. The file is written one intent at a time, so the full yaml document is
+    never held in memory.
 
     Usage:
 
@@ -63,22 +418,263 @@ def dataframe_to_nlu_file(dataf, write_path, text_col="text", label_col="intent"
       - i really really like this
       - i enjoy this
     ```
+
+    When `write_path` ends with `.parquet`, `.arrow` or `.feather` the examples are
+    written with `dataframe_to_nlu_table` instead. When a table of entity `spans` is
+    given, the `text_col` holds clean texts and the annotations are put back with
+    `add_entity_markup` first.
+
+    The lookup tables, synonyms and regexes of the nlu files at `sections_from` are
+    streamed into the yaml file after the intents, so they survive an augmentation.
+
+    ```python
+    df = nlu_path_to_dataframe("path/to/nlu.yml")
+    dataframe_to_nlu_file(df, "path/to/copy.yml", sections_from="path/to/nlu.yml")
+    ```
+    """
+    if spans is not None:
+        dataf = dataf.assign(**{text_col: add_entity_markup(dataf[text_col], spans)})
+    if pathlib.Path(write_path).suffix in TABLE_FORMATS:
+        with profile_stage("write", rows=len(dataf)):
+            return dataframe_to_nlu_table(
+                dataf, write_path=write_path, text_col=text_col, label_col=label_col
+            )
+    sections = iter(nlu_sections(sections_from) if sections_from is not None else [])
+    first_section = next(sections, None)
+    with open(write_path, "w", encoding="utf-8") as f:
+        written = f.write(_YAML_HEADER)
+        groups = dataf.groupby(label_col)
+        if len(groups) == 0 and first_section is None:
+            return written + f.write(" []\n")
+        written += f.write("\n")
+        for _, group in groups:
+            with profile_stage("serialize", rows=len(group)):
+                lines = [_yaml_intent_line(group[label_col].iloc[0]), "  examples: |\n"]
+                lines.extend(_yaml_example_line(t) for t in group[text_col])
+                chunk = "".join(lines)
+            with profile_stage("write", rows=len(group)):
+                written += f.write(chunk)
+        if first_section is not None:
+            written += f.write(first_section)
+            for block in sections:
+                written += f.write(block)
+    return written
+
+
+def _write_nlu_file(args):
+    dataf, write_path, text_col, label_col, sections_from = args
+    pathlib.Path(write_path).parent.mkdir(parents=True, exist_ok=True)
+    return dataframe_to_nlu_file(
+        dataf,
+        write_path=write_path,
+        text_col=text_col,
+        label_col=label_col,
+        sections_from=sections_from,
+    )
+
+
+def dataframe_to_nlu_files(
+    dataf,
+    write_path,
+    text_col="text",
+    label_col="intent",
+    source_col="source_file",
+    workers=1,
+    sections_from=None,
+):
+    """
+    Writes a dataframe that was read from a folder back as a folder. Every value in
+    `source_col` becomes an nlu file with the same relative path inside the
+    `write_path` folder. With `workers` larger than one the files are written by
+    that many processes.
+
+    When `sections_from` is the folder or glob that the dataframe was read from, the
+    lookup tables, synonyms and regexes of every file are copied into the file with
+    the same path. Files that only hold such sections are copied too.
+
+    Usage:
+
+    ```python
+    from taipo.common import nlu_path_to_dataframe, dataframe_to_nlu_files
+    df = nlu_path_to_dataframe("data/nlu")
+    dataframe_to_nlu_files(df, write_path="augmented/nlu")
+    ```
+    """
+    groups = dict(list(dataf.groupby(source_col, sort=True)))
+    root, files = (
+        nlu_sources(sections_from) if sections_from is not None else (None, [])
+    )
+    for file in files:
+        source = file.relative_to(root).as_posix()
+        if source not in groups and next(nlu_sections(file), None) is not None:
+            groups[source] = dataf.iloc[:0]
+    jobs = [
+        (
+            group,
+            pathlib.Path(write_path) / source,
+            text_col,
+            label_col,
+            root / source if root is not None and (root / source).exists() else None,
+        )
+        for source, group in sorted(groups.items())
+    ]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            return sum(pool.map(_write_nlu_file, jobs))
+    return sum(map(_write_nlu_file, jobs))
+
+
+class BackgroundWriter:
+    """
+    Writes NLU files with `dataframe_to_nlu_file` on a background thread, so the
+    next dataframe can be augmented while the previous one is written. At most
+    `max_pending` dataframes wait to be written, `write` blocks until one of them is
+    done when there are more. Errors of a write are raised once the writer closes.
+
+    Usage:
+
+    ```python
+    from taipo.common import BackgroundWriter
+    with BackgroundWriter() as writer:
+        writer.write(df_train, write_path="data/nlu-train.yml")
+        writer.write(df_valid, write_path="test/nlu-valid.yml")
+    ```
     """
-    result = {"version": str(2.0), "nlu": []}
-    for idx, group in dataf.groupby(label_col):
-        intent = group[label_col].iloc[0]
-        result["nlu"].append(
-            {
-                "intent": intent,
-                "examples": [t for t in group[text_col]],
-            }
+
+    def __init__(self, max_pending=2):
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(
+        self, dataf, write_path, text_col="text", label_col="intent", sections_from=None
+    ):
+        self.slots.acquire()
+        future = self.pool.submit(
+            dataframe_to_nlu_file,
+            dataf,
+            write_path=write_path,
+            text_col=text_col,
+            label_col=label_col,
+            sections_from=sections_from,
         )
-    dump = (
-        yaml.dump(result, sort_keys=False, width=1000, allow_unicode=True)
-        .replace("examples:", "examples: |")
-        .replace("  -", "   -")
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def close(self):
+        """Waits for all files to be written."""
+        self.pool.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+
+
+def train_valid_split(dataf, test_size, seed, write=True, writer=None):
+    """
+    Splits an NLU dataframe into train and validation examples, sorted by intent, the
+    way the `generate` commands do. With `write` the splits are also stored in
+    `data/nlu-train.yml` and `test/nlu-valid.yml`, by the `writer` when it is given.
+
+    Usage:
+
+    ```python
+    from taipo.common import nlu_path_to_dataframe, train_valid_split
+    df_train, df_valid = train_valid_split(
+        nlu_path_to_dataframe("nlu.yml"), test_size=33, seed=42
     )
-    return pathlib.Path(write_path).write_text(dump)
+    ```
+    """
+    from sklearn.model_selection import train_test_split
+
+    with profile_stage("split", rows=len(dataf)):
+        X_train, X_test, y_train, y_test = train_test_split(
+            dataf["text"], dataf["intent"], test_size=test_size / 100, random_state=seed
+        )
+        df_valid = pd.DataFrame({"text": X_test, "intent": y_test}).sort_values(
+            ["intent"]
+        )
+        df_train = pd.DataFrame({"text": X_train, "intent": y_train}).sort_values(
+            ["intent"]
+        )
+    if write:
+        write_nlu = writer.write if writer else dataframe_to_nlu_file
+        write_nlu(df_train, write_path="data/nlu-train.yml", label_col="intent")
+        write_nlu(df_valid, write_path="test/nlu-valid.yml", label_col="intent")
+    return df_train, df_valid
+
+
+def trie_regex(words):
+    """
+    Compiles a regex that matches any of `words`, preferring the longest one.
+
+    The alternatives are merged into a trie first, so the pattern shares common
+    prefixes and matching time does not grow with the number of words.
+
+    Usage:
+
+    ```python
+    from taipo.common import trie_regex
+    regex = trie_regex(["java", "javascript", "python"])
+    assert regex.findall("javascript or python") == ["javascript", "python"]
+    ```
+    """
+    trie = {}
+    for word in words:
+        if word == "":
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = None
+
+    def to_pattern(node):
+        branches = [re.escape(c) + to_pattern(n) for c, n in node.items() if c != ""]
+        if not branches:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if "" in node else "")
+
+    # An empty character class never matches, which handles an empty vocabulary.
+    return re.compile(to_pattern(trie) or "[^\\s\\S]")
+
+
+# Matches `[text]` optionally followed by `(entity)` or `{...}`. None of the parts
+# can contain their own delimiters or a newline, which keeps a scan linear and lets
+# a whole corpus be scanned at once when the texts are joined by newlines.
+ENTITY_MARKUP = re.compile(
+    r"\[(?P<text>[^\[\]\n]*)\](?:\((?P<entity>[^()\n]*)\)|\{(?P<curly>[^{}\n]*)\})?"
+)
+
+EntitySpan = namedtuple("EntitySpan", ["start", "end", "text", "entity", "curly"])
+
+
+def scan_entities(text):
+    """
+    Finds all the entity annotations in a single Rasa style NLU string in one pass.
+
+    Every annotation is returned as an `EntitySpan` with the character range of the
+    markup, the annotated text and either the `(entity)` or the `{...}` part. The
+    part that is not used is `None`, as are both for a bare `[text]`.
+
+    Usage:
+
+    ```python
+    from taipo.common import scan_entities
+    spans = scan_entities("[python](proglang) and [pandas]{entity:package}")
+    assert spans[0].entity == "proglang"
+    assert spans[1].curly == "entity:package"
+    ```
+    """
+    return [
+        EntitySpan(m.start(), m.end(), *m.groups())
+        for m in ENTITY_MARKUP.finditer(text)
+    ]
 
 
 def entity_names(rasa_strings):
@@ -88,68 +684,185 @@ def entity_names(rasa_strings):
     Usage:
 
     ```python
-    out = entity_names("[python](proglang) and [pandas](package)")
+    out = entity_names(["[python](proglang) and [pandas](package)"])
     assert out == ["proglang", "package"]
     ```
     """
-    r = parse_compile("({entity})")
-    results = [list(r.findall(s)) for s in rasa_strings]
-    flat_results = [item for sublist in results for item in sublist]
-    if len(flat_results) == 0:
-        return []
-    uniq = pd.DataFrame([_.named for _ in flat_results])["entity"].unique()
-    return list(uniq)
+    with profile_stage("entities", rows=len(rasa_strings)):
+        found = ENTITY_MARKUP.findall("\n".join(rasa_strings))
+        return list(dict.fromkeys(entity for _, entity, _ in found if entity))
 
 
 def gen_curly_ents(text):
     """
     Returns a list of all the curly entity bits for a single text.
     """
-    while text.find("[") != -1:
-        sq1 = text.find("[")
-        sq2 = text[sq1:].find("]")
-        br1 = text[sq1 + sq2 :].find("{")
-        br2 = text[sq1 + sq2 + br1 :].find("}")
-        ent = text[sq1 : sq1 + sq2 + 1]
-        curly_bit = text[sq1 + sq2 + br1 : sq1 + sq2 + br1 + br2 + 1]
-        yield ent, curly_bit
-        if curly_bit != "":
-            text = text[sq1 + sq2 + br1 + br2 :]
-        else:
-            text = text[sq1 + sq2 :]
+    for span in scan_entities(text):
+        curly_bit = "" if span.curly is None else f"{{{span.curly}}}"
+        yield f"[{span.text}]", curly_bit
 
 
 def curly_entity_items(texts):
     """
     Returns a list of all the curly entity bits for a list of texts.
     """
-    results = []
-    for text in texts:
-        items = gen_curly_ents(text)
-        for ent, curly in items:
-            cleaned = (
-                curly.replace(":", " ")
-                .replace("{", "")
-                .replace("}", "")
-                .replace(",", " ")
-                .split(" ")
-            )
-            for item in cleaned:
-                if item != "":
-                    results.append(item)
-    return list(set(results))
+    with profile_stage("entities", rows=len(texts)):
+        found = ENTITY_MARKUP.findall("\n".join(texts))
+        curly_bits = " ".join(curly for _, _, curly in found if curly)
+        return list(set(curly_bits.replace(":", " ").replace(",", " ").split()))
+
+
+# Like `ENTITY_MARKUP` but the annotation is required and only the annotated text
+# is captured, so `split` followed by `join` strips the markup entirely in C.
+ENTITY_ANNOTATION = re.compile(r"\[([^\[\]\n]*)\](?:\([^()\n]*\)|\{[^{}\n]*\})")
 
 
 def replace_ent_assignment(texts):
     """
     Takes in a list of strings, possibly with entity annotations, and
-    returns a list of strings without entity annotations.
-    """
-    parser = parse_compile("[{entity}]({ent_name})")
-    results = []
-    for t in texts:
-        for found in [_.named for _ in parser.findall(t)]:
-            t = t.replace(f"[{found['entity']}]", found["entity"])
-            t = t.replace(f"({found['ent_name']})", "")
-        results.append(t)
-    return results
+    returns a list of strings without entity annotations. When a pandas
+    Series is passed in, a Series with the same index is returned.
+
+    Usage:
+
+    ```python
+    out = replace_ent_assignment(["[python](proglang) and [pandas]{entity:pkg}"])
+    assert out == ["python and pandas"]
+    ```
+    """
+    values = list(texts)
+    joined = "\n".join(values)
+    if joined.count("\n") == len(values) - 1:
+        # No text contains a newline, so the whole batch is handled in one go.
+        cleaned = "".join(ENTITY_ANNOTATION.split(joined)).split("\n")
+    else:
+        cleaned = ["".join(ENTITY_ANNOTATION.split(t)) for t in values]
+    if isinstance(texts, pd.Series):
+        return pd.Series(cleaned, index=texts.index, name=texts.name)
+    return cleaned
+
+
+# Like `ENTITY_ANNOTATION`, but with the parts of the annotation as groups.
+ENTITY_ANNOTATION_PARTS = re.compile(
+    r"\[(?P<text>[^\[\]\n]*)\]"
+    r"(?P<markup>\((?P<entity>[^()\n]*)\)|\{(?P<curly>[^{}\n]*)\})"
+)
+
+ENTITY_SPAN_COLUMNS = [
+    "example",
+    "start",
+    "end",
+    "text",
+    "entity",
+    "role",
+    "group",
+    "value",
+    "markup",
+]
+
+
+def _annotation_fields(entity, curly):
+    """The entity, role, group and value of `(entity:value)` or `{...}` markup."""
+    if entity is not None:
+        name, _, value = entity.partition(":")
+        return name, None, None, value or None
+    try:
+        fields = json.loads("{" + curly + "}")
+    except ValueError:
+        fields = None
+    if not isinstance(fields, dict):
+        return None, None, None, None
+    return tuple(fields.get(k) for k in ["entity", "role", "group", "value"])
+
+
+def parse_entities(texts):
+    """
+    Strips the entity annotations from Rasa style NLU strings and returns the clean
+    texts together with a table of entity spans. Every row of the table has the
+    `example` it belongs to, which is the index of `texts` when it is a pandas
+    Series, the `start` and `end` of the annotated `text` in the clean text, its
+    `entity`, `role`, `group` and synonym `value` and the annotation `markup` as it
+    was written. The clean texts are the same as those of `replace_ent_assignment`.
+
+    Usage:
+
+    ```python
+    from taipo.common import parse_entities
+    clean, spans = parse_entities(["i like [python](proglang)"])
+    assert clean == ["i like python"]
+    assert spans.loc[0, "entity"] == "proglang"
+    ```
+    """
+    with profile_stage("entities", rows=len(texts)):
+        clean, spans = _parse_entities(texts)
+    if isinstance(texts, pd.Series):
+        return pd.Series(clean, index=texts.index, name=texts.name), spans
+    return clean, spans
+
+
+def _parse_entities(texts):
+    index = texts.index if isinstance(texts, pd.Series) else range(len(texts))
+    clean, rows = [], []
+    for example, text in zip(index, texts):
+        parts, removed, last = [], 0, 0
+        for m in ENTITY_ANNOTATION_PARTS.finditer(text):
+            parts.append(text[last : m.start()])
+            parts.append(m["text"])
+            start = m.start() - removed
+            end = start + len(m["text"])
+            fields = _annotation_fields(m["entity"], m["curly"])
+            rows.append((example, start, end, m["text"], *fields, m["markup"]))
+            removed += len(m[0]) - len(m["text"])
+            last = m.end()
+        parts.append(text[last:])
+        clean.append("".join(parts))
+    return clean, pd.DataFrame(rows, columns=ENTITY_SPAN_COLUMNS)
+
+
+def _span_markup(span):
+    """The annotation of a span, as written or made from its fields."""
+    if isinstance(span.markup, str):
+        return span.markup
+    fields = {"entity": span.entity, "role": span.role, "group": span.group}
+    fields = {k: v for k, v in fields.items() if isinstance(v, str)}
+    if list(fields) == ["entity"]:
+        value = f":{span.value}" if isinstance(span.value, str) else ""
+        return f"({span.entity}{value})"
+    if isinstance(span.value, str):
+        fields["value"] = span.value
+    return json.dumps(fields)
+
+
+def add_entity_markup(texts, spans):
+    """
+    Puts the entity annotations of the `spans` table from `parse_entities` back into
+    the clean `texts`. The annotated text is taken from the clean text, so edits that
+    keep the length of a text, like keyboard typos, end up inside the annotations.
+
+    Usage:
+
+    ```python
+    from taipo.common import parse_entities, add_entity_markup
+    clean, spans = parse_entities(["i like [python](proglang)"])
+    assert add_entity_markup(clean, spans) == ["i like [python](proglang)"]
+    ```
+    """
+    index = texts.index if isinstance(texts, pd.Series) else range(len(texts))
+    # Tables made by hand can leave out the columns they don't need.
+    spans = spans.reindex(columns=ENTITY_SPAN_COLUMNS)
+    by_example = {
+        example: list(group.sort_values("start").itertuples())
+        for example, group in spans.groupby("example", sort=False)
+    }
+    result = []
+    for example, text in zip(index, texts):
+        parts, last = [], 0
+        for span in by_example.get(example, []):
+            parts.append(text[last : span.start])
+            parts.append(f"[{text[span.start : span.end]}]{_span_markup(span)}")
+            last = span.end
+        parts.append(text[last:])
+        result.append("".join(parts))
+    if isinstance(texts, pd.Series):
+        return pd.Series(result, index=texts.index, name=texts.name)
+    return result
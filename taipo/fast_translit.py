@@ -0,0 +1,182 @@
+"""
+Compiles the rules of a `transliterate` language pack into as few passes as possible.
+
+A language pack applies a chain of `str.replace` calls and `str.translate` tables to
+every text. Tables and replacements of a single character both map every character
+on its own, so runs of them are composed into one `str.translate` table and mostly
+the replacements of longer strings are left as a pre-pass. The compiled steps are
+stored on disk, so later runs skip the compilation.
+"""
+import os
+import json
+import pathlib
+import tempfile
+
+
+# Bump this when the layout of the compiled steps changes.
+FORMAT_VERSION = 1
+
+
+def cache_dir():
+    """The folder with compiled tables, `$TAIPO_CACHE_DIR` or `~/.cache/taipo`."""
+    default = pathlib.Path.home() / ".cache" / "taipo"
+    return pathlib.Path(os.environ.get("TAIPO_CACHE_DIR", default)) / "translit"
+
+
+def pack_steps(pack, reversed):
+    """
+    Lists the steps that `pack.translit` takes, in order, as `("lower",)`,
+    `("table", {char: replacement})` or `("replace", key, value)`.
+    """
+    steps = []
+    if type(pack).__name__ == "GeorgianLanguagePack":
+        # Georgian has no capitals, its pack lowercases before anything else.
+        steps.append(("lower",))
+
+    def replacements(mapping, keys):
+        return [("replace", key, mapping[key]) for key in keys or []]
+
+    if reversed:
+        if pack.reversed_specific_mapping:
+            steps.append(("table", _as_table(pack.reversed_specific_translation_table)))
+        if pack.reversed_specific_pre_processor_mapping:
+            steps += replacements(
+                pack.reversed_specific_pre_processor_mapping,
+                pack.reversed_specific_pre_processor_mapping_keys,
+            )
+        if pack.reversed_pre_processor_mapping:
+            steps += replacements(
+                pack.reversed_pre_processor_mapping,
+                pack.reversed_pre_processor_mapping_keys,
+            )
+        steps.append(("table", _as_table(pack.reversed_translation_table)))
+    else:
+        if pack.pre_processor_mapping:
+            steps += replacements(
+                pack.pre_processor_mapping, pack.pre_processor_mapping_keys
+            )
+        steps.append(("table", _as_table(pack.translation_table)))
+    return steps
+
+
+def _as_table(table):
+    """A `str.translate` table with characters as keys and strings as values."""
+    return {chr(k): v if isinstance(v, str) else chr(v) for k, v in table.items()}
+
+
+def _compose(first, second):
+    """A table that does what applying `first` and then `second` does."""
+    table = {c: "".join(second.get(x, x) for x in v) for c, v in first.items()}
+    for c, v in second.items():
+        table.setdefault(c, v)
+    return {c: v for c, v in table.items() if c != v}
+
+
+def compile_steps(steps):
+    """
+    Merges every run of replacements into a single `("replaces", [[key, value], ...])`
+    step and folds the replacements of single characters that border a table into
+    that table. A lone replacement that finds nothing is cheaper than an extra
+    `str.translate`, so those stay where they are.
+    """
+    merged = []
+    for step in steps:
+        single = step[0] == "replace" and len(step[1]) == 1
+        if single and merged and merged[-1][0] == "table":
+            step = ("table", {step[1]: step[2]})
+        if step[0] == "table" and merged and merged[-1][0] == "table":
+            merged[-1] = ("table", _compose(merged[-1][1], step[1]))
+        elif step[0] == "table" and merged and merged[-1][0] == "replaces":
+            rules = merged[-1][1]
+            while rules and len(rules[-1][0]) == 1:
+                key, value = rules.pop()
+                step = ("table", _compose({key: value}, step[1]))
+            if not rules:
+                merged.pop()
+            merged.append(step)
+        elif step[0] == "replace" and merged and merged[-1][0] == "replaces":
+            merged[-1][1].append([step[1], step[2]])
+        elif step[0] == "replace":
+            merged.append(("replaces", [[step[1], step[2]]]))
+        else:
+            merged.append(step)
+    return merged
+
+
+class FastTranslit:
+    """
+    Transliterates like the `transliterate` language pack for `lang`, in one
+    direction, with the compiled steps of `compile_steps`.
+
+    Usage:
+
+    ```python
+    from taipo.fast_translit import FastTranslit
+
+    translit = FastTranslit.load("ru", reversed=False)
+    translit("privet mir")
+    ```
+    """
+
+    def __init__(self, lang, reversed, steps):
+        self.lang = lang
+        self.reversed = reversed
+        self.steps = steps
+        self._funcs = [self._make_func(step) for step in steps]
+
+    @staticmethod
+    def _make_func(step):
+        kind = step[0]
+        if kind == "lower":
+            return str.lower
+        if kind == "table":
+            table = str.maketrans(step[1])
+            return lambda s: s.translate(table)
+        rules = [tuple(r) for r in step[1]]
+
+        def replace_all(s):
+            for key, value in rules:
+                s = s.replace(key, value)
+            return s
+
+        return replace_all
+
+    @classmethod
+    def compile(cls, lang, reversed):
+        from transliterate import get_translit_function
+
+        pack = get_translit_function(lang).__self__
+        return cls(lang, reversed, compile_steps(pack_steps(pack, reversed)))
+
+    @classmethod
+    def load(cls, lang, reversed, folder=None):
+        """Reads the compiled steps from disk, they are compiled and stored if missing."""
+        import transliterate
+
+        folder = pathlib.Path(folder or cache_dir())
+        direction = "reversed" if reversed else "forward"
+        version = getattr(transliterate, "__version__", "unknown")
+        path = folder / f"{lang}-{direction}-{version}-v{FORMAT_VERSION}.json"
+        if path.exists():
+            steps = [tuple(step) for step in json.loads(path.read_text("utf-8"))]
+            return cls(lang, reversed, steps)
+
+        compiled = cls.compile(lang, reversed)
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first, so readers never see half a file.
+            with tempfile.NamedTemporaryFile(
+                "w", dir=folder, suffix=".tmp", delete=False, encoding="utf-8"
+            ) as f:
+                json.dump(compiled.steps, f, ensure_ascii=False)
+            os.replace(f.name, path)
+        except OSError:
+            pass
+        return compiled
+
+    def __call__(self, value, reversed=None):
+        if reversed is not None and reversed != self.reversed:
+            raise ValueError("This FastTranslit was compiled for the other direction.")
+        for func in self._funcs:
+            value = func(value)
+        return value
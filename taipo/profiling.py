@@ -0,0 +1,233 @@
+import sys
+import json
+import time
+import types
+import pathlib
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def peak_rss_mb():
+    """The peak resident memory of this process so far in megabytes, if known."""
+    if resource is None:  # pragma: no cover
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports the peak in kilobytes, macOS in bytes.
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+# The stages of a command in the order that they run, other stages come after them.
+STAGES = ["load", "entities", "split", "augment", "serialize", "write"]
+
+
+class Stage:
+    """
+    The counters of a pipeline stage, summed over every time that it ran. The
+    `rss_growth_mb` is how much the peak memory of the process grew during the
+    stage, the most of all its runs. Memory that an earlier stage already used
+    doesn't count again, so a stage that reuses it shows no growth.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.rows = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rss_growth_mb = None
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "wall_seconds": self.wall,
+            "cpu_seconds": self.cpu,
+            "peak_rss_growth_mb": self.rss_growth_mb,
+        }
+
+
+class Profiler:
+    """
+    Keeps the wall time, CPU time, growth of the peak memory and number of rows of
+    every stage of a command. Stages are only counted once the profiler is enabled,
+    before that a stage costs next to nothing. A stage that runs inside a stage with
+    the same name is part of the outer one, stages on other threads are counted on
+    their own. The CPU time of a stage is that of the thread that runs it, the work
+    of worker processes is only in the wall time.
+
+    Usage:
+
+    ```python
+    from taipo.profiling import PROFILER, profile_stage
+    PROFILER.enable()
+    with profile_stage("load") as stage:
+        df = nlu_path_to_dataframe("nlu.yml")
+        stage.rows = len(df)
+    PROFILER.print_report()
+    ```
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.started = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+        self.started = (time.perf_counter(), time.process_time())
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.stages = {}
+        self.started = None
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=0):
+        """
+        Counts the block as a run of the stage `name`. The `rows` can also be set on
+        the object that the block gets, once the number is known.
+        """
+        counter = types.SimpleNamespace(rows=rows)
+        active = getattr(self._local, "active", None)
+        if active is None:
+            active = self._local.active = set()
+        if not self.enabled or name in active:
+            yield counter
+            return
+        active.add(name)
+        wall, cpu, peak = time.perf_counter(), time.thread_time(), peak_rss_mb()
+        try:
+            yield counter
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            active.discard(name)
+            growth = None if peak is None else peak_rss_mb() - peak
+            with self._lock:
+                stage = self.stages.setdefault(name, Stage(name))
+                stage.calls += 1
+                stage.rows += counter.rows or 0
+                stage.wall += wall
+                stage.cpu += cpu
+                if growth is not None:
+                    stage.rss_growth_mb = max(stage.rss_growth_mb or 0.0, growth)
+
+    def total(self):
+        """The wall and CPU seconds since the profiler was enabled."""
+        if self.started is None:
+            return 0.0, 0.0
+        return (
+            time.perf_counter() - self.started[0],
+            time.process_time() - self.started[1],
+        )
+
+    def report(self):
+        """The counters of every stage and of the whole run as a dictionary."""
+        wall, cpu = self.total()
+        names = sorted(
+            self.stages, key=lambda n: STAGES.index(n) if n in STAGES else len(STAGES)
+        )
+        return {
+            "stages": {name: self.stages[name].as_dict() for name in names},
+            "total": {
+                "wall_seconds": wall,
+                "cpu_seconds": cpu,
+                "peak_rss_mb": peak_rss_mb(),
+            },
+        }
+
+    def table(self):
+        """A rich table with a row for every stage and a total."""
+        from rich.table import Table
+
+        def fmt(value, spec):
+            return "-" if value is None else format(value, spec)
+
+        report = self.report()
+        table = Table(
+            title="taipo profile",
+            caption="rss: growth of the peak memory, the process peak for the total\n"
+            "cpu: the thread that runs the stage, without worker processes",
+        )
+        for column in [
+            "stage",
+            "calls",
+            "rows",
+            "wall (s)",
+            "cpu (s)",
+            "rss (MB)",
+        ]:
+            table.add_column(column, justify="left" if column == "stage" else "right")
+        for name, s in report["stages"].items():
+            table.add_row(
+                name,
+                str(s["calls"]),
+                f"{s['rows']:,}",
+                f"{s['wall_seconds']:.3f}",
+                f"{s['cpu_seconds']:.3f}",
+                fmt(s["peak_rss_growth_mb"], "+.1f"),
+            )
+        total = report["total"]
+        table.add_row(
+            "total",
+            "",
+            "",
+            f"{total['wall_seconds']:.3f}",
+            f"{total['cpu_seconds']:.3f}",
+            fmt(total["peak_rss_mb"], ".1f"),
+            style="bold",
+        )
+        return table
+
+    def print_report(self):
+        from rich.console import Console
+
+        Console().print(self.table())
+
+    def dump_json(self, path):
+        pathlib.Path(path).write_text(json.dumps(self.report(), indent=2) + "\n")
+
+
+# The profiler that the stages of all commands report to.
+PROFILER = Profiler()
+
+
+def profile_stage(name, rows=0):
+    """Counts a block as a run of the stage `name` of the global `PROFILER`."""
+    return PROFILER.stage(name, rows=rows)
+
+
+def start_profiling(json_path=None, stats_path=None):
+    """
+    Enables the global `PROFILER`, and `cProfile` when there is a `stats_path`, and
+    returns the function that stops them again. That function prints the table of
+    stages and writes the json and pstats files.
+    """
+    profile = None
+    if stats_path is not None:
+        import cProfile
+
+        profile = cProfile.Profile()
+    PROFILER.reset()
+    PROFILER.enable()
+    if profile is not None:
+        profile.enable()
+
+    def stop():
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(str(stats_path))
+        PROFILER.disable()
+        PROFILER.print_report()
+        if json_path is not None:
+            PROFILER.dump_json(json_path)
+
+    return stop
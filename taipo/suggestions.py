@@ -0,0 +1,185 @@
+import os
+import csv
+import json
+import heapq
+import hashlib
+import contextlib
+import shutil
+import pathlib
+
+
+def suggestion_fields(top_k=1, source_file=False):
+    """
+    The columns of a suggestions file. Next to the predicted intent there is a
+    `pred_intent_{rank}` and `confidence_{rank}` column for every other intent in
+    the `top_k` of the ranking, the file of every example comes last if it is known.
+    """
+    fields = ["text", "intent", "pred_intent", "confidence"]
+    for rank in range(2, top_k + 1):
+        fields.extend([f"pred_intent_{rank}", f"confidence_{rank}"])
+    if source_file:
+        fields.append("source_file")
+    return fields
+
+
+def suggestion_rows(columns, offset, predictions, top_k=1):
+    """
+    Yields a row for every prediction with an intent that differs from the label.
+
+    The `columns` hold the `text`, `intent` and maybe `source_file` of all examples
+    and the `predictions` are those of the examples from `offset` on. A prediction
+    is a dictionary with the `name` and `confidence` of the predicted intent and the
+    `ranking` of intents like the `intent_ranking` of Rasa, best first.
+    """
+    for idx, prediction in enumerate(predictions, start=offset):
+        if prediction["name"] == columns["intent"][idx]:
+            continue
+        row = {
+            "example": idx,
+            "text": columns["text"][idx],
+            "intent": columns["intent"][idx],
+            "pred_intent": prediction["name"],
+            "confidence": prediction["confidence"],
+        }
+        others = [
+            r for r in prediction.get("ranking") or [] if r[0] != row["pred_intent"]
+        ]
+        for rank in range(2, top_k + 1):
+            name, confidence = (
+                others[rank - 2] if rank - 2 < len(others) else (None, None)
+            )
+            row[f"pred_intent_{rank}"] = name
+            row[f"confidence_{rank}"] = confidence
+        if "source_file" in columns:
+            row["source_file"] = columns["source_file"][idx]
+        yield row
+
+
+def data_fingerprint(*columns):
+    """
+    A hash of the values of all `columns`, so that a checkpoint is only continued
+    for the examples that it was made for.
+    """
+    digest = hashlib.sha256()
+    for column in columns:
+        for value in column:
+            digest.update(json.dumps(value).encode("utf-8") + b"\n")
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _sort_key(row):
+    """The most confident suggestions come first, ties keep the order of the file."""
+    return -float(row["confidence"] or 0), int(row["example"])
+
+
+def _write_atomic(path, write):
+    """Calls `write` on a temporary file that then replaces `path` in one step."""
+    tmp = pathlib.Path(f"{path}.tmp")
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+class SuggestionWriter:
+    """
+    Streams suggestions to disk in sorted runs of at most `chunk_size` examples, and
+    merges the runs into one file at `out_path` that is sorted by confidence once it
+    closes. The runs are kept in a `{out_path}.parts` folder with a checkpoint of the
+    number of examples that were handled. When that folder exists for the same
+    `config`, the writer continues from the checkpoint and `done` holds the number of
+    examples that can be skipped. The folder stays on disk when the block raises.
+
+    Usage:
+
+    ```python
+    from taipo.suggestions import SuggestionWriter, suggestion_fields
+    with SuggestionWriter("checkthese.csv", suggestion_fields(), config) as writer:
+        for rows, n_examples in batches[writer.done:]:
+            writer.add(rows, n_examples)
+    ```
+    """
+
+    def __init__(self, out_path, fields, config, chunk_size=10_000):
+        self.out_path = pathlib.Path(out_path)
+        self.parts = self.out_path.with_name(f"{self.out_path.name}.parts")
+        self.fields = list(fields)
+        self.config = config
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.pending = 0
+        self.done = 0
+        self.runs = []
+        self._resume()
+
+    def _resume(self):
+        checkpoint = self.parts / "checkpoint.json"
+        if checkpoint.exists():
+            state = json.loads(checkpoint.read_text())
+            if state["config"] == self.config and state["fields"] == self.fields:
+                self.done, self.runs = state["done"], state["runs"]
+                return
+        shutil.rmtree(self.parts, ignore_errors=True)
+        self.parts.mkdir(parents=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+
+    def add(self, rows, n_examples):
+        """Adds the suggestions of the next `n_examples` examples."""
+        self.rows.extend(rows)
+        self.pending += n_examples
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending suggestions as a sorted run and moves the checkpoint."""
+        if self.rows:
+            run = f"run-{len(self.runs):05d}.csv"
+
+            def write(f):
+                writer = csv.DictWriter(f, fieldnames=["example", *self.fields])
+                writer.writeheader()
+                writer.writerows(sorted(self.rows, key=_sort_key))
+
+            _write_atomic(self.parts / run, write)
+            self.runs.append(run)
+        self.done += self.pending
+        self.rows, self.pending = [], 0
+        state = dict(config=self.config, fields=self.fields, done=self.done)
+        _write_atomic(
+            self.parts / "checkpoint.json",
+            lambda f: json.dump({**state, "runs": self.runs}, f),
+        )
+
+    def close(self):
+        """Merges the sorted runs into `out_path` and returns the number of rows."""
+        self.flush()
+        with contextlib.ExitStack() as stack:
+            readers = [
+                csv.DictReader(
+                    stack.enter_context(
+                        open(self.parts / run, encoding="utf-8", newline="")
+                    )
+                )
+                for run in self.runs
+            ]
+            count = 0
+
+            def write(f):
+                nonlocal count
+                writer = csv.DictWriter(
+                    f, fieldnames=self.fields, extrasaction="ignore"
+                )
+                writer.writeheader()
+                for row in heapq.merge(*readers, key=_sort_key):
+                    writer.writerow(row)
+                    count += 1
+
+            _write_atomic(self.out_path, write)
+        shutil.rmtree(self.parts)
+        return count
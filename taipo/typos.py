@@ -0,0 +1,269 @@
+"""
+A keyboard typo generator that handles a whole batch of texts with numpy.
+
+The keyboard layouts in `taipo/res/keyboard` are taken from nlpaug (MIT licensed).
+"""
+import re
+import json
+import pathlib
+import functools
+
+import numpy as np
+
+from taipo.common import trie_regex, ENTITY_MARKUP
+
+
+KEYBOARD_DIR = pathlib.Path(__file__).parent / "res" / "keyboard"
+
+# Codepoints outside of the basic multilingual plane are never part of a word.
+_BMP_SIZE = 0x10000
+
+
+def keyboard_languages():
+    """Lists the languages that have a keyboard layout."""
+    return sorted(p.stem for p in KEYBOARD_DIR.glob("*.json"))
+
+
+def _is_lower_letter(char):
+    return len(char) == 1 and char.isalpha() and not char.isupper()
+
+
+@functools.lru_cache(maxsize=None)
+def keyboard_table(lang):
+    """
+    Returns the neighbours on the keyboard layout of `lang` as two arrays indexed by
+    codepoint. `counts[c]` holds the number of neighbours of `c` and the neighbours
+    themselves are in `neighbours[c, :counts[c]]`. Only lower case letters are kept.
+    """
+    path = KEYBOARD_DIR / f"{lang}.json"
+    if not path.exists():
+        raise ValueError(
+            f"No keyboard layout for {lang}, choose from {keyboard_languages()}."
+        )
+    layout = json.loads(path.read_text(encoding="utf-8"))
+    mapping = {}
+    for key, values in layout.items():
+        if not _is_lower_letter(key):
+            continue
+        keep = sorted({v for v in values if _is_lower_letter(v) and v != key})
+        if keep:
+            mapping[ord(key)] = [ord(v) for v in keep]
+
+    size = max(mapping, default=0) + 1
+    width = max((len(v) for v in mapping.values()), default=1)
+    counts = np.zeros(size, dtype=np.int64)
+    neighbours = np.zeros((size, width), dtype=np.uint32)
+    for key, values in mapping.items():
+        counts[key] = len(values)
+        neighbours[key, : len(values)] = values
+    return counts, neighbours
+
+
+@functools.lru_cache(maxsize=None)
+def _word_chars():
+    """Boolean lookup of the codepoints that `\\w` matches."""
+    chars = "".join(map(chr, range(_BMP_SIZE)))
+    mask = np.zeros(_BMP_SIZE, dtype=bool)
+    for match in re.finditer(r"\w+", chars):
+        mask[match.start() : match.end()] = True
+    return mask
+
+
+def _lookup(table, codes, default=0):
+    """Looks up `codes` in `table`, codes beyond the table get `default`."""
+    inside = codes < len(table)
+    return np.where(inside, table[np.where(inside, codes, 0)], default)
+
+
+def _group_ranks(groups):
+    """Gives every element its position within its run of equal `groups`."""
+    if len(groups) == 0:
+        return np.zeros(0, dtype=np.int64)
+    firsts = np.searchsorted(groups, groups, side="left")
+    return np.arange(len(groups)) - firsts
+
+
+def _sample_per_group(groups, wanted):
+    """
+    Picks `wanted[g]` random elements without replacement out of every group `g`.
+    The `groups` need to be sorted and every group must have enough elements.
+    """
+    # The groups are integers, adding keys in [0, 1) shuffles within every group.
+    order = np.argsort(groups + np.random.random(len(groups)))
+    ranks = _group_ranks(groups[order])
+    return np.sort(order[ranks < wanted[groups[order]]])
+
+
+def _n_to_change(sizes, p, n_min, n_max, available):
+    """Mirrors nlpaug, a fraction `p` of `sizes` clipped to `[n_min, n_max]`."""
+    n = np.clip(np.ceil(p * sizes).astype(np.int64), n_min, n_max)
+    return np.minimum(n, available)
+
+
+class KeyboardTypos:
+    """
+    Adds keyboard typos to texts, like nlpaug's `KeyboardAug`, but for a whole batch
+    at once. Characters are replaced by a neighbouring key in place, so the texts are
+    never tokenized and the `(...)` or `{...}` markup of entity annotations is never
+    changed, only the annotated text can get typos.
+
+    Words shorter than `min_char` and words in `stopwords` are never changed. Per text
+    a fraction `aug_word_p` of the words is picked and per picked word a fraction
+    `aug_char_p` of the letters that have a neighbour on the keyboard.
+
+    Random numbers are drawn from `np.random`, so `np.random.seed` makes it reproducible.
+
+    Usage:
+
+    ```python
+    from taipo.typos import KeyboardTypos
+
+    aug = KeyboardTypos(lang="en", stopwords=["python"])
+    aug.augment(["i want to learn [python](proglang)"])
+    ```
+    """
+
+    def __init__(
+        self,
+        aug_char_min=1,
+        aug_char_max=3,
+        aug_char_p=0.3,
+        aug_word_min=1,
+        aug_word_max=3,
+        aug_word_p=0.3,
+        min_char=4,
+        lang="en",
+        stopwords=None,
+    ):
+        self.aug_char_min = aug_char_min
+        self.aug_char_max = aug_char_max
+        self.aug_char_p = aug_char_p
+        self.aug_word_min = aug_word_min
+        self.aug_word_max = aug_word_max
+        self.aug_word_p = aug_word_p
+        self.min_char = min_char
+        self.lang = lang
+        self.counts, self.neighbours = keyboard_table(lang)
+        self.stopwords = stopwords
+
+    @property
+    def stopwords(self):
+        return self._stopwords
+
+    @stopwords.setter
+    def stopwords(self, words):
+        self._stopwords = list(words or [])
+        # Only stopwords made of word characters can ever be equal to a word.
+        words = [w for w in self._stopwords if re.fullmatch(r"\w+", w)]
+        self._stopword_regex = None
+        if words:
+            self._stopword_regex = re.compile(
+                rf"(?<!\w)(?:{trie_regex(words).pattern})(?!\w)"
+            )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_stopword_regex"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stopwords = self._stopwords
+
+    def _stopword_starts(self, text):
+        if self._stopword_regex is None:
+            return np.zeros(0, dtype=np.int64)
+        starts = [m.start() for m in self._stopword_regex.finditer(text)]
+        return np.array(starts, dtype=np.int64)
+
+    @staticmethod
+    def _overlaps(joined, texts, bounds, protect, starts, lengths):
+        """
+        Whether every word overlaps with the `(...)` or `{...}` markup of an entity
+        annotation or with one of the `protect` ranges.
+        """
+        ranges = [
+            (m.end("text") + 1, m.end())
+            for m in ENTITY_MARKUP.finditer(joined)
+            if m.end() > m.end("text") + 1
+        ]
+        if protect is not None:
+            offsets = bounds - np.array([len(t) + 1 for t in texts])
+            ranges += [
+                (o + a, o + b) for o, spans in zip(offsets, protect) for a, b in spans
+            ]
+        marks = np.zeros(bounds[-1] + 1, dtype=np.int64)
+        for first, last in ranges:
+            marks[first] += 1
+            marks[last] -= 1
+        protected = np.concatenate(([0], np.cumsum(np.cumsum(marks) > 0)))
+        return protected[starts + lengths] > protected[starts]
+
+    def augment(self, texts, n=1, protect=None):
+        """
+        Returns a misspelled copy of `texts`. Like nlpaug, a single string gives back
+        a single string and a list of strings gives back a list.
+
+        The markup of entity annotations, like `(city)` or `{"entity": "city"}`, is
+        never changed. The `protect` argument holds a list of extra `(start, end)`
+        character ranges per text, like the entity spans of
+        `taipo.common.parse_entities`. Words that overlap with one of them are never
+        changed either.
+        """
+        if n != 1:
+            raise ValueError("KeyboardTypos only makes a single copy, use n=1.")
+        if isinstance(texts, str):
+            protect = None if protect is None else [protect]
+            return self.augment([texts], protect=protect)[0]
+        if len(texts) == 0:
+            return []
+
+        joined = "\n".join(texts)
+        codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).copy()
+        bounds = np.cumsum([len(t) + 1 for t in texts])
+
+        # Words are runs of word characters, a text never has a word across a newline.
+        is_word = _lookup(_word_chars(), codes, default=False)
+        edges = np.diff(np.concatenate(([0], is_word.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        lengths = np.flatnonzero(edges == -1) - starts
+        text_ids = np.searchsorted(bounds, starts, side="right")
+
+        eligible = lengths >= self.min_char
+        eligible &= ~np.isin(starts, self._stopword_starts(joined))
+        eligible &= ~self._overlaps(joined, texts, bounds, protect, starts, lengths)
+        candidates = np.flatnonzero(eligible)
+        n_words = _n_to_change(
+            np.bincount(text_ids, minlength=len(texts)),
+            self.aug_word_p,
+            self.aug_word_min,
+            self.aug_word_max,
+            np.bincount(text_ids[candidates], minlength=len(texts)),
+        )
+        picked = candidates[_sample_per_group(text_ids[candidates], n_words)]
+
+        # Every character of every picked word, with the word it belongs to.
+        word_lengths = lengths[picked]
+        word_ids = np.repeat(np.arange(len(picked)), word_lengths)
+        offsets = np.arange(len(word_ids)) - np.repeat(
+            np.cumsum(word_lengths) - word_lengths, word_lengths
+        )
+        positions = starts[picked][word_ids] + offsets
+        n_options = _lookup(self.counts, codes[positions])
+        mappable = np.flatnonzero(n_options > 0)
+
+        n_chars = _n_to_change(
+            word_lengths,
+            self.aug_char_p,
+            self.aug_char_min,
+            self.aug_char_max,
+            np.bincount(word_ids[mappable], minlength=len(picked)),
+        )
+        chosen = mappable[_sample_per_group(word_ids[mappable], n_chars)]
+
+        choice = (np.random.random(len(chosen)) * n_options[chosen]).astype(np.int64)
+        old = codes[positions[chosen]]
+        codes[positions[chosen]] = self.neighbours[old, choice]
+
+        result = codes.tobytes().decode("utf-32-le")
+        return [result[b - len(t) - 1 : b - 1] for t, b in zip(texts, bounds)]
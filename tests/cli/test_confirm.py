@@ -0,0 +1,251 @@
+import os
+import sys
+import time
+import types
+import pytest
+import pandas as pd
+from typer.testing import CliRunner
+
+from taipo.__main__ import app
+from taipo.cli.confirm import (
+    model_fingerprint,
+    parse_batch,
+    predict_batches,
+    _load_process_interpreter,
+    _parse_predictions,
+)
+from taipo.suggestions import SuggestionWriter, suggestion_fields, suggestion_rows
+
+runner = CliRunner()
+
+
+@pytest.mark.parametrize("folds", ["1", "2"])
+def test_confirm_logistic(tmp_path, folds):
+    """Ensure basic usage of command works."""
+    cmd = [
+        "confirm",
+        "logistic",
+        "tests/data/nlu/nlu.yml",
+        f"{tmp_path}/checkthese.csv",
+        "--folds",
+        folds,
+    ]
+    res = runner.invoke(app, cmd)
+    assert res.exit_code == 0
+    df = pd.read_csv(f"{tmp_path}/checkthese.csv")
+    assert list(df.columns) == ["text", "intent", "pred_intent", "confidence"]
+    assert (df["intent"] != df["pred_intent"]).all()
+    assert df["confidence"].is_monotonic_decreasing
+
+
+def test_confirm_logistic_folder(nlu_folder, tmp_path):
+    """Suggestions for a folder point to the file that holds the example."""
+    cmd = ["confirm", "logistic", str(nlu_folder), f"{tmp_path}/checkthese.csv"]
+    res = runner.invoke(app, cmd + ["--workers", "2"])
+    assert res.exit_code == 0
+    df = pd.read_csv(f"{tmp_path}/checkthese.csv")
+    assert list(df.columns) == [
+        "text",
+        "intent",
+        "pred_intent",
+        "confidence",
+        "source_file",
+    ]
+    assert set(df["source_file"]) <= {"first.yml", "nested/second.yml"}
+
+
+def test_model_fingerprint(tmp_path):
+    """A folder points to its newest model, a new or retrained model changes it."""
+    old, new = tmp_path / "old.tar.gz", tmp_path / "new.tar.gz"
+    old.write_bytes(b"old model")
+    assert model_fingerprint(tmp_path) == model_fingerprint(old)
+    time.sleep(0.05)
+    new.write_bytes(b"new model")
+    assert model_fingerprint(tmp_path) == model_fingerprint(new)
+    assert model_fingerprint(tmp_path)["path"] == str(new.resolve())
+
+    before = model_fingerprint(new)
+    new.write_bytes(b"retrained model")
+    assert model_fingerprint(new)["size"] != before["size"]
+    os.utime(new, (2_000_000, 2_000_000))
+    assert model_fingerprint(new)["mtime"] == 2_000_000
+
+
+def test_writer_starts_over_for_another_model(tmp_path):
+    """A checkpoint of `confirm rasa-model` is dropped once the model changes."""
+    model = tmp_path / "model.tar.gz"
+    model.write_bytes(b"model")
+    fields, out = suggestion_fields(), tmp_path / "checkthese.csv"
+    writer = SuggestionWriter(out, fields, {"model": model_fingerprint(model)})
+    writer.add([], 100)
+    writer.flush()
+    assert SuggestionWriter(out, fields, {"model": model_fingerprint(model)}).done
+    model.write_bytes(b"retrained model")
+    assert SuggestionWriter(out, fields, {"model": model_fingerprint(model)}).done == 0
+
+
+class StubMessage:
+    """Stands in for the `Message` of Rasa, without Rasa installed."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def set(self, prop, info):
+        self.data[prop] = info
+
+    def as_dict(self, only_output_properties=False):
+        return {k: v for k, v in self.data.items() if not k.startswith("_")}
+
+
+class StubTokenizer:
+    """Fails on empty texts, like some Rasa components do."""
+
+    def process(self, message, **kwargs):
+        if not message.data["text"]:
+            raise ValueError("Empty text.")
+        message.set("_tokens", message.data["text"].split())
+
+
+class StubClassifier:
+    def process(self, message, **kwargs):
+        tokens = message.data["_tokens"]
+        name = "greet" if "hi" in tokens else "other"
+        confidence = round(1 / (1 + len(tokens)), 3)
+        message.set("intent", {"name": name, "confidence": confidence})
+        message.set(
+            "intent_ranking",
+            [
+                {"name": name, "confidence": confidence},
+                {"name": "rest", "confidence": round(1 - confidence, 3)},
+            ],
+        )
+
+
+class StubInterpreter:
+    """The parts of a Rasa `Interpreter` that `parse_batch` uses."""
+
+    context = {}
+
+    def __init__(self):
+        self.pipeline = [StubTokenizer(), StubClassifier()]
+
+    def default_output_attributes(self):
+        return {"intent": {"name": None, "confidence": 0.0}, "entities": []}
+
+    def parse(self, text):
+        """The `Interpreter.parse` of Rasa, one text at a time."""
+        if not text:
+            output = self.default_output_attributes()
+            output["text"] = ""
+            return output
+        data = self.default_output_attributes()
+        data["text"] = text
+        message = StubMessage(data=data)
+        for component in self.pipeline:
+            component.process(message, **self.context)
+        output = self.default_output_attributes()
+        output.update(message.as_dict(only_output_properties=True))
+        return output
+
+
+def stub_message_module():
+    """A `rasa.shared.nlu.training_data.message` module with the `StubMessage`."""
+    module = types.ModuleType("rasa.shared.nlu.training_data.message")
+    module.Message = StubMessage
+    return module
+
+
+@pytest.fixture
+def stub_message(monkeypatch):
+    module = stub_message_module()
+    monkeypatch.setitem(sys.modules, module.__name__, module)
+
+
+TEXTS = ["hi there", "", " ", "\n", "hi", "what is this", "  hi  ", "bye now hi"]
+
+
+def test_parse_batch_matches_parse(stub_message):
+    """Empty texts are skipped, texts with only whitespace go through the pipeline."""
+    interpreter = StubInterpreter()
+    expected = [interpreter.parse(text) for text in TEXTS]
+    assert parse_batch(interpreter, TEXTS) == expected
+    assert expected[1] == {**interpreter.default_output_attributes(), "text": ""}
+    assert expected[2]["intent"] == {"name": "other", "confidence": 1.0}
+
+
+class StubNLUInterpreter:
+    """Holds the `StubInterpreter` like a `RasaNLUInterpreter` holds its own."""
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.interpreter = StubInterpreter()
+
+
+def load_stub_interpreter(model_path):
+    """Loads the stub, also in worker processes that don't have the stub message."""
+    module = stub_message_module()
+    sys.modules.setdefault(module.__name__, module)
+    return StubNLUInterpreter(model_path)
+
+
+def test_parse_predictions(stub_message):
+    _load_process_interpreter("models/stub.tar.gz", loader=load_stub_interpreter)
+    assert _parse_predictions(["hi there", "", "what is this"], top_k=2) == [
+        {
+            "name": "greet",
+            "confidence": 0.333,
+            "ranking": [("greet", 0.333), ("rest", 0.667)],
+        },
+        {"name": None, "confidence": 0.0, "ranking": []},
+        {
+            "name": "other",
+            "confidence": 0.25,
+            "ranking": [("other", 0.25), ("rest", 0.75)],
+        },
+    ]
+
+
+def _parse_batches_one_by_one(batches):
+    """The predictions of `parse` on every text of every batch, with a top 2."""
+    interpreter = StubInterpreter()
+    return [
+        [
+            {
+                "name": p["intent"]["name"],
+                "confidence": p["intent"]["confidence"],
+                "ranking": [
+                    (r["name"], r["confidence"]) for r in p.get("intent_ranking", [])
+                ][:2],
+            }
+            for p in (interpreter.parse(text) for text in batch)
+        ]
+        for batch in batches
+    ]
+
+
+def test_predict_batches_independent_of_workers(stub_message):
+    """The batches come back in order and give the same rows for any workers."""
+    texts = [f"{'hi ' if i % 3 else ''}example {'x ' * (i % 7)}{i}" for i in range(50)]
+    texts[10:13] = ["", " ", "hi"]
+    columns = {"text": texts, "intent": ["greet"] * len(texts)}
+    batches = [texts[i : i + 8] for i in range(0, len(texts), 8)]
+    expected = _parse_batches_one_by_one(batches)
+    rows = []
+    for workers in [1, 2]:
+        with predict_batches(
+            "models/stub.tar.gz",
+            batches,
+            workers=workers,
+            top_k=2,
+            loader=load_stub_interpreter,
+        ) as parsed_batches:
+            parsed = list(parsed_batches)
+        assert parsed == expected
+        rows.append(
+            [
+                row
+                for offset, predictions in zip(range(0, len(texts), 8), parsed)
+                for row in suggestion_rows(columns, offset, predictions, top_k=2)
+            ]
+        )
+    assert rows[0] == rows[1]
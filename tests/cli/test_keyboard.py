@@ -2,10 +2,16 @@ import pathlib
 import re
 
 import pytest
+import yaml
 from typer.testing import CliRunner
 
 from taipo.__main__ import app
 from taipo.common import nlu_path_to_dataframe
+from taipo.cli.keyboard import (
+    add_spelling_errors,
+    chained_reverse_tokenizer,
+    custom_reverse_tokenizer,
+)
 
 runner = CliRunner()
 
@@ -44,6 +50,18 @@ def test_keyboard_augment_keeps_annotations(tmp_path):
         assert len(annotations_in) == len(annotations_out)
 
 
+def test_keyboard_augment_keeps_sections(tmp_path):
+    """The regexes and synonyms of the file are copied as they are."""
+    cmd = ["keyboard", "augment", "tests/data/nlu/nlu.yml", f"{tmp_path}/nlu.yml"]
+    result = runner.invoke(app, cmd)
+    assert result.exit_code == 0
+    items_in = yaml.safe_load(pathlib.Path("tests/data/nlu/nlu.yml").read_text())
+    items_out = yaml.safe_load((tmp_path / "nlu.yml").read_text())
+    sections_in = [i for i in items_in["nlu"] if "intent" not in i]
+    assert sections_in
+    assert [i for i in items_out["nlu"] if "intent" not in i] == sections_in
+
+
 @pytest.mark.parametrize(
     "lang", ["de", "en", "es", "fr", "he", "it", "nl", "pl", "th", "uk"]
 )
@@ -82,3 +100,241 @@ def test_keyboard_generate():
         assert pathlib.Path(f).exists()
         pathlib.Path(f).unlink()
     assert res.exit_code == 0
+
+
+def test_keyboard_generate_workers(tmp_path, monkeypatch):
+    """The typo processes start next to the writer threads and give the same files."""
+    nlu_path = pathlib.Path("data/nlu-orig.yml").resolve()
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "test").mkdir()
+    outputs = []
+    for workers in ["1", "2"]:
+        cmd = ["keyboard", "generate", str(nlu_path), "--engine", "native"]
+        res = runner.invoke(app, cmd + ["--seed-aug", "42", "--workers", workers])
+        assert res.exit_code == 0
+        outputs.append(
+            [
+                (tmp_path / f).read_text()
+                for f in [
+                    "data/misspelled-nlu-train.yml",
+                    "test/misspelled-nlu-valid.yml",
+                ]
+            ]
+        )
+    assert outputs[0] == outputs[1]
+
+
+def test_keyboard_augment_workers_reproducible(tmp_path):
+    """The same seed should give the same typos, regardless of the workers."""
+    for workers in ["1", "2"]:
+        cmd = [
+            "keyboard",
+            "augment",
+            "data/nlu-entities.yml",
+            f"{tmp_path}/nlu-{workers}.yml",
+            "--seed-aug",
+            "42",
+            "--workers",
+            workers,
+        ]
+        res = runner.invoke(app, cmd)
+        assert res.exit_code == 0
+    single = pathlib.Path(f"{tmp_path}/nlu-1.yml").read_text()
+    double = pathlib.Path(f"{tmp_path}/nlu-2.yml").read_text()
+    assert single == double
+    original = pathlib.Path("data/nlu-entities.yml").read_text()
+    assert single != original
+
+
+def test_add_spelling_errors_shards_independent_of_workers():
+    """Shards get their own seed, so spreading them over processes changes nothing."""
+    import nlpaug.augmenter.char as nac
+
+    dataf = nlu_path_to_dataframe("data/nlu-entities.yml")
+    outputs = []
+    for workers in [1, 3]:
+        aug = nac.KeyboardAug(include_special_char=False, include_numeric=False)
+        out = add_spelling_errors(dataf, aug=aug, workers=workers, seed=1, shard_size=7)
+        outputs.append(list(out["text"]))
+    assert outputs[0] == outputs[1]
+    assert outputs[0] != list(dataf["text"])
+
+
+@pytest.mark.parametrize("lang", ["de", "en", "he", "uk"])
+def test_keyboard_augment_native_engine(tmp_path, lang):
+    """The native engine keeps every example and the entity annotations."""
+    cmd = [
+        "keyboard",
+        "augment",
+        "data/nlu-entities.yml",
+        f"{tmp_path}/nlu.yml",
+        "--engine",
+        "native",
+        "--lang",
+        lang,
+        "--seed-aug",
+        "42",
+    ]
+    res = runner.invoke(app, cmd)
+    assert res.exit_code == 0
+    df_in = nlu_path_to_dataframe("data/nlu-entities.yml").sort_values(
+        "intent", kind="stable"
+    )
+    df_out = nlu_path_to_dataframe(f"{tmp_path}/nlu.yml")
+    assert df_out.shape == df_in.shape
+    annotation_pattern = r"\]\(\w+\)"
+    for text_in, text_out in zip(df_in.text, df_out.text):
+        assert re.findall(annotation_pattern, text_in) == re.findall(
+            annotation_pattern, text_out
+        )
+
+
+def test_keyboard_augment_unknown_engine(tmp_path):
+    cmd = [
+        "keyboard",
+        "augment",
+        "tests/data/nlu/nlu.yml",
+        f"{tmp_path}/nlu.yml",
+        "--engine",
+        "foobar",
+    ]
+    res = runner.invoke(app, cmd)
+    assert res.exit_code == 1
+    assert not pathlib.Path(f"{tmp_path}/nlu.yml").exists()
+
+
+@pytest.mark.parametrize(
+    "toks,expected",
+    [
+        (
+            "going to [ New York ] ( city ) today".split(),
+            "going to [New York](city) today",
+        ),
+        ("[ python ] ( proglang ) is fun !".split(), "[python](proglang) is fun!"),
+        ("is it ' ok ' ?".split(), "is it ' ok '?"),
+    ],
+)
+def test_reverse_tokenizer_examples(toks, expected):
+    assert custom_reverse_tokenizer(toks) == expected
+    assert chained_reverse_tokenizer(toks) == expected
+
+
+def test_keyboard_augment_n_variants(tmp_path):
+    """All copies end up in one file, or in numbered files with --split-variants."""
+    base = ["keyboard", "augment", "data/nlu-entities.yml"]
+    seed = ["--seed-aug", "42", "--engine", "native"]
+    res = runner.invoke(app, base + [f"{tmp_path}/single.yml"] + seed)
+    assert res.exit_code == 0
+    res = runner.invoke(app, base + [f"{tmp_path}/nlu.yml", "--n-variants", "3"] + seed)
+    assert res.exit_code == 0
+    res = runner.invoke(
+        app,
+        base
+        + [f"{tmp_path}/split.yml", "--n-variants", "3", "--split-variants"]
+        + seed,
+    )
+    assert res.exit_code == 0
+
+    n_examples = nlu_path_to_dataframe("data/nlu-entities.yml").shape[0]
+    assert nlu_path_to_dataframe(f"{tmp_path}/nlu.yml").shape[0] == 3 * n_examples
+    variants = [
+        pathlib.Path(f"{tmp_path}/split-{i}.yml").read_text() for i in [1, 2, 3]
+    ]
+    assert len(set(variants)) == 3
+    # The first copy is the same as a run that makes a single copy.
+    assert variants[0] == pathlib.Path(f"{tmp_path}/single.yml").read_text()
+
+
+def test_spelling_error_variants_independent_of_workers():
+    from taipo.typos import KeyboardTypos
+    from taipo.cli.keyboard import spelling_error_variants
+
+    dataf = nlu_path_to_dataframe("data/nlu-entities.yml")
+    outputs = []
+    for workers in [1, 2]:
+        variants = spelling_error_variants(
+            dataf, aug=KeyboardTypos(), n_variants=2, workers=workers, seed=1
+        )
+        outputs.append([list(v["text"]) for v in variants])
+    assert outputs[0] == outputs[1]
+    assert outputs[0][0] != outputs[0][1]
+
+
+@pytest.mark.parametrize("command", ["augment", "generate"])
+def test_keyboard_cache_needs_seed(tmp_path, command):
+    """Without a seed the typos are random, so there is nothing to cache."""
+    cmd = ["keyboard", command, "data/nlu-entities.yml"]
+    if command == "augment":
+        cmd.append(f"{tmp_path}/nlu.yml")
+    res = runner.invoke(app, cmd + ["--cache", f"{tmp_path}/cache.db"])
+    assert res.exit_code == 1
+    assert "--seed-aug" in res.stdout
+    assert not (tmp_path / "cache.db").exists()
+
+
+def test_keyboard_augment_cache(tmp_path):
+    """A second run with the cache gives the same file and only misses on edits."""
+    cmd = ["keyboard", "augment", "data/nlu-entities.yml", f"{tmp_path}/first.yml"]
+    cache = ["--seed-aug", "42", "--cache", f"{tmp_path}/cache.db"]
+    n_examples = nlu_path_to_dataframe("data/nlu-entities.yml").shape[0]
+    res = runner.invoke(app, cmd + cache)
+    assert res.exit_code == 0
+    assert f"0 hits, {n_examples} misses" in res.stdout
+
+    cmd[-1] = f"{tmp_path}/second.yml"
+    res = runner.invoke(app, cmd + cache)
+    assert res.exit_code == 0
+    assert f"{n_examples} hits, 0 misses" in res.stdout
+    first = pathlib.Path(f"{tmp_path}/first.yml").read_text()
+    assert pathlib.Path(f"{tmp_path}/second.yml").read_text() == first
+
+    edited = (
+        pathlib.Path("data/nlu-entities.yml")
+        .read_text()
+        .replace("hey there", "hey there friend")
+    )
+    pathlib.Path(f"{tmp_path}/edited.yml").write_text(edited)
+    cmd[2:4] = [f"{tmp_path}/edited.yml", f"{tmp_path}/third.yml"]
+    res = runner.invoke(app, cmd + cache)
+    assert f"{n_examples - 1} hits, 1 misses" in res.stdout
+
+
+def test_keyboard_augment_folder_mirror(nlu_folder, tmp_path):
+    """A folder of files gives a folder with the same files and examples."""
+    cmd = ["keyboard", "augment", str(nlu_folder), f"{tmp_path}/out", "--mirror"]
+    res = runner.invoke(app, cmd + ["--engine", "native", "--workers", "2"])
+    assert res.exit_code == 0
+    for name in ["first.yml", "nested/second.yml"]:
+        df_in = nlu_path_to_dataframe(nlu_folder / name)
+        df_out = nlu_path_to_dataframe(tmp_path / "out" / name)
+        assert df_out.shape == df_in.shape
+        assert sorted(df_out["intent"]) == sorted(df_in["intent"])
+
+
+def test_keyboard_augment_glob_single_file(nlu_folder, tmp_path):
+    cmd = ["keyboard", "augment", f"{nlu_folder}/**/*.yml", f"{tmp_path}/nlu.yml"]
+    res = runner.invoke(app, cmd + ["--engine", "native"])
+    assert res.exit_code == 0
+    expected = nlu_path_to_dataframe(nlu_folder).shape[0]
+    assert nlu_path_to_dataframe(f"{tmp_path}/nlu.yml").shape[0] == expected
+
+
+def test_keyboard_augment_mirror_needs_folder(tmp_path):
+    cmd = ["keyboard", "augment", "tests/data/nlu/nlu.yml", f"{tmp_path}/out"]
+    res = runner.invoke(app, cmd + ["--mirror"])
+    assert res.exit_code == 1
+
+
+def test_keyboard_augment_parquet(tmp_path):
+    """Tables go in and out without a yaml file in between."""
+    pytest.importorskip("pyarrow")
+    cmd = ["util", "convert", "data/nlu-entities.yml", f"{tmp_path}/nlu.parquet"]
+    assert runner.invoke(app, cmd).exit_code == 0
+    cmd = ["keyboard", "augment", f"{tmp_path}/nlu.parquet", f"{tmp_path}/out.arrow"]
+    res = runner.invoke(app, cmd + ["--engine", "native", "--seed-aug", "42"])
+    assert res.exit_code == 0
+    df_in = nlu_path_to_dataframe(f"{tmp_path}/nlu.parquet")
+    df_out = nlu_path_to_dataframe(f"{tmp_path}/out.arrow")
+    assert list(df_out["intent"]) == list(df_in["intent"])
+    assert list(df_out["text"]) != list(df_in["text"])
@@ -0,0 +1,37 @@
+import pytest
+
+# The property tests need hypothesis, which only comes with the dev extra.
+hypothesis = pytest.importorskip("hypothesis")
+
+from hypothesis import given, strategies as st  # noqa: E402
+
+from taipo.cli.keyboard import (  # noqa: E402
+    chained_reverse_tokenizer,
+    custom_reverse_tokenizer,
+    custom_reverse_tokenizer_batch,
+)
+
+
+# Tokens made of the characters the detokenizer cares about, plus some whitespace.
+tokens = st.text(alphabet="ab[](){}<>.,:;?!%'\"` \n", max_size=4)
+token_lists = st.lists(tokens, max_size=8)
+clean_token_lists = st.lists(
+    st.text(alphabet="ab[](){}<>.,:;?!%'\"`", min_size=1, max_size=4), max_size=8
+)
+
+
+@given(token_lists)
+def test_reverse_tokenizer_matches_chain(toks):
+    assert custom_reverse_tokenizer(toks) == chained_reverse_tokenizer(toks)
+
+
+@given(st.lists(token_lists, max_size=5))
+def test_reverse_tokenizer_batch_matches_chain(lists):
+    expected = [chained_reverse_tokenizer(toks) for toks in lists]
+    assert custom_reverse_tokenizer_batch(lists) == expected
+
+
+@given(st.lists(clean_token_lists, max_size=5))
+def test_reverse_tokenizer_batch_single_scan_matches_chain(lists):
+    expected = [chained_reverse_tokenizer(toks) for toks in lists]
+    assert custom_reverse_tokenizer_batch(lists) == expected
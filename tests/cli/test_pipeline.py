@@ -0,0 +1,83 @@
+import pathlib
+
+import pytest
+import yaml
+from typer.testing import CliRunner
+
+from taipo.__main__ import app
+
+runner = CliRunner()
+
+FILES = [
+    "data/nlu-train.yml",
+    "test/nlu-valid.yml",
+    "data/typod-nlu-train.yml",
+    "test/typod-nlu-valid.yml",
+    "data/greek-nlu-train.yml",
+    "test/greek-nlu-valid.yml",
+]
+
+
+def read_and_remove(files):
+    """Reads the generated files and removes them again."""
+    contents = {}
+    for f in files:
+        contents[f] = pathlib.Path(f).read_text()
+        pathlib.Path(f).unlink()
+    return contents
+
+
+def write_config(tmp_path, augmenters):
+    config = {"file": "data/nlu-orig.yml", "seed_split": 42, "augmenters": augmenters}
+    path = tmp_path / "pipeline.yml"
+    path.write_text(yaml.safe_dump(config))
+    return str(path)
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_pipeline_matches_generate(tmp_path, workers):
+    """The pipeline writes the same files as the separate generate commands."""
+    for f in FILES:
+        if pathlib.Path(f).exists():
+            pathlib.Path(f).unlink()
+    keyboard = ["--prefix", "typod", "--engine", "native", "--seed-aug", "1"]
+    res = runner.invoke(app, ["keyboard", "generate", "data/nlu-orig.yml"] + keyboard)
+    assert res.exit_code == 0
+    res = runner.invoke(
+        app,
+        ["translit", "generate", "data/nlu-orig.yml", "--prefix", "greek"]
+        + ["--target", "el"],
+    )
+    assert res.exit_code == 0
+    expected = read_and_remove(FILES)
+
+    config = write_config(
+        tmp_path,
+        [
+            {"type": "keyboard", "prefix": "typod", "engine": "native", "seed_aug": 1},
+            {"type": "translit", "prefix": "greek", "target": "el"},
+        ],
+    )
+    res = runner.invoke(app, ["pipeline", config, "--workers", workers])
+    assert res.exit_code == 0
+    assert read_and_remove(FILES) == expected
+
+
+@pytest.mark.parametrize(
+    "augmenters",
+    [
+        [{"type": "foobar"}],
+        [{"type": "keyboard", "foobar": 1}],
+        [{"type": "keyboard", "engine": "foobar"}],
+        [{"type": "translit"}],
+        [{"type": "keyboard"}, {"type": "keyboard", "lang": "de"}],
+        [],
+    ],
+)
+def test_pipeline_invalid_config(tmp_path, augmenters):
+    """A config with a mistake is refused before any file is written."""
+    if pathlib.Path("data/nlu-train.yml").exists():
+        pathlib.Path("data/nlu-train.yml").unlink()
+    res = runner.invoke(app, ["pipeline", write_config(tmp_path, augmenters)])
+    assert res.exit_code == 1
+    assert not pathlib.Path("data/nlu-train.yml").exists()
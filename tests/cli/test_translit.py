@@ -1,11 +1,14 @@
 import pathlib
 import itertools as it
+import collections
 
 import pytest
+import pandas as pd
 from typer.testing import CliRunner
 
 from taipo.__main__ import app
 from taipo.common import nlu_path_to_dataframe
+from taipo.cli.translit import Translitor, add_transliteration
 
 runner = CliRunner()
 
@@ -99,3 +102,147 @@ def test_invalid_lang_settings(source, target, cmd):
     ]
     res = runner.invoke(app, cmd)
     assert res.exit_code != 0
+
+
+@pytest.mark.parametrize("reversed", [True, False])
+def test_translitor_keeps_many_entities(reversed):
+    """Entities should survive, also when there are more than ten of them."""
+    ents = [f"ent{i}" for i in range(12)] + ["proglang", "prog"]
+    tl = Translitor(lang="el", reversed=reversed, ents=ents)
+    text = "use [a](ent1) [b](ent10) [c](proglang) [d](prog) 1 10"
+    out = tl.translit(text)
+    assert "(ent1)" in out
+    assert "(ent10)" in out
+    assert "(proglang)" in out
+    assert "(prog)" in out
+    assert out.endswith(" 1 10")
+    assert tl.show_ents(tl.hide_ents(text)) == text
+
+
+def test_translit_augment_cache(tmp_path):
+    """A second run with the cache gives the same file without any misses."""
+    for name in ["first", "second"]:
+        cmd = [
+            "translit",
+            "augment",
+            "data/nlu-entities.yml",
+            f"{tmp_path}/{name}.yml",
+            "--target",
+            "ru",
+            "--cache",
+            f"{tmp_path}/cache.db",
+        ]
+        res = runner.invoke(app, cmd)
+        assert res.exit_code == 0
+    assert "0 misses" in res.stdout
+    first = pathlib.Path(f"{tmp_path}/first.yml").read_text()
+    assert pathlib.Path(f"{tmp_path}/second.yml").read_text() == first
+
+
+@pytest.mark.parametrize(
+    "lang,reversed",
+    list(
+        it.product(
+            ["ru", "mn", "sr", "bg", "ka", "uk", "el", "mk", "l1", "hy"], [True, False]
+        )
+    ),
+)
+def test_translit_many_matches_sentences(lang, reversed):
+    """Transliterating distinct words gives the same texts as whole sentences."""
+    texts = list(nlu_path_to_dataframe("data/nlu-entities.yml")["text"])
+    texts += ["  double  spaces ", "", "Σ ΣΑΣ σας", "tabs\tare\twords"]
+    if reversed:
+        texts = Translitor(lang=lang, reversed=False, ents=[]).translit_many(texts)
+    ents = ["proglang", "city"]
+    by_sentence = Translitor(lang=lang, reversed=reversed, ents=ents)
+    by_word = Translitor(
+        lang=lang, reversed=reversed, ents=ents, memo_size=20, chunk_size=7
+    )
+    assert by_word.by_word
+    assert by_word.translit_many(texts) == [by_sentence.translit(t) for t in texts]
+    assert len(by_word.memo) == 20
+    assert by_word.memo_hits > 0
+
+
+def test_translit_many_falls_back_on_spaced_entities():
+    tl = Translitor(lang="ru", reversed=False, ents=["new york"], memo_size=10)
+    assert not tl.by_word
+    assert tl.translit_many(["to [ny](new york)"]) == ["то [ны](new york)"]
+
+
+def test_translit_many_drops_least_recently_used():
+    tl = Translitor(lang="ru", reversed=False, ents=[], memo_size=2)
+    tl.translit_many(["privet mir"])
+    tl.translit_many(["privet"])
+    tl.translit_many(["da"])
+    assert list(tl.memo) == ["privet", "da"]
+
+
+def test_add_transliteration_counts_memo(capsys):
+    dataf = pd.DataFrame({"text": ["privet mir privet"], "intent": ["greet"]})
+    stats = collections.Counter()
+    add_transliteration(dataf, lang="ru", reversed=False, stats=stats)
+    assert stats == {"memo_hits": 1, "memo_misses": 2}
+    assert capsys.readouterr().out == ""
+
+
+def test_translit_augment_reports_memo(tmp_path):
+    cmd = [
+        "translit",
+        "augment",
+        "data/nlu-orig.yml",
+        f"{tmp_path}/nlu.yml",
+        "--target",
+        "ru",
+    ]
+    res = runner.invoke(app, cmd)
+    assert res.exit_code == 0
+    assert "memo hit rate" in res.stdout
+    res = runner.invoke(app, cmd + ["--memo-size", "0"])
+    assert "memo hit rate" not in res.stdout
+
+
+@pytest.mark.parametrize("reversed", [True, False])
+def test_translit_augment_fast_engine(tmp_path, monkeypatch, reversed):
+    """The fast engine writes the same file as the transliterate engine."""
+    monkeypatch.setenv("TAIPO_CACHE_DIR", str(tmp_path / "cache"))
+    src, direction = "data/nlu-entities.yml", ["--target", "ru"]
+    if reversed:
+        res = runner.invoke(
+            app, ["translit", "augment", src, f"{tmp_path}/ru.yml"] + direction
+        )
+        src, direction = f"{tmp_path}/ru.yml", ["--source", "ru"]
+    for engine in ["transliterate", "fast"]:
+        cmd = [
+            "translit",
+            "augment",
+            src,
+            f"{tmp_path}/{engine}.yml",
+            "--engine",
+            engine,
+        ]
+        res = runner.invoke(app, cmd + direction)
+        assert res.exit_code == 0
+    expected = pathlib.Path(f"{tmp_path}/transliterate.yml").read_text()
+    assert pathlib.Path(f"{tmp_path}/fast.yml").read_text() == expected
+    assert list((tmp_path / "cache" / "translit").iterdir())
+
+
+def test_translit_augment_unknown_engine(tmp_path):
+    cmd = ["translit", "augment", "tests/data/nlu/nlu.yml", f"{tmp_path}/nlu.yml"]
+    res = runner.invoke(app, cmd + ["--target", "ru", "--engine", "foobar"])
+    assert res.exit_code == 1
+    assert not pathlib.Path(f"{tmp_path}/nlu.yml").exists()
+
+
+def test_translit_augment_folder_mirror(nlu_folder, tmp_path):
+    """Every file of the folder is transliterated into the same place in `out`."""
+    cmd = ["translit", "augment", str(nlu_folder), f"{tmp_path}/out", "--mirror"]
+    res = runner.invoke(app, cmd + ["--target", "ru", "--workers", "2"])
+    assert res.exit_code == 0
+    for name in ["first.yml", "nested/second.yml"]:
+        single = ["translit", "augment", str(nlu_folder / name), f"{tmp_path}/one.yml"]
+        res = runner.invoke(app, single + ["--target", "ru"])
+        assert res.exit_code == 0
+        expected = pathlib.Path(f"{tmp_path}/one.yml").read_text()
+        assert (tmp_path / "out" / name).read_text() == expected
@@ -1,3 +1,4 @@
+import pytest
 from typer.testing import CliRunner
 
 import pandas as pd
@@ -77,3 +78,29 @@ def test_yml_csv_no_path():
         pd.read_csv(f"nlu.csv").shape[0]
         == pd.read_csv(f"tests/data/nlu/nlu.csv").shape[0]
     )
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".arrow"])
+def test_convert_both_ways(tmp_path, suffix):
+    """Converting to a table and back gives the same nlu file as rewriting it."""
+    pytest.importorskip("pyarrow")
+    cmd = ["util", "convert", "data/nlu-entities.yml", f"{tmp_path}/nlu{suffix}"]
+    assert runner.invoke(app, cmd).exit_code == 0
+    cmd = ["util", "convert", f"{tmp_path}/nlu{suffix}", f"{tmp_path}/back.yml"]
+    assert runner.invoke(app, cmd).exit_code == 0
+    cmd = ["util", "convert", "data/nlu-entities.yml", f"{tmp_path}/direct.yml"]
+    assert runner.invoke(app, cmd).exit_code == 0
+    expected = (tmp_path / "direct.yml").read_text()
+    assert (tmp_path / "back.yml").read_text() == expected
+
+
+def test_convert_csv_columns(tmp_path):
+    pytest.importorskip("pyarrow")
+    pd.DataFrame({"sentence": ["hi there"], "label": ["greet"]}).to_csv(
+        tmp_path / "in.csv", index=False
+    )
+    cmd = ["util", "convert", f"{tmp_path}/in.csv", f"{tmp_path}/nlu.parquet"]
+    res = runner.invoke(app, cmd + ["--text-col", "sentence", "--label-col", "label"])
+    assert res.exit_code == 0
+    df = nlu_path_to_dataframe(f"{tmp_path}/nlu.parquet")
+    assert df.to_dict("records") == [{"intent": "greet", "text": "hi there"}]
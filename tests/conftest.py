@@ -0,0 +1,17 @@
+import shutil
+
+import pytest
+
+
+@pytest.fixture
+def nlu_folder(tmp_path):
+    """
+    A Rasa style data folder with two nlu files, one of them nested, next to a
+    stories file without any nlu data.
+    """
+    folder = tmp_path / "nlu-folder"
+    (folder / "nested").mkdir(parents=True)
+    shutil.copy("tests/data/nlu/nlu.yml", folder / "first.yml")
+    shutil.copy("data/nlu-entities.yml", folder / "nested" / "second.yml")
+    (folder / "stories.yml").write_text("version: '2.0'\nstories: []\n")
+    return folder
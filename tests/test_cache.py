@@ -0,0 +1,92 @@
+import pandas as pd
+
+from taipo.cache import AugmentationCache, cached_augment
+
+
+def test_cache_roundtrip(tmp_path):
+    with AugmentationCache(tmp_path / "cache.db") as cache:
+        key = cache.key("hello", "greet", config={"lang": "en"}, seed=42)
+        assert cache.get_many([key]) == {}
+        cache.put_many({key: "hwllo"})
+    with AugmentationCache(tmp_path / "cache.db") as cache:
+        assert cache.get_many([key]) == {key: "hwllo"}
+        assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_cache_key_depends_on_everything():
+    keys = {
+        AugmentationCache.key("hello", "greet", {"lang": "en"}, 42),
+        AugmentationCache.key("hello!", "greet", {"lang": "en"}, 42),
+        AugmentationCache.key("hello", "bye", {"lang": "en"}, 42),
+        AugmentationCache.key("hello", "greet", {"lang": "nl"}, 42),
+        AugmentationCache.key("hello", "greet", {"lang": "en"}, 43),
+        AugmentationCache.key("hello", "greet", {"lang": "en"}, 42, variant=1),
+    }
+    assert len(keys) == 6
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    path = tmp_path / "cache.db"
+    with AugmentationCache(path) as cache:
+        cache.put_many({"a": "1", "b": "2"})
+    with AugmentationCache(path) as cache:
+        cache.put_many({"c": "3"})
+    with AugmentationCache(path, max_entries=2) as cache:
+        # Using "a" makes "b" the least recently used example.
+        cache.get_many(["a"])
+    assert cache.evicted == 1
+    with AugmentationCache(path) as cache:
+        assert cache.get_many(["a", "b", "c"]) == {"a": "1", "c": "3"}
+
+
+def test_cache_evicts_by_size(tmp_path):
+    path = tmp_path / "cache.db"
+    with AugmentationCache(path) as cache:
+        cache.put_many({"a": "x" * 600_000})
+    with AugmentationCache(path, max_mb=1) as cache:
+        cache.put_many({"b": "x" * 600_000})
+    with AugmentationCache(path) as cache:
+        assert list(cache.get_many(["a", "b"])) == ["b"]
+
+
+def test_cached_augment_only_augments_missing(tmp_path):
+    calls = []
+
+    def shout(dataf):
+        calls.append(list(dataf["text"]))
+        return [dataf.assign(text=lambda d: d["text"].str.upper())]
+
+    dataf = pd.DataFrame({"text": ["hi", "bye"], "intent": ["greet", "goodbye"]})
+    with AugmentationCache(tmp_path / "cache.db") as cache:
+        [first] = cached_augment(dataf, shout, cache, config={}, seed=1)
+        edited = dataf.assign(text=["hi", "ciao"])
+        [second] = cached_augment(edited, shout, cache, config={}, seed=1)
+    assert list(first["text"]) == ["HI", "BYE"]
+    assert list(second["text"]) == ["HI", "CIAO"]
+    assert calls == [["hi", "bye"], ["ciao"]]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_cached_augment_skips_cache_without_seed(tmp_path):
+    """Random typos without a seed are neither stored nor replayed."""
+    calls = []
+
+    def shout(dataf):
+        calls.append(list(dataf["text"]))
+        return [dataf.assign(text=lambda d: d["text"].str.upper())]
+
+    dataf = pd.DataFrame({"text": ["hi", "bye"], "intent": ["greet", "goodbye"]})
+    with AugmentationCache(tmp_path / "cache.db") as cache:
+        for _ in range(2):
+            [result] = cached_augment(dataf, shout, cache, config={}, seed=None)
+            assert list(result["text"]) == ["HI", "BYE"]
+        assert calls == [["hi", "bye"], ["hi", "bye"]]
+        assert (cache.hits, cache.misses) == (0, 0)
+
+        # Augmenters that always give the same examples still use the cache.
+        for _ in range(2):
+            cached_augment(
+                dataf, shout, cache, config={}, seed=None, deterministic=True
+            )
+        assert len(calls) == 3
+        assert (cache.hits, cache.misses) == (2, 2)
@@ -1,12 +1,24 @@
+import yaml
 import pytest
 import pandas as pd
 
 from taipo.common import (
     nlu_path_to_dataframe,
+    iter_nlu_examples,
     dataframe_to_nlu_file,
     entity_names,
     replace_ent_assignment,
     curly_entity_items,
+    scan_entities,
+    EntitySpan,
+    trie_regex,
+    BackgroundWriter,
+    nlu_sources,
+    dataframe_to_nlu_files,
+    read_nlu_table,
+    parse_entities,
+    add_entity_markup,
+    iter_nlu_sections,
 )
 
 
@@ -27,6 +39,55 @@ def test_yaml_both_ways(tmp_path):
     assert len(df_read) == 3
 
 
+@pytest.mark.parametrize(
+    "text",
+    [
+        "plain text",
+        "[python](proglang) first",
+        "what's up?",
+        "yes",
+        "2021",
+        " leading space",
+        "key: value",
+        "- dash",
+        "-dash",
+        "#hashtag and a # comment",
+        "ünïcödé ✓",
+        "tab\there",
+        "line\nbreak",
+        "foo\u2028bar",
+        "\u2029",
+        "",
+        "'" * 600,
+        "word " * 300,
+    ],
+)
+def test_nlu_file_matches_yaml_dump(tmp_path, text):
+    """
+    The streaming writer should write exactly what a single `yaml.dump` would.
+    """
+    df = pd.DataFrame([{"text": text, "intent": "a"}, {"text": "ok", "intent": "b"}])
+    expected = (
+        yaml.dump(
+            {
+                "version": "2.0",
+                "nlu": [
+                    {"intent": "a", "examples": [text]},
+                    {"intent": "b", "examples": ["ok"]},
+                ],
+            },
+            sort_keys=False,
+            width=1000,
+            allow_unicode=True,
+        )
+        .replace("examples:", "examples: |")
+        .replace("  -", "   -")
+    )
+    path = tmp_path / "nlu.yml"
+    dataframe_to_nlu_file(df, write_path=path)
+    assert path.read_text(encoding="utf-8") == expected
+
+
 def test_nlu_path_to_dataframe():
     """
     Test that nlu_path_to_dataframe works with no errors.
@@ -35,6 +96,45 @@ def test_nlu_path_to_dataframe():
     assert len(df_read) == 8
 
 
+def test_iter_nlu_examples():
+    """
+    Test that the generator yields the same records as the dataframe.
+    """
+    examples = list(iter_nlu_examples("tests/data/nlu/nlu.yml"))
+    df_read = nlu_path_to_dataframe("tests/data/nlu/nlu.yml")
+    assert examples == list(zip(df_read["text"], df_read["intent"]))
+    assert examples[0] == ("are you a bot?", "bot_challenge")
+
+
+def test_iter_nlu_examples_skips_nested(tmp_path):
+    """
+    Nested metadata and non-intent items should not end up as examples.
+    """
+    path = tmp_path / "nlu.yml"
+    path.write_text(
+        """version: "2.0"
+nlu:
+- intent: greet
+  metadata:
+    sentiment: neutral
+  examples: |
+    - hello
+    - hi
+- lookup: city
+  examples: |
+    - berlin
+- intent: goodbye
+  examples: |
+    - bye
+"""
+    )
+    assert list(iter_nlu_examples(path)) == [
+        ("hello", "greet"),
+        ("hi", "greet"),
+        ("bye", "goodbye"),
+    ]
+
+
 @pytest.mark.parametrize(
     "going_in, going_out",
     [
@@ -48,6 +148,33 @@ def test_entity_names(going_in, going_out):
     assert entity_names([going_in]) == going_out
 
 
+@pytest.mark.parametrize(
+    "words, text, found",
+    [
+        (["java", "javascript"], "javascript and java", ["javascript", "java"]),
+        (["c#", "c++", "a.b"], "c# c++ axb a.b", ["c#", "c++", "a.b"]),
+        (["x", ""], "xx", ["x", "x"]),
+        ([], "anything", []),
+    ],
+)
+def test_trie_regex(words, text, found):
+    assert trie_regex(words).findall(text) == found
+
+
+def test_scan_entities():
+    text = "use [python](proglang) or [js]{entity:proglang} not [this]"
+    assert scan_entities(text) == [
+        EntitySpan(4, 22, "python", "proglang", None),
+        EntitySpan(26, 47, "js", None, "entity:proglang"),
+        EntitySpan(52, 58, "this", None, None),
+    ]
+    assert [text[s.start : s.end] for s in scan_entities(text)] == [
+        "[python](proglang)",
+        "[js]{entity:proglang}",
+        "[this]",
+    ]
+
+
 @pytest.mark.parametrize(
     "going_in, going_out",
     [
@@ -55,12 +182,24 @@ def test_entity_names(going_in, going_out):
         ("[python](proglang) and [r](proglang)", "python and r"),
         ("[python](proglang) and [pandas](package)", "python and pandas"),
         ("there be no entities", "there be no entities"),
+        ("[python]{entity:proglang} is [not] annotated", "python is [not] annotated"),
     ],
 )
 def test_replace_ent_assignment(going_in, going_out):
     assert replace_ent_assignment([going_in]) == [going_out]
 
 
+def test_replace_ent_assignment_series():
+    texts = pd.Series(
+        ["[python](proglang) and\n[r](proglang)", "[r](proglang)", ""],
+        index=[10, 5, 7],
+    )
+    out = replace_ent_assignment(texts)
+    assert list(out.index) == [10, 5, 7]
+    assert list(out) == ["python and\nr", "r", ""]
+    assert replace_ent_assignment(texts[1:]).to_dict() == {5: "r", 7: ""}
+
+
 @pytest.mark.parametrize(
     "going_in, going_out",
     [
@@ -79,3 +218,208 @@ def test_replace_ent_assignment(going_in, going_out):
 @pytest.mark.timeout(5)
 def test_curly_entity_items(going_in, going_out):
     assert set(curly_entity_items([going_in])) == set(going_out)
+
+
+def test_background_writer_matches_direct_writes(tmp_path):
+    """Files written in the background are the same as files written directly."""
+    df = nlu_path_to_dataframe("tests/data/nlu/nlu.yml")
+    with BackgroundWriter(max_pending=1) as writer:
+        for i in range(4):
+            writer.write(df.iloc[i:], write_path=tmp_path / f"bg-{i}.yml")
+    for i in range(4):
+        dataframe_to_nlu_file(df.iloc[i:], write_path=tmp_path / f"direct-{i}.yml")
+        direct = (tmp_path / f"direct-{i}.yml").read_text()
+        assert (tmp_path / f"bg-{i}.yml").read_text() == direct
+
+
+def test_background_writer_raises_on_close(tmp_path):
+    df = nlu_path_to_dataframe("tests/data/nlu/nlu.yml")
+    writer = BackgroundWriter()
+    writer.write(df, write_path=tmp_path / "missing" / "nlu.yml")
+    writer.write(df, write_path=tmp_path / "nlu.yml")
+    with pytest.raises(FileNotFoundError):
+        writer.close()
+    assert (tmp_path / "nlu.yml").exists()
+
+
+def test_nlu_path_to_dataframe_folder(nlu_folder):
+    """A folder is read into one dataframe that knows where every example is from."""
+    df = nlu_path_to_dataframe(nlu_folder)
+    first = nlu_path_to_dataframe("tests/data/nlu/nlu.yml")
+    second = nlu_path_to_dataframe("data/nlu-entities.yml")
+    assert list(df.columns) == ["intent", "text", "source_file"]
+    assert "source_file" not in first.columns
+    assert list(df["text"]) == list(first["text"]) + list(second["text"])
+    assert set(df["source_file"]) == {"first.yml", "nested/second.yml"}
+    pd.testing.assert_frame_equal(nlu_path_to_dataframe(nlu_folder, workers=2), df)
+
+
+@pytest.mark.parametrize(
+    "pattern,folder,files",
+    [
+        ("*.yml", "", ["first.yml", "stories.yml"]),
+        ("**/*.yml", "", ["first.yml", "nested/second.yml", "stories.yml"]),
+        ("nested/*.yml", "nested", ["second.yml"]),
+    ],
+)
+def test_nlu_sources_glob(nlu_folder, pattern, folder, files):
+    """Files of a glob are relative to the part of the pattern without wildcards."""
+    root, found = nlu_sources(f"{nlu_folder}/{pattern}")
+    assert root == nlu_folder / folder
+    assert [f.relative_to(root).as_posix() for f in found] == files
+
+
+def test_nlu_sources_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        nlu_sources(f"{tmp_path}/*.yml")
+
+
+def test_dataframe_to_nlu_files_mirrors_folder(nlu_folder, tmp_path):
+    """Writing a folder back gives the same files as writing every file on its own."""
+    df = nlu_path_to_dataframe(nlu_folder)
+    dataframe_to_nlu_files(df, write_path=tmp_path / "out", workers=2)
+    for name in ["first.yml", "nested/second.yml"]:
+        dataframe_to_nlu_file(
+            nlu_path_to_dataframe(nlu_folder / name), write_path=tmp_path / "direct.yml"
+        )
+        expected = (tmp_path / "direct.yml").read_text()
+        assert (tmp_path / "out" / name).read_text() == expected
+    assert not (tmp_path / "out" / "stories.yml").exists()
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".arrow", ".feather"])
+def test_nlu_table_both_ways(tmp_path, nlu_folder, suffix):
+    """Columnar files keep the order, the exact texts and the source files."""
+    pytest.importorskip("pyarrow")
+    df = nlu_path_to_dataframe(nlu_folder)
+    df.loc[0, "text"] = 'it\'s "quoted" [New York](city): yes'
+    path = tmp_path / f"nlu{suffix}"
+    dataframe_to_nlu_file(df, write_path=path)
+    pd.testing.assert_frame_equal(nlu_path_to_dataframe(path), df)
+    pd.testing.assert_frame_equal(nlu_path_to_dataframe(f"{tmp_path}/*{suffix}"), df)
+
+
+def test_read_nlu_table_needs_columns(tmp_path):
+    pytest.importorskip("pyarrow")
+    pd.DataFrame({"sentence": ["hi"], "intent": ["greet"]}).to_parquet(
+        tmp_path / "nlu.parquet"
+    )
+    with pytest.raises(ValueError):
+        read_nlu_table(tmp_path / "nlu.parquet")
+
+
+def test_parse_entities_both_ways():
+    df = nlu_path_to_dataframe("data/nlu-entities.yml")
+    clean, spans = parse_entities(df["text"])
+    assert list(clean) == replace_ent_assignment(list(df["text"]))
+    assert add_entity_markup(clean, spans).equals(df["text"])
+    for span in spans.itertuples():
+        assert clean[span.example][span.start : span.end] == span.text
+
+
+def test_parse_entities_fields():
+    texts = [
+        'fly from [Berlin]{"entity": "city", "role": "from", "value": "BER"}',
+        "i like [py](proglang:python) and [pandas](pkg)",
+        "no entities [here]",
+    ]
+    clean, spans = parse_entities(texts)
+    assert clean == ["fly from Berlin", "i like py and pandas", "no entities [here]"]
+    assert list(spans["example"]) == [0, 1, 1]
+    assert spans.loc[0, ["entity", "role", "value"]].tolist() == ["city", "from", "BER"]
+    assert spans.loc[1, ["entity", "value"]].tolist() == ["proglang", "python"]
+    assert pd.isna(spans.loc[2, "value"])
+
+
+def test_add_entity_markup_without_markup():
+    spans = pd.DataFrame(
+        [
+            {"example": 0, "start": 10, "end": 15, "entity": "city", "role": "to"},
+            {"example": 1, "start": 0, "end": 5, "entity": "city", "value": "Paris"},
+        ]
+    )
+    out = add_entity_markup(["i fly to Paris", "paris"], spans.assign(start=[9, 0]))
+    assert out == [
+        'i fly to [Paris]{"entity": "city", "role": "to"}',
+        "[paris](city:Paris)",
+    ]
+
+
+def test_nlu_file_with_entity_spans(tmp_path):
+    df, spans = nlu_path_to_dataframe("data/nlu-entities.yml", entities=True)
+    assert list(df["clean_text"]) == replace_ent_assignment(list(df["text"]))
+    dataframe_to_nlu_file(df, write_path=tmp_path / "direct.yml")
+    dataframe_to_nlu_file(
+        df, write_path=tmp_path / "spans.yml", text_col="clean_text", spans=spans
+    )
+    direct = (tmp_path / "direct.yml").read_text()
+    assert (tmp_path / "spans.yml").read_text() == direct
+
+
+NLU_WITH_SECTIONS = """version: "3.1"
+nlu:
+  - intent: greet
+    examples: |
+      - hey
+      - hello
+  - lookup: city  # big cities only
+    examples: |
+      - Berlin
+      - Paris
+
+  - synonym: credit
+    examples: |
+      - credit card account
+  - {regex: zipcode, examples: "- \\\\d{5}\\n"}
+  -   regex: account
+      examples: |
+        - \\d{10,12}
+responses:
+  utter_greet:
+  - text: hi
+"""
+
+
+def test_iter_nlu_sections(tmp_path):
+    path = tmp_path / "nlu.yml"
+    path.write_text(NLU_WITH_SECTIONS)
+    blocks = list(iter_nlu_sections(path))
+    assert blocks[0] == "- lookup: city  # big cities only\n  examples: |\n" + (
+        "    - Berlin\n    - Paris\n"
+    )
+    assert blocks[3] == "- regex: account\n  examples: |\n    - \\d{10,12}\n"
+    assert [yaml.safe_load(b)[0] for b in blocks] == yaml.safe_load(path.read_text())[
+        "nlu"
+    ][1:]
+    assert list(iter_nlu_sections("data/nlu-entities.yml")) == []
+
+
+def test_nlu_file_keeps_sections(tmp_path):
+    path = tmp_path / "nlu.yml"
+    path.write_text(NLU_WITH_SECTIONS)
+    df = nlu_path_to_dataframe(path)
+    dataframe_to_nlu_file(df, write_path=tmp_path / "out.yml", sections_from=path)
+    written = yaml.safe_load((tmp_path / "out.yml").read_text())["nlu"]
+    assert written == yaml.safe_load(path.read_text())["nlu"]
+    pd.testing.assert_frame_equal(nlu_path_to_dataframe(tmp_path / "out.yml"), df)
+
+    dataframe_to_nlu_file(
+        df.iloc[:0], write_path=tmp_path / "none.yml", sections_from=path
+    )
+    assert yaml.safe_load((tmp_path / "none.yml").read_text())["nlu"] == written[1:]
+
+
+def test_nlu_files_keep_sections(nlu_folder, tmp_path):
+    """Sections stay in their own file, files with only sections are copied too."""
+    (nlu_folder / "nested" / "lookups.yml").write_text(
+        "nlu:\n- lookup: city\n  examples: |\n    - Berlin\n"
+    )
+    df = nlu_path_to_dataframe(nlu_folder)
+    dataframe_to_nlu_files(df, write_path=tmp_path / "out", sections_from=nlu_folder)
+    for name in ["first.yml", "nested/second.yml", "nested/lookups.yml"]:
+        expected = yaml.safe_load((nlu_folder / name).read_text())["nlu"]
+        written = yaml.safe_load((tmp_path / "out" / name).read_text())["nlu"]
+        assert [i for i in written if "intent" not in i] == [
+            i for i in expected if "intent" not in i
+        ]
+    assert not (tmp_path / "out" / "stories.yml").exists()
@@ -0,0 +1,50 @@
+import itertools as it
+
+import pytest
+from transliterate import get_translit_function
+
+from taipo.common import nlu_path_to_dataframe
+from taipo.fast_translit import FastTranslit, compile_steps
+
+LANGS = ["ru", "mn", "sr", "bg", "ka", "uk", "el", "mk", "l1", "hy"]
+
+
+@pytest.mark.parametrize("lang,reversed", list(it.product(LANGS, [True, False])))
+def test_fast_translit_matches_transliterate(tmp_path, lang, reversed):
+    """The compiled tables give the same texts as the language pack."""
+    translit = get_translit_function(lang)
+    texts = list(nlu_path_to_dataframe("data/nlu-orig.yml")["text"])
+    texts += ["", "Σ ΣΑΣ σας", "Shchuka JA ja zh ch ts"]
+    if reversed:
+        texts = [translit(t) for t in texts]
+    fast = FastTranslit.load(lang, reversed, folder=tmp_path)
+    assert [fast(t) for t in texts] == [translit(t, reversed=reversed) for t in texts]
+
+
+def test_fast_translit_stores_tables(tmp_path):
+    """The first load writes the compiled tables, the second one reads them."""
+    first = FastTranslit.load("ru", reversed=True, folder=tmp_path)
+    [path] = tmp_path.glob("ru-reversed-*.json")
+    second = FastTranslit.load("ru", reversed=True, folder=tmp_path)
+    assert second.steps == [tuple(step) for step in first.steps]
+    assert second("privet") == first("privet")
+    assert path.exists()
+
+
+def test_fast_translit_checks_direction(tmp_path):
+    fast = FastTranslit.load("el", reversed=False, folder=tmp_path)
+    with pytest.raises(ValueError):
+        fast("hello", reversed=True)
+
+
+def test_compile_steps_merges_tables():
+    steps = [
+        ("replace", "sh", "ш"),
+        ("replace", "h", "х"),
+        ("table", {"s": "с", "x": "кс"}),
+        ("replace", "a", "а"),
+    ]
+    assert compile_steps(steps) == [
+        ("replaces", [["sh", "ш"]]),
+        ("table", {"h": "х", "s": "с", "x": "кс", "a": "а"}),
+    ]
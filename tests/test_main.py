@@ -0,0 +1,50 @@
+import sys
+import subprocess
+
+import pytest
+
+
+HEAVY_MODULES = ["tensorflow", "rasa", "sklearn", "nlpaug", "transliterate"]
+IMPORT_BUDGET_SECONDS = 3.0
+
+
+def import_times(*args):
+    """
+    Runs `python -X importtime -m taipo *args` and returns the names of all
+    imported modules together with the total import time in seconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "taipo", *args],
+        capture_output=True,
+        text=True,
+    )
+    assert proc.returncode == 0, proc.stderr
+    modules, total = set(), 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.add(name.strip())
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return modules, total / 1e6
+
+
+@pytest.mark.parametrize(
+    "subcommand", ["keyboard", "translit", "confirm", "pipeline", "util"]
+)
+def test_subcommand_help_skips_heavy_imports(subcommand):
+    """
+    Showing the help of a subcommand should not import any of the heavy libraries
+    that are only needed once a command actually runs.
+    """
+    modules, seconds = import_times(subcommand, "--help")
+    for module in HEAVY_MODULES:
+        assert module not in modules
+    assert seconds < IMPORT_BUDGET_SECONDS
+
+
+def test_main_help_imports_no_subcommands():
+    """Listing the subcommands should not import any of them."""
+    modules, _ = import_times("--help")
+    assert not [m for m in modules if m.startswith("taipo.cli.")]
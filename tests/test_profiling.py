@@ -0,0 +1,83 @@
+import json
+
+from typer.testing import CliRunner
+
+from taipo.__main__ import app
+from taipo import profiling
+from taipo.profiling import Profiler
+
+
+runner = CliRunner()
+
+
+def test_stages_are_summed():
+    profiler = Profiler()
+    with profiler.stage("load", rows=5):
+        pass
+    profiler.enable()
+    for rows in [3, 4]:
+        with profiler.stage("write", rows=rows):
+            pass
+    with profiler.stage("load") as stage:
+        with profiler.stage("load", rows=100):
+            pass
+        stage.rows = 2
+    report = profiler.report()
+    assert list(report["stages"]) == ["load", "write"]
+    assert report["stages"]["write"]["calls"] == 2
+    assert report["stages"]["write"]["rows"] == 7
+    # The nested stage with the same name is part of the outer one.
+    assert report["stages"]["load"]["calls"] == 1
+    assert report["stages"]["load"]["rows"] == 2
+    assert report["stages"]["load"]["peak_rss_growth_mb"] >= 0
+    assert report["total"]["peak_rss_mb"] > 0
+
+
+def test_stage_reports_memory_growth(monkeypatch):
+    """A stage only gets the memory that the process peak grew by while it ran."""
+    peaks = iter([100.0, 100.0, 100.0, 180.0, 180.0, 200.0, 200.0])
+    monkeypatch.setattr(profiling, "peak_rss_mb", lambda: next(peaks))
+    profiler = Profiler()
+    profiler.enable()
+    with profiler.stage("load"):
+        pass
+    for _ in range(2):
+        with profiler.stage("augment"):
+            pass
+    stages = profiler.report()["stages"]
+    assert stages["load"]["peak_rss_growth_mb"] == 0
+    assert stages["augment"]["peak_rss_growth_mb"] == 80
+
+
+def test_stage_is_counted_on_errors():
+    profiler = Profiler()
+    profiler.enable()
+    try:
+        with profiler.stage("augment"):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert profiler.report()["stages"]["augment"]["calls"] == 1
+
+
+def test_profile_option(tmp_path):
+    """The global option prints the stages and writes them to json and pstats."""
+    json_path, stats_path = tmp_path / "profile.json", tmp_path / "profile.pstats"
+    cmd = [
+        "--profile",
+        "--profile-json",
+        str(json_path),
+        "--profile-stats",
+        str(stats_path),
+        "util",
+        "convert",
+        "tests/data/nlu/nlu.yml",
+        str(tmp_path / "nlu.yml"),
+    ]
+    result = runner.invoke(app, cmd)
+    assert result.exit_code == 0
+    assert "taipo profile" in result.output
+    report = json.loads(json_path.read_text())
+    assert list(report["stages"]) == ["load", "serialize", "write"]
+    assert report["stages"]["load"]["rows"] == report["stages"]["write"]["rows"]
+    assert stats_path.stat().st_size > 0
@@ -0,0 +1,150 @@
+import random
+
+import pytest
+import pandas as pd
+
+from taipo.suggestions import (
+    SuggestionWriter,
+    suggestion_fields,
+    suggestion_rows,
+    data_fingerprint,
+)
+
+
+INTENTS = ["greet", "goodbye", "talk_code", "out_of_scope"]
+
+
+@pytest.fixture
+def predictions():
+    """Made up predictions with rankings for 1000 examples, with a few ties."""
+    rng = random.Random(42)
+    columns = {
+        "text": [f"example, number\n{i}" for i in range(1000)],
+        "intent": rng.choices(INTENTS, k=1000),
+    }
+    preds = []
+    for _ in range(1000):
+        scores = sorted(
+            ((name, round(rng.random(), 2)) for name in INTENTS),
+            key=lambda r: -r[1],
+        )
+        preds.append(
+            {"name": scores[0][0], "confidence": scores[0][1], "ranking": scores}
+        )
+    return columns, preds
+
+
+def write_suggestions(
+    path, columns, preds, chunk_size, batch_size=64, stop=None, config=None
+):
+    config = config or {"n_examples": len(preds)}
+    with SuggestionWriter(path, suggestion_fields(3), config, chunk_size) as writer:
+        for start in range(writer.done, len(preds), batch_size):
+            if stop is not None and start >= stop:
+                raise KeyboardInterrupt()
+            batch = preds[start : start + batch_size]
+            writer.add(suggestion_rows(columns, start, batch, top_k=3), len(batch))
+
+
+def test_suggestion_rows():
+    columns = {"text": ["hi", "bye"], "intent": ["greet", "greet"]}
+    preds = [
+        {"name": "greet", "confidence": 0.9, "ranking": [("greet", 0.9)]},
+        {"name": "goodbye", "confidence": 0.6, "ranking": [("goodbye", 0.6)]},
+    ]
+    rows = list(suggestion_rows(columns, 0, preds, top_k=3))
+    assert rows == [
+        {
+            "example": 1,
+            "text": "bye",
+            "intent": "greet",
+            "pred_intent": "goodbye",
+            "confidence": 0.6,
+            "pred_intent_2": None,
+            "confidence_2": None,
+            "pred_intent_3": None,
+            "confidence_3": None,
+        }
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 10_000])
+def test_writer_sorts_by_confidence(tmp_path, predictions, chunk_size):
+    """The merged runs are the same as sorting all the suggestions at once."""
+    columns, preds = predictions
+    write_suggestions(tmp_path / "out.csv", columns, preds, chunk_size)
+    expected = (
+        pd.DataFrame(suggestion_rows(columns, 0, preds, top_k=3))
+        .sort_values(["confidence", "example"], ascending=[False, True])
+        .drop(columns="example")
+        .reset_index(drop=True)
+    )
+    df = pd.read_csv(tmp_path / "out.csv")
+    assert list(df.columns) == suggestion_fields(3)
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+    assert (df["intent"] != df["pred_intent"]).all()
+    assert (df["confidence"] >= df["confidence_2"]).all()
+    assert not (tmp_path / "out.csv.parts").exists()
+
+
+def test_writer_resumes_after_a_crash(tmp_path, predictions):
+    columns, preds = predictions
+    write_suggestions(tmp_path / "once.csv", columns, preds, chunk_size=100)
+    with pytest.raises(KeyboardInterrupt):
+        write_suggestions(
+            tmp_path / "out.csv", columns, preds, chunk_size=100, stop=500
+        )
+    assert (tmp_path / "out.csv.parts" / "checkpoint.json").exists()
+    assert not (tmp_path / "out.csv").exists()
+
+    writer = SuggestionWriter(
+        tmp_path / "out.csv", suggestion_fields(3), {"n_examples": 1000}, 100
+    )
+    # Batches of 64 examples are checkpointed every two batches.
+    assert writer.done == 512
+    write_suggestions(tmp_path / "out.csv", columns, preds, chunk_size=100)
+    assert (tmp_path / "out.csv").read_text() == (tmp_path / "once.csv").read_text()
+
+
+def test_writer_starts_over_for_another_config(tmp_path, predictions):
+    columns, preds = predictions
+    with pytest.raises(KeyboardInterrupt):
+        write_suggestions(
+            tmp_path / "out.csv", columns, preds, chunk_size=100, stop=500
+        )
+    writer = SuggestionWriter(
+        tmp_path / "out.csv", suggestion_fields(3), {"n_examples": 5}
+    )
+    assert writer.done == 0
+    assert list((tmp_path / "out.csv.parts").iterdir()) == []
+
+
+def test_data_fingerprint():
+    texts, intents = ["hi", "bye"], ["greet", "goodbye"]
+    assert data_fingerprint(texts, intents) == data_fingerprint(list(texts), intents)
+    assert data_fingerprint(texts, intents) != data_fingerprint(["hi", "bye!"], intents)
+    assert data_fingerprint(texts, intents) != data_fingerprint(texts, ["greet"] * 2)
+    assert data_fingerprint(["a", "b"], ["c"]) != data_fingerprint(["a"], ["b", "c"])
+
+
+def test_writer_starts_over_for_other_examples(tmp_path, predictions):
+    """A checkpoint made for other texts or intents is not continued."""
+    columns, preds = predictions
+
+    def config(columns):
+        fingerprint = data_fingerprint(columns["text"], columns["intent"])
+        return {"n_examples": len(preds), "data": fingerprint}
+
+    with pytest.raises(KeyboardInterrupt):
+        write_suggestions(
+            tmp_path / "out.csv", columns, preds, 100, stop=500, config=config(columns)
+        )
+    path, fields = tmp_path / "out.csv", suggestion_fields(3)
+    assert SuggestionWriter(path, fields, config(columns)).done == 512
+    edited = {**columns, "text": ["edited", *columns["text"][1:]]}
+    assert SuggestionWriter(path, fields, config(edited)).done == 0
+
+    with pytest.raises(KeyboardInterrupt):
+        write_suggestions(path, columns, preds, 100, stop=500, config=config(columns))
+    relabeled = {**columns, "intent": ["greet"] * len(preds)}
+    assert SuggestionWriter(path, fields, config(relabeled)).done == 0
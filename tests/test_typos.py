@@ -0,0 +1,100 @@
+import pickle
+
+import pytest
+import numpy as np
+
+from taipo.common import nlu_path_to_dataframe
+from taipo.typos import KeyboardTypos, keyboard_table, keyboard_languages
+
+
+@pytest.fixture
+def texts():
+    return list(nlu_path_to_dataframe("data/nlu-entities.yml")["text"])
+
+
+@pytest.mark.parametrize("lang", keyboard_languages())
+def test_keyboard_table_only_has_letters(lang):
+    counts, neighbours = keyboard_table(lang)
+    for key in np.flatnonzero(counts):
+        assert chr(key).isalpha()
+        assert all(chr(c).isalpha() for c in neighbours[key, : counts[key]])
+        assert key not in neighbours[key, : counts[key]]
+
+
+def test_keyboard_table_unknown_lang():
+    with pytest.raises(ValueError):
+        keyboard_table("klingon")
+
+
+def test_augment_only_swaps_neighbours(texts):
+    """Every change is a single letter replaced by one of its keyboard neighbours."""
+    counts, neighbours = keyboard_table("en")
+    np.random.seed(0)
+    augmented = KeyboardTypos(aug_char_max=2, aug_word_max=2).augment(texts)
+    assert augmented != texts
+    for before, after in zip(texts, augmented):
+        assert len(before) == len(after)
+        changed = [(a, b) for a, b in zip(before, after) if a != b]
+        assert len(changed) <= 4
+        for a, b in changed:
+            assert ord(b) in neighbours[ord(a), : counts[ord(a)]]
+
+
+def test_augment_respects_stopwords_and_min_char():
+    aug = KeyboardTypos(
+        aug_word_p=1.0, aug_word_max=100, stopwords=["python", "proglang"]
+    )
+    texts = ["i want to learn [python](proglang) today", "python pythonic python"] * 50
+    for before, after in zip(texts, aug.augment(texts)):
+        words_before, words_after = before.split(" "), after.split(" ")
+        # Only the words that are long enough and not a stopword can change.
+        for word_before, word_after in zip(words_before, words_after):
+            if len(word_before) < 4 or word_before == "python":
+                assert word_before == word_after
+        assert before != after
+
+
+def test_augment_leaves_annotation_markup():
+    """Keys, roles and values of Rasa annotations never get typos."""
+    aug = KeyboardTypos(aug_word_p=1.0, aug_word_max=100, aug_char_p=1.0)
+    markup = ['{"entity": "location", "role": "departure"}', "(city:paris)"]
+    texts = [f"flying from [Berlin]{markup[0]} towards [Paris]{markup[1]}"] * 50
+    for before, after in zip(texts, aug.augment(texts)):
+        assert before != after
+        for part in markup:
+            assert part in after
+        assert len(after) == len(before)
+
+
+def test_augment_leaves_protected_words():
+    aug = KeyboardTypos(aug_word_p=1.0, aug_word_max=100)
+    texts = ["going to New York tomorrow", "learning python today"] * 50
+    protect = [[(9, 17)], [(9, 15)]] * 50
+    for before, after in zip(texts, aug.augment(texts, protect=protect)):
+        words_before, words_after = before.split(" "), after.split(" ")
+        for word in ["New", "York", "python"]:
+            assert (word in words_before) == (word in words_after)
+        assert before != after
+
+
+def test_augment_is_reproducible(texts):
+    aug = KeyboardTypos()
+    np.random.seed(42)
+    first = aug.augment(texts)
+    np.random.seed(42)
+    assert aug.augment(texts) == first
+
+
+def test_augment_edge_cases():
+    aug = KeyboardTypos()
+    assert aug.augment([]) == []
+    assert aug.augment(["", "a b", "🙂🙂"]) == ["", "a b", "🙂🙂"]
+    assert len(aug.augment("hello there")) == len("hello there")
+    assert aug.augment(["line one\nline two"])[0].count("\n") == 1
+
+
+def test_augment_pickles_with_stopwords():
+    aug = KeyboardTypos(aug_word_p=1.0, stopwords=["python"])
+    clone = pickle.loads(pickle.dumps(aug))
+    assert clone.stopwords == ["python"]
+    assert clone.augment(["python"]) == ["python"]